@@ -0,0 +1,60 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Streaming benchmark measuring the per-item cost of async generator wrappers.
+
+Compares the raw implementation, a hand-written `async for y in ...: yield y` wrapper (the previous makefun body),
+and the delegating wrapper generated by `makefun.create_function`.
+
+    python benchmarks/bench_async_generators.py [n_items]
+
+Each measure is the best of several runs, to reduce noise.
+"""
+import asyncio
+import sys
+from time import perf_counter
+
+from makefun import create_function
+
+
+async def impl(n):
+    for i in range(n):
+        yield i
+
+
+async def async_for_wrapper(n):
+    async for y in impl(n):
+        yield y
+
+
+makefun_wrapper = create_function("makefun_wrapper(n)", impl)
+
+
+async def consume(gen_fun, n):
+    start = perf_counter()
+    async for _ in gen_fun(n):
+        pass
+    return perf_counter() - start
+
+
+async def best_of(gen_fun, n, repeat=5):
+    return min([await consume(gen_fun, n) for _ in range(repeat)])
+
+
+async def main(n):
+    print("Consuming %s items per async generator" % n)
+    ref = None
+    for name, gen_fun in (("raw impl", impl),
+                          ("async for re-yield", async_for_wrapper),
+                          ("makefun wrapper", makefun_wrapper)):
+        duration = await best_of(gen_fun, n)
+        per_item = duration / n * 1e9
+        if ref is None:
+            ref = per_item
+        print("%-20s %8.1f ns/item   (wrapper overhead: %6.1f ns/item)" % (name, per_item, per_item - ref))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000))
@@ -0,0 +1,42 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Benchmark comparing the time needed to apply a scalar function to columns of values with a python loop, and with the
+batched function created by `makefun.create_batched`.
+
+    python benchmarks/bench_batched.py [n_items]
+"""
+import sys
+from timeit import repeat
+
+from makefun import create_batched
+
+
+def convert(a, b, unit='m', factor=1):
+    return (a + b) * (1000 if unit == 'km' else 1) * factor
+
+
+def python_loop(a, b, unit):
+    res = []
+    for i in range(len(a)):
+        res.append(convert(a[i], b[i], unit=unit[i]))
+    return res
+
+
+def main(n):
+    a, b, unit = list(range(n)), list(range(n)), ['m', 'km'] * (n // 2)
+    convert_batch = create_batched(convert)
+    assert convert_batch(a, b, unit) == python_loop(a, b, unit)
+
+    print("Calling a scalar function on %s items (best of 5, ms)" % n)
+    for name, run in (("python loop", lambda: python_loop(a, b, unit)),
+                      ("list comprehension", lambda: [convert(*args) for args in zip(a, b, unit)]),
+                      ("create_batched", lambda: convert_batch(a, b, unit))):
+        duration = min(repeat(run, number=1, repeat=5))
+        print("%-20s %8.1f" % (name, duration * 1e3))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,67 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Benchmark measuring the execution time of loop-heavy functions using global and builtin symbols and small helper
+functions, compiled by `makefun.compile_fun_manually` with and without `optimize=True` and `inline`.
+
+    python benchmarks/bench_compile_fun_optimize.py [n_items]
+"""
+import math
+import sys
+from timeit import repeat
+
+from makefun.main import compile_fun_manually
+
+
+def scale(x):
+    return x * 2
+
+
+def loop_builtins(items):
+    total = 0
+    for item in items:
+        total += abs(item) + len(str(item)) + min(item, 10)
+    return total
+
+
+def loop_globals(items):
+    total = 0.0
+    for item in items:
+        total += math.sqrt(abs(item)) + scale(item)
+    return total
+
+
+def to_m(x):
+    return x * 0.001
+
+
+def clamp(v, lo=0.0, hi=1.0):
+    return max(lo, min(v, hi))
+
+
+def loop_helpers(items):
+    total = 0.0
+    for item in items:
+        total += clamp(to_m(item), hi=0.5) + to_m(item)
+    return total
+
+
+def main(n):
+    items = list(range(-n // 2, n // 2))
+    print("Calling loop-heavy functions on %s items (best of 5, ms)" % n)
+    for func in (loop_builtins, loop_globals, loop_helpers):
+        variants = [("compile_fun", dict()), ("compile_fun(optimize)", dict(optimize=True))]
+        if func is loop_helpers:
+            variants += [("compile_fun(inline)", dict(inline=('to_m', 'clamp'))),
+                         ("compile_fun(inline, optimize)", dict(inline=('to_m', 'clamp'), optimize=True))]
+        for name, options in variants:
+            f = compile_fun_manually(func, _evaldict=dict(globals()), **options)
+            assert f(items) == func(items)
+            duration = min(repeat(lambda: f(items), number=10, repeat=5)) / 10
+            print("%-15s %-30s %8.3f" % (func.__name__, name, duration * 1e3))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
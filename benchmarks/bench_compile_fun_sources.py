@@ -0,0 +1,57 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Benchmark comparing the time needed to get the sources of one function and of all functions of a module with
+`inspect.getsource`, that searches for each function block in the file, and with `makefun.compile_fun`, that uses
+`inspect.getsource` for isolated lookups and indexes the source file once it is used enough.
+
+    python benchmarks/bench_compile_fun_sources.py [n_functions]
+"""
+import os
+import sys
+import tempfile
+from importlib import import_module
+from inspect import getsource
+from time import perf_counter
+
+from makefun.main import _get_function_source, _source_index_cache, _source_lines_read
+
+
+FUNCTION_TEMPLATE = '''
+def func_%(i)s(a, b=%(i)s):
+    """A function with a docstring"""
+    c = [a, b]
+    for x in range(b):
+        c.append(x * a)
+    return c
+'''
+
+
+def main(n):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, "_bench_sources.py"), 'w') as f:
+            f.write(''.join(FUNCTION_TEMPLATE % dict(i=i) for i in range(n)))
+        sys.path.insert(0, tmp_dir)
+        try:
+            module = import_module("_bench_sources")
+        finally:
+            sys.path.remove(tmp_dir)
+        functions = [getattr(module, "func_%s" % i) for i in range(n)]
+
+        print("Getting the sources of the first function, then of all %s functions" % n)
+        for name, get_source in (("inspect.getsource", getsource), ("compile_fun", _get_function_source)):
+            for functions_subset in (functions[:1], functions):
+                _source_index_cache.clear()
+                _source_lines_read.clear()
+                start = perf_counter()
+                for func in functions_subset:
+                    get_source(func)
+                duration = perf_counter() - start
+                print("%-20s %6s functions: %8.1f ms   (%.1f us/function)"
+                      % (name, len(functions_subset), duration * 1e3, duration / len(functions_subset) * 1e6))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,66 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Benchmark comparing the time needed to compile all functions of a module with `makefun.compile_fun_manually`, one
+function at a time, and with `makefun.compile_module`.
+
+    python benchmarks/bench_compile_module.py [n_functions]
+"""
+import os
+import sys
+import tempfile
+from importlib import import_module
+from time import perf_counter
+
+from makefun import compile_module
+from makefun.main import compile_fun_manually, _source_index_cache
+
+
+FUNCTION_TEMPLATE = '''
+def func_%(i)s(a, b=%(i)s):
+    """A function with a docstring"""
+    c = [a, b]
+    for x in range(b):
+        c.append(x * a)
+    return c
+'''
+
+
+def main(n):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, "_bench_module.py"), 'w') as f:
+            f.write(''.join(FUNCTION_TEMPLATE % dict(i=i) for i in range(n)))
+        sys.path.insert(0, tmp_dir)
+        try:
+            module = import_module("_bench_module")
+        finally:
+            sys.path.remove(tmp_dir)
+
+        print("Compiling the %s functions of a module" % n)
+
+        _source_index_cache.clear()
+        start = perf_counter()
+        for i in range(n):
+            name = "func_%s" % i
+            setattr(module, name, compile_fun_manually(getattr(module, name), _evaldict=vars(module)))
+        duration = perf_counter() - start
+        print("%-25s %8.1f ms" % ("compile_fun_manually", duration * 1e3))
+
+        # restore the original functions, that compile_module requires
+        del sys.modules["_bench_module"]
+        sys.path.insert(0, tmp_dir)
+        try:
+            module = import_module("_bench_module")
+        finally:
+            sys.path.remove(tmp_dir)
+
+        start = perf_counter()
+        compile_module(module)
+        duration = perf_counter() - start
+        print("%-25s %8.1f ms" % ("compile_module", duration * 1e3))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
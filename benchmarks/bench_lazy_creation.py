@@ -0,0 +1,45 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Benchmark comparing wrappers created by `makefun.wraps` with and without `lazy=True`: creation time (paid at import
+time when used as a decorator), first call time (when the lazy wrappers are compiled) and steady-state call time.
+
+    python benchmarks/bench_lazy_creation.py [n_wrappers]
+"""
+import sys
+from time import perf_counter
+from timeit import repeat
+
+from makefun import wraps
+
+
+def foo(a, b=1, *args, c='hello', **kwargs):
+    return a
+
+
+def impl(*args, **kwargs):
+    return foo(*args, **kwargs)
+
+
+def main(n):
+    print("Creating and calling %s wrappers" % n)
+    for lazy in (False, True):
+        start = perf_counter()
+        wrappers = [wraps(foo, lazy=lazy)(impl) for _ in range(n)]
+        creation = perf_counter() - start
+
+        start = perf_counter()
+        for w in wrappers:
+            w(0)
+        first_call = perf_counter() - start
+
+        steady_state = min(repeat("f(0)", globals={'f': wrappers[0]}, number=100000, repeat=5)) / 100000
+
+        print("lazy=%-5s  creation: %6.1f us/wrapper   first call: %6.1f us/wrapper   next calls: %6.1f ns/call"
+              % (lazy, creation / n * 1e6, first_call / n * 1e6, steady_state * 1e9))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,43 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Benchmark comparing `makefun.memoize` with `functools.lru_cache`: hit rate and time per call, for calls passing the
+same arguments positionally, by keyword, or relying on default values.
+
+    python benchmarks/bench_memoize.py [n_calls]
+"""
+import sys
+from functools import lru_cache
+from timeit import repeat
+
+from makefun import memoize
+
+
+def compute(a, b=1, c=2):
+    return a * b + c
+
+
+CALL_STYLES = {
+    "positional": lambda f, i: f(i % 100, 1, 2),
+    "keywords": lambda f, i: f(i % 100, b=1, c=2),
+    "mixed": lambda f, i: (f(i % 100), f(i % 100, 1), f(i % 100, c=2), f(a=i % 100, b=1, c=2))[-1],
+}
+
+
+def main(n):
+    print("%s calls per style, 100 distinct argument values" % n)
+    for style, call in CALL_STYLES.items():
+        for name, decorator in (("lru_cache", lru_cache(maxsize=128)), ("memoize", memoize(maxsize=128))):
+            f = decorator(compute)
+            for i in range(n):
+                call(f, i)
+            info = f.cache_info()
+            hit_rate = info.hits / (info.hits + info.misses)
+            duration = min(repeat(lambda: [call(f, i) for i in range(n)], number=1, repeat=5))
+            print("%-10s %-10s hit rate %6.2f%%   %8.1f ms" % (style, name, hit_rate * 100, duration * 1e3))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
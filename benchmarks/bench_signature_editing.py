@@ -0,0 +1,62 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Benchmark comparing signature editing workloads (`add_signature_parameters`, `remove_signature_parameters`,
+`gen_partial_sig` and `create_function`) with `inspect.Signature` and with `makefun.CompactSignature`, for signatures
+of various sizes. Then measures the time needed to prepend long lists of parameters with a `makefun.SignatureBuilder`,
+that should be linear in the number of parameters.
+
+    python benchmarks/bench_signature_editing.py [n_repeats]
+"""
+import sys
+from inspect import Parameter, Signature
+from timeit import repeat
+
+from makefun import CompactSignature, SignatureBuilder, add_signature_parameters, remove_signature_parameters, \
+    create_function
+from makefun.main import gen_partial_sig
+
+
+def impl(*args, **kwargs):
+    return args, kwargs
+
+
+def edit(sig):
+    """A typical editing workload: add and remove parameters, and preset some of them"""
+    sig = add_signature_parameters(sig, first=('x', 'y'), last=Parameter('z', Parameter.KEYWORD_ONLY, default=0))
+    sig = remove_signature_parameters(sig, 'y', 'p0')
+    return gen_partial_sig(sig, (0,), dict(p1=1), impl)
+
+
+def edit_and_create(sig):
+    """The same workload, followed by the creation of a function with the new signature"""
+    return create_function(edit(sig), impl, func_name='foo')
+
+
+def main(n):
+    print("Editing signatures %s times" % n)
+    for n_params in (2, 10, 50):
+        sig = Signature([Parameter('p%s' % i, Parameter.POSITIONAL_OR_KEYWORD, default=i) for i in range(n_params)])
+        csig = CompactSignature.from_signature(sig)
+        for name, s in (("Signature", sig), ("CompactSignature", csig)):
+            g = {'edit': edit, 'edit_and_create': edit_and_create, 's': s}
+            edit_only = min(repeat("edit(s)", globals=g, number=n, repeat=5))
+            with_creation = min(repeat("edit_and_create(s)", globals=g, number=n, repeat=5))
+            print("%3s parameters, %-18s edit: %7.1f us   edit + create_function: %7.1f us"
+                  % (n_params, name + ':', edit_only / n * 1e6, with_creation / n * 1e6))
+
+    print("Prepending and removing parameters with a SignatureBuilder")
+    csig = CompactSignature([('a', Parameter.POSITIONAL_OR_KEYWORD)])
+    for n_params in (100, 1000, 10000):
+        names = ['p%s' % i for i in range(n_params)]
+        stmt = "SignatureBuilder(csig).prepend(*names).remove('a').build()"
+        duration = min(repeat(stmt, globals=dict(SignatureBuilder=SignatureBuilder, csig=csig, names=names),
+                              number=10, repeat=5)) / 10
+        print("%5s parameters: %8.1f us   (%.2f us/parameter)"
+              % (n_params, duration * 1e6, duration / n_params * 1e6))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,58 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Benchmark measuring the memory retained by the `__signature__` of wrappers created by `makefun.wraps` with
+`append_args`, for structurally identical functions, with and without `intern_signature=True`, and the time needed to
+compare these signatures.
+
+    python benchmarks/bench_signature_interning.py [n_wrappers]
+"""
+import gc
+import sys
+import tracemalloc
+from inspect import Parameter
+from timeit import repeat
+
+from makefun import wraps
+
+
+def make_handler():
+    def handler(request, user_id: int, page: int = 1, size: int = 20, sort: str = 'asc'):
+        return request
+    return handler
+
+
+def impl(*args, **kwargs):
+    pass
+
+
+# the parameter added to all handlers
+CONTEXT = Parameter('context', Parameter.KEYWORD_ONLY)
+
+
+def main(n):
+    print("Wrapping %s handlers with identical signatures" % n)
+    handlers = [make_handler() for _ in range(n)]
+    for intern_signature in (False, True):
+        gc.collect()
+        tracemalloc.start()
+        wrappers = [wraps(h, append_args=CONTEXT, intern_signature=intern_signature)(impl) for h in handlers]
+        gc.collect()
+        with_signature, _ = tracemalloc.get_traced_memory()
+        for w in wrappers:
+            del w.__signature__
+        gc.collect()
+        without_signature, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        wrappers = [wraps(h, append_args=CONTEXT, intern_signature=intern_signature)(impl) for h in handlers[:2]]
+        s1, s2 = wrappers[0].__signature__, wrappers[1].__signature__
+        eq = min(repeat("s1 == s2", globals=dict(s1=s1, s2=s2), number=10000, repeat=5)) / 10000
+        print("intern_signature=%-5s  %6.0f bytes/signature   equality check: %6.1f ns"
+              % (intern_signature, (with_signature - without_signature) / n, eq * 1e9))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,65 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Adversarial benchmark of the signature string parser used by `get_signature_from_string`.
+
+Compares the parser (a linear-time regular expression for well-formed signatures, falling back to a single-pass
+parser) with the regular expression that was used before (`FUNC_DEF`, copied below). For each family of inputs the
+size is multiplied by 10 at each step: the time of the parser should grow by ~10x too (linear bound), whatever the
+shape of the input. The old regular expression is only run on the smallest sizes for the
+families where it backtracks exponentially.
+
+    python benchmarks/bench_signature_parser.py
+"""
+import re
+from timeit import repeat
+
+from makefun.main import _parse_signature_string
+
+OLD_FUNC_DEF = re.compile(
+    '(?s)^\\s*(?P<funcname>[_\\w][_\\w\\d]*)?\\s*'
+    '\\(\\s*(?P<params>.*?)\\s*\\)\\s*'
+    '(((?P<typed_return_hint>->\\s*[^:]+)?(?P<colon>:)?\\s*)|:\\s*#\\s*(?P<comment_return_hint>.+))*$'
+)
+
+FAMILIES = {
+    # a valid signature with n typed parameters with defaults
+    "n typed params": lambda n: "foo(%s) -> int" % ", ".join("a%d: Dict[str, int] = {'x': (%d)}" % (i, i)
+                                                             for i in range(n)),
+    # many closing parenthesis candidates, then an invalid tail
+    "n ')' then garbage": lambda n: "foo(" + "a)" * n + " x",
+    # a long return hint that is not terminated properly
+    "long return hint": lambda n: "foo(a) -> " + "int " * n + "x",
+    # trailing whitespace followed by an invalid character: exponential for the old regex
+    "n spaces then garbage": lambda n: "foo(a)" + " " * n + "x",
+}
+
+
+def parse(sig_str):
+    try:
+        _parse_signature_string(sig_str)
+    except SyntaxError:
+        pass
+
+
+def best_time(fun, arg, number):
+    return min(repeat(lambda: fun(arg), number=number, repeat=5)) / number
+
+
+def main():
+    for family, make_input in FAMILIES.items():
+        print("--- %s" % family)
+        for n in (10, 100, 1000, 10000):
+            sig_str = make_input(n)
+            new = best_time(parse, sig_str, number=max(1, 10000 // n))
+            if family == "n spaces then garbage" and n > 10:
+                old = "too long (exponential)"
+            else:
+                old = "%10.1f us" % (best_time(OLD_FUNC_DEF.match, sig_str, number=max(1, 10000 // n)) * 1e6)
+            print("n=%-6s len=%-7s parser: %10.1f us    old regex: %s" % (n, len(sig_str), new * 1e6, old))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Benchmark measuring the memory retained by each wrapper generated by `makefun.create_function`, for modules of various
+sizes. Since the created functions do not keep a copy of the caller's namespace alive, it should not depend on the
+size of the module.
+
+    python benchmarks/bench_wrapper_memory.py [n_wrappers]
+"""
+import gc
+import sys
+import tracemalloc
+
+from makefun import create_function
+
+
+def impl(a, b=0):
+    return a
+
+
+# the code of the simulated modules, creating wrappers
+MODULE_CODE = """
+def make_wrappers(n):
+    return [create_function("foo(a, b=0)", impl) for _ in range(n)]
+
+wrappers = make_wrappers(n)
+"""
+
+
+def main(n):
+    print("Creating %s wrappers" % n)
+    for module_size in (10, 1000, 10000):
+        # simulate a module of the given size
+        module_globals = dict(("symbol_%s" % i, i) for i in range(module_size))
+        module_globals.update(create_function=create_function, impl=impl, n=n)
+
+        gc.collect()
+        tracemalloc.start()
+        exec(MODULE_CODE, module_globals)  # noqa
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del module_globals
+        print("module with %-6s symbols: %6.0f bytes retained per wrapper" % (module_size, retained / n))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
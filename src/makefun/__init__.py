@@ -3,8 +3,11 @@
 #
 # License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
 from .main import create_function, with_signature, remove_signature_parameters, add_signature_parameters, \
-    wraps, create_wrapper, partial, with_partial, compile_fun, UndefinedSymbolError, UnsupportedForCompilation, \
+    SignatureBuilder, CompactSignature, CompactParameter, get_signature_shape_key, wraps, create_wrapper, partial, \
+    with_partial, compile_fun, compile_module, specialize, UndefinedSymbolError, UnsupportedForCompilation, \
     SourceUnavailable
+from .caching import memoize
+from .batching import micro_batch, create_batched
 
 try:
     # -- Distribution mode: import from _version.py generated by setuptools_scm during release
@@ -18,11 +21,15 @@ except ImportError:
 __all__ = [
     '__version__',
     # submodules
-    'main',
+    'main', 'caching', 'batching',
     # symbols
     'create_function', 'with_signature',
-    'remove_signature_parameters', 'add_signature_parameters',
+    'remove_signature_parameters', 'add_signature_parameters', 'SignatureBuilder', 'CompactSignature',
+    'CompactParameter', 'get_signature_shape_key',
     'wraps', 'create_wrapper', 'partial', 'with_partial',
+    # memoization and batching
+    'memoize', 'micro_batch', 'create_batched',
     # pseudo compilation
-    'compile_fun', 'UndefinedSymbolError', 'UnsupportedForCompilation', 'SourceUnavailable'
+    'compile_fun', 'compile_module', 'specialize', 'UndefinedSymbolError', 'UnsupportedForCompilation',
+    'SourceUnavailable'
 ]
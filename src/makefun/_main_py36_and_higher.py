@@ -7,9 +7,10 @@ from itertools import chain
 from makefun.main import wraps
 
 
-def make_partial_using_async_for_in_yield(new_sig, f, *preset_pos_args, **preset_kwargs):
+def make_partial_using_async_delegation(new_sig, f, *preset_pos_args, **preset_kwargs):
     """
-    Makes a 'partial' when f is a async generator and python is new enough to support `async for v in f(): yield v`
+    Makes a 'partial' when f is a async generator. The generated async generator delegates to the one created by `f`,
+    including `asend` and `athrow`. See `get_async_generator_body_template`.
 
     :param new_sig:
     :param f:
@@ -20,7 +21,77 @@ def make_partial_using_async_for_in_yield(new_sig, f, *preset_pos_args, **preset
     @wraps(f, new_sig=new_sig)
     async def partial_f(*args, **kwargs):
         kwargs.update(preset_kwargs)
-        async for v in f(*chain(preset_pos_args, args), **kwargs):
-            yield v
+        _i = f(*chain(preset_pos_args, args), **kwargs)
+        _e = None
+        async for _y in _i:
+            try:
+                _s = yield _y
+            except GeneratorExit:
+                await _i.aclose()
+                raise
+            except BaseException as _x:
+                _e = _x
+                break
+            if _s is not None:
+                break
+        else:
+            return
+        try:
+            _y = await (_i.asend(_s) if _e is None else _i.athrow(_e))
+            while True:
+                try:
+                    _s = yield _y
+                except GeneratorExit:
+                    await _i.aclose()
+                    raise
+                except BaseException as _e:
+                    _y = await _i.athrow(_e)
+                else:
+                    _y = await _i.asend(_s)
+        except StopAsyncIteration:
+            return
 
     return partial_f
+
+
+def get_async_generator_body_template():
+    """
+    There is no `yield from` for async generators, and `async for y in ...: yield y` does not forward `asend` and
+    `athrow`. This is a replacement, adapted from PEP380.
+    See https://www.python.org/dev/peps/pep-0380/#formal-semantics
+
+    Items are first re-yielded with a fast `async for` loop, as long as nothing is sent or thrown into the generator.
+    The first time a value is sent or an exception is thrown, the delegation continues with `asend` and `athrow`.
+    :return:
+    """
+    return """async def %s
+    _i = _func_impl_(%s)             # create the async generator
+    _e = None
+    async for _y in _i:              # fast path: nothing is sent or thrown
+        try:
+            _s = yield _y
+        except GeneratorExit:        # ---generator exit error---
+            await _i.aclose()        # close the delegate first
+            raise                    # then re-raise exception
+        except BaseException as _x:  # ---other exception: switch to full delegation
+            _e = _x
+            break
+        if _s is not None:           # a value was sent: switch to full delegation
+            break
+    else:                            # the delegate is exhausted
+        return
+    try:
+        _y = await (_i.asend(_s) if _e is None else _i.athrow(_e))
+        while True:
+            try:
+                _s = yield _y        # yield the output and retrieve the new input
+            except GeneratorExit:
+                await _i.aclose()
+                raise
+            except BaseException as _e:
+                _y = await _i.athrow(_e)
+            else:                    # the new input was received
+                _y = await _i.asend(_s)
+    except StopAsyncIteration:       # the delegate is exhausted
+        return
+"""
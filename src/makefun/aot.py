@@ -0,0 +1,137 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Ahead-of-time generation of the code created by makefun.
+
+    python -m makefun.aot <module> [<module> ...]
+
+Each module is imported while recording all the code that makefun compiles for it (functions created by
+`create_function`, `@with_signature`, `@wraps`, ...). This code is then written as real python functions in a
+`<module>_makefun_aot.py` file next to the module. When this file exists, makefun uses the functions it contains
+instead of calling `compile()` and `exec()` at runtime. If the code generated at runtime is different (for example
+because the module was modified), it is compiled as usual: the file should be generated again.
+"""
+import os
+import sys
+from argparse import ArgumentParser
+from importlib import import_module
+
+from makefun import main as makefun_main
+from makefun.main import AOT_MODULE_SUFFIX, _indent_code
+
+try:  # python 3.5+
+    from typing import List, Optional
+except ImportError:
+    pass
+
+
+AOT_MODULE_HEADER = """# This file was generated by `python -m makefun.aot %s`, do not edit it manually.
+# It contains the code generated by makefun when importing this module, so that it does not have to be compiled at
+# runtime. Generate it again if the module is modified.
+# flake8: noqa
+"""
+
+
+def get_aot_module_path(module):
+    """
+    Returns the path of the file containing the code generated ahead of time for `module`: `<module>_makefun_aot.py`
+    in the same folder than the module (or than the package, if `module` is a package).
+
+    :param module:
+    :return:
+    """
+    module_file = os.path.abspath(module.__file__)
+    if hasattr(module, '__path__'):
+        # a package: the file is next to the package folder
+        folder = os.path.dirname(os.path.dirname(module_file))
+    else:
+        folder = os.path.dirname(module_file)
+    return os.path.join(folder, module.__name__.rsplit('.', 1)[-1] + AOT_MODULE_SUFFIX + '.py')
+
+
+def generate_aot_source(module_name,  # type: str
+                        records       # type: List[tuple]
+                        ):
+    # type: (...) -> str
+    """
+    Returns the source code of the module containing the code generated ahead of time for module `module_name`.
+
+    Each piece of code recorded by makefun is executed in a "holder" function returning the defined object. At runtime
+    the code of the holder is executed with the usual namespace as globals, so that default values and type hints
+    are evaluated as usual.
+
+    :param module_name:
+    :param records: the list of (module name, code, defined name) recorded by makefun
+    :return:
+    """
+    lines = [AOT_MODULE_HEADER % module_name]
+    registry = []
+    for rec_module_name, code_str, defined_name in records:
+        if rec_module_name != module_name or any(code_str == c for c, _ in registry):
+            continue
+        holder_name = '_makefun_aot_%s' % len(registry)
+        lines.append("\ndef %s():\n%s    return %s\n" % (holder_name, _indent_code(code_str), defined_name))
+        registry.append((code_str, holder_name))
+
+    lines.append("\n# The registry used by makefun: generated code -> holder function")
+    lines.append("MAKEFUN_AOT = {")
+    for code_str, holder_name in registry:
+        lines.append("    %r: %s," % (code_str, holder_name))
+    lines.append("}\n")
+    return '\n'.join(lines)
+
+
+def generate_aot_module(module_name,     # type: str
+                        output_path=None  # type: Optional[str]
+                        ):
+    # type: (...) -> str
+    """
+    Imports module `module_name` while recording all the code compiled by makefun for it, and writes it as a
+    `<module>_makefun_aot.py` module that makefun will use at runtime instead of compiling the code.
+
+    Note that only the functions created when the module is imported are recorded: functions created later (for
+    example in a function body) are compiled as usual.
+
+    :param module_name: the name of the module to import. It should not be imported yet.
+    :param output_path: an optional path where to write the generated module. By default it is written next to the
+        module, so that makefun can find it.
+    :return: the path of the generated module
+    """
+    if module_name in sys.modules:
+        raise ValueError("Module %r is already imported: the code generated when importing it can not be recorded"
+                         % module_name)
+
+    records = []
+    makefun_main._aot_recorder = records
+    try:
+        module = import_module(module_name)
+    finally:
+        makefun_main._aot_recorder = None
+
+    if output_path is None:
+        output_path = get_aot_module_path(module)
+    with open(output_path, 'w') as f:
+        f.write(generate_aot_source(module_name, records))
+
+    # make sure that the new module is used from now on
+    makefun_main._aot_registries.pop(module_name, None)
+
+    return output_path
+
+
+def main(args=None):
+    parser = ArgumentParser(prog="python -m makefun.aot",
+                            description="Generates the code created by makefun when importing each module, so that "
+                                        "it does not have to be compiled at runtime.")
+    parser.add_argument("modules", nargs='+', help="the names of the modules to import")
+    parsed = parser.parse_args(args)
+
+    for module_name in parsed.modules:
+        output_path = generate_aot_module(module_name)
+        print("Generated %s" % output_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Batching of per-item functions.
+
+The `micro_batch` decorator creates a coroutine function with the signature of a per-item function, that collects the
+calls made concurrently by asyncio tasks and processes them with a single call to a batch implementation.
+
+The `create_batched` function does the opposite: it creates the batched version of a per-item function, calling it
+for each item of its column arguments in generated code.
+"""
+import asyncio
+import sys
+from inspect import isawaitable
+from itertools import repeat
+from weakref import WeakKeyDictionary
+
+from makefun.main import signature, Parameter, wraps, _get_signature_shape_string, _is_valid_func_def_name, _make, \
+    _update_fields
+
+try:  # python 3.5+
+    from typing import Callable, List, Tuple, Sequence
+except ImportError:
+    pass
+
+
+def micro_batch(batch_impl,      # type: Callable
+                max_size=64,     # type: int
+                max_delay=0.001  # type: float
+                ):
+    """
+    A decorator replacing a per-item function with a coroutine function with the same signature, that collects the
+    calls made concurrently (for example by asyncio tasks) and processes them with a single call to `batch_impl`:
+
+    ```python
+    from makefun import micro_batch
+
+    async def get_users(user_ids, with_details):
+        users = await db.fetch_users(user_ids)
+        ...
+        return users  # in the same order as user_ids
+
+    @micro_batch(get_users, max_size=100, max_delay=0.005)
+    async def get_user(user_id: int, with_details: bool = False) -> User:
+        pass
+    ```
+
+    The body of the decorated function is not used: it only provides the signature, name and documentation of the
+    created function. Each call waits for the batch to be processed, and returns the result corresponding to its
+    arguments.
+
+    `batch_impl` receives one list per parameter of the per-item signature (in the same order), containing the values
+    of this parameter for each call of the batch, with the default values applied. It should return the sequence of
+    results of each call, in the same order. It can be a coroutine function. If it raises an exception, all calls of
+    the batch raise this exception. If the task processing the batch is cancelled, all calls of the batch are
+    cancelled.
+
+    A batch is processed when it contains `max_size` calls, or `max_delay` seconds after its first call. The calls are
+    batched separately for each asyncio event loop.
+
+    :param batch_impl: the function processing a batch of calls.
+    :param max_size: the maximum number of calls in a batch (default 64).
+    :param max_delay: the maximum time in seconds (default 0.001) a call waits for the batch to be processed.
+    :return:
+    """
+    if max_size < 1:
+        raise ValueError("max_size should be a positive integer, found %r" % max_size)
+    if max_delay < 0:
+        raise ValueError("max_delay should be a positive number, found %r" % max_delay)
+
+    def apply_micro_batch(f):
+        # the wrapper created by `wraps` passes the positional-only arguments positionally and the others by keyword
+        func_signature = signature(f)
+        kw_names = []
+        for p_name, p in func_signature.parameters.items():
+            if p.kind in (Parameter.VAR_POSITIONAL, Parameter.VAR_KEYWORD):
+                raise ValueError("micro_batch can not be applied on %r: variable-length arguments are not supported"
+                                 % f)
+            if p.kind is not Parameter.POSITIONAL_ONLY:
+                kw_names.append(p_name)
+
+        batcher = _MicroBatcher(batch_impl, max_size, max_delay)
+
+        @wraps(f)
+        async def submit_call(*args, **kwargs):
+            return await batcher.submit(args + tuple([kwargs[n] for n in kw_names]))
+
+        submit_call.batch_impl = batch_impl
+        return submit_call
+
+    return apply_micro_batch
+
+
+class _PendingBatch(object):
+    """The calls collected for an event loop, waiting to be processed"""
+    __slots__ = ('items', 'futures', 'timer')
+
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        self.timer = None
+
+
+class _MicroBatcher(object):
+    """
+    Collects the calls (tuples of argument values) and processes them by batches with `batch_impl`. There is one
+    pending batch for each event loop.
+    """
+    __slots__ = ('batch_impl', 'max_size', 'max_delay', 'pending', 'tasks')
+
+    def __init__(self, batch_impl, max_size, max_delay):
+        self.batch_impl = batch_impl
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.pending = WeakKeyDictionary()
+        # the running tasks, that the event loop only references weakly
+        self.tasks = set()
+
+    def submit(self, item):
+        """
+        Adds a call to the pending batch of the running event loop. Returns a future receiving its result.
+
+        :param item: the tuple of argument values
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            batch = self.pending[loop]
+        except KeyError:
+            batch = self.pending[loop] = _PendingBatch()
+
+        future = loop.create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+        if len(batch.items) >= self.max_size:
+            self.flush(loop)
+        elif batch.timer is None:
+            batch.timer = loop.call_later(self.max_delay, self.flush, loop)
+        return future
+
+    def flush(self, loop):
+        """Processes the pending batch of `loop` in a new task"""
+        batch = self.pending.pop(loop, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = loop.create_task(self.process(batch.items, batch.futures))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def process(self, items,  # type: List[Tuple]
+                      futures       # type: List[asyncio.Future]
+                      ):
+        """Calls `batch_impl` with the columns of `items`, and sets the results of `futures`"""
+        try:
+            results = self.batch_impl(*[list(column) for column in zip(*items)])
+            if isawaitable(results):
+                results = await results
+            results = list(results)
+            if len(results) != len(items):
+                raise ValueError("The batch implementation returned %s results for %s calls"
+                                 % (len(results), len(items)))
+        except asyncio.CancelledError:
+            # the batch task was cancelled: cancel the calls waiting for it
+            for future in futures:
+                future.cancel()
+            raise
+        except BaseException as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            for future, result in zip(futures, results):
+                # the caller may have been cancelled
+                if not future.done():
+                    future.set_result(result)
+
+
+def create_batched(f,                 # type: Callable
+                   vectorizable=False  # type: bool
+                   ):
+    # type: (...) -> Callable
+    """
+    Creates the batched version of the per-item function `f`: a function with the same parameters, each receiving a
+    sequence of values (a column), that returns the list of the results of `f` for each item. The code of the loop
+    calling `f` is generated for its signature, so there is no per-item dispatch overhead:
+
+    ```python
+    from makefun import create_batched
+
+    def convert(a: float, b: float, unit: str = 'm') -> float:
+        ...
+
+    convert_batch = create_batched(convert)
+    convert_batch([1, 2], [3, 4], unit=['m', 'km'])
+    ```
+
+    The signature of the created function `convert_batch` is
+    `(a: Sequence[float], b: Sequence[float], unit: Sequence[str] = None) -> List[float]`. All columns should have the
+    same length. The parameters with a default value are optional: when not provided, `f` is called with the default
+    value for all items.
+
+    If `vectorizable` is True, `f` is also able to process NumPy arrays directly (for example because it only uses
+    NumPy universal functions): when at least one argument is a NumPy array, `f` is called once with the columns
+    instead (and with the default values for the columns not provided), and its result is returned.
+
+    :param f: the per-item function. It should not have variable-length arguments.
+    :param vectorizable: a boolean (default False) indicating if `f` can be called with NumPy arrays.
+    :return:
+    """
+    func_signature = signature(f)
+    params = list(func_signature.parameters.values())
+    for p in params:
+        if p.kind in (Parameter.VAR_POSITIONAL, Parameter.VAR_KEYWORD):
+            raise ValueError("create_batched can not be applied on %r: variable-length arguments are not supported"
+                             % f)
+    if not params:
+        raise ValueError("create_batched can not be applied on %r: it has no parameters" % f)
+    for p_name in func_signature.parameters:
+        if p_name in ('_func_impl_', '_repeat_', '_zip_', '_has_ndarray_', '_n_') or p_name.startswith('DEFAULT_'):
+            raise ValueError("create_batched can not be applied on %r: parameter name %r is reserved" % (f, p_name))
+
+    # the first column is the reference for the length, it is always required
+    ref = params[0].name
+    new_params = [p.replace(default=Parameter.empty if p.name == ref or p.default is Parameter.empty else None,
+                            annotation=_get_column_hint(p.annotation)) for p in params]
+    new_signature = func_signature.replace(parameters=new_params,
+                                           return_annotation=_get_list_hint(func_signature.return_annotation))
+
+    # generate the code
+    factory_vars = dict(_func_impl_=f, _repeat_=repeat, _zip_=zip, _has_ndarray_=_has_ndarray)
+    call_args = ', '.join(p.name if p.kind is not Parameter.KEYWORD_ONLY else "%s=%s" % (p.name, p.name)
+                          for p in params)
+    names = ', '.join(p.name for p in params)
+    lines = []
+    if vectorizable:
+        vector_args = []
+        for p in params:
+            if p.name != ref and p.default is not Parameter.empty:
+                factory_vars["DEFAULT_%s" % p.name] = p.default
+                value = "DEFAULT_%s if %s is None else %s" % (p.name, p.name, p.name)
+            else:
+                value = p.name
+            vector_args.append(value if p.kind is not Parameter.KEYWORD_ONLY else "%s=%s" % (p.name, value))
+        lines.append("    if _has_ndarray_(%s):\n        return _func_impl_(%s)\n" % (names, ', '.join(vector_args)))
+    lines.append("    _n_ = len(%s)\n" % ref)
+    for p in params[1:]:
+        if p.default is not Parameter.empty:
+            factory_vars["DEFAULT_%s" % p.name] = p.default
+            lines.append("    if %s is None:\n        %s = _repeat_(DEFAULT_%s)\n    el" % (p.name, p.name, p.name))
+        else:
+            lines.append("    ")
+        lines.append("if len(%s) != _n_:\n"
+                     "        raise ValueError('%s has length %%s instead of %%s' %% (len(%s), _n_))\n"
+                     % (p.name, p.name, p.name))
+    lines.append("    return [_func_impl_(%s) for %s in _zip_(%s)]\n" % (call_args, names, names))
+
+    func_name = getattr(f, '__name__', 'function') + '_batch'
+    co_name = func_name if _is_valid_func_def_name(func_name) else 'batched'
+    body = "def %s(%s):\n%s" % (co_name, _get_signature_shape_string(new_signature), ''.join(lines))
+    batched = _make(co_name, (), body, dict(), factory_vars=factory_vars)
+
+    # default values and type hints are set on the function afterwards, they are not needed in the compiled code
+    defaults = tuple(p.default for p in new_params
+                     if p.default is not Parameter.empty and p.kind is not Parameter.KEYWORD_ONLY)
+    kwonlydefaults = {p.name: p.default for p in new_params
+                      if p.default is not Parameter.empty and p.kind is Parameter.KEYWORD_ONLY}
+    annotations = {p.name: p.annotation for p in new_params}
+    annotations['return'] = new_signature.return_annotation
+    qualname = getattr(f, '__qualname__', None)
+    _update_fields(batched, name=func_name, qualname=qualname + '_batch' if qualname else None,
+                   doc=getattr(f, '__doc__', None), annotations=annotations, defaults=defaults,
+                   kwonlydefaults=kwonlydefaults, module=getattr(f, '__module__', None),
+                   kw=dict(__source__=body, __func_impl__=f))
+    return batched
+
+
+def _get_column_hint(hint):
+    """Returns the type hint of a column of values with type hint `hint`"""
+    if hint is Parameter.empty:
+        return Sequence
+    try:
+        return Sequence[hint]
+    except TypeError:
+        # for example a string type hint in old python versions
+        return Sequence
+
+
+def _get_list_hint(hint):
+    """Returns the type hint of a list of results with type hint `hint`"""
+    if hint is Parameter.empty:
+        return List
+    try:
+        return List[hint]
+    except TypeError:
+        return List
+
+
+def _has_ndarray(*columns):
+    """Returns True if one of the columns is a NumPy array. NumPy is not imported if it was not imported yet."""
+    np = sys.modules.get('numpy')
+    if np is None:
+        return False
+    return any(isinstance(c, np.ndarray) for c in columns)
@@ -0,0 +1,326 @@
+# Authors: Sylvain MARIE <sylvain.marie@se.com>
+#          + All contributors to <https://github.com/smarie/python-makefun>
+#
+# License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
+"""
+Signature-aware memoization.
+
+The `memoize` decorator creates a wrapper with the same signature as the decorated function, whose code is generated
+for this signature: all arguments are received by name with their default values applied, so the cache key is a
+tuple built in straight-line code, and `f(1, 2)`, `f(1, b=2)` and `f(1)` (if the default value of `b` is 2) share
+the same cache entry.
+"""
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import monotonic
+
+from makefun.main import signature, Parameter, iscoroutinefunction, isasyncgenfunction, get_signature_params, \
+    get_signature_details, _get_signature_shape_string, _is_generator_func, _is_valid_func_def_name, _make, \
+    _update_fields
+
+try:  # python 3.5+
+    from typing import Callable, Optional, Union
+except ImportError:
+    pass
+
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'maxsize', 'currsize'))
+
+# the names used in the generated code, that can not be parameter names
+RESERVED_NAMES = ('_func_impl_', '_key_', '_res_', '_hits_', '_get_', '_MISS_', '_cache_set_', '_move_to_end_',
+                  '_touch_', '_now_')
+
+# the value returned by the lookup of a result that is not cached
+_MISS = object()
+
+
+def memoize(maxsize=128,  # type: Union[Optional[int], Callable]
+            policy='lru',  # type: str
+            ttl=None       # type: float
+            ):
+    """
+    A decorator caching the results of a function, like `functools.lru_cache`. The wrapper has the same signature as
+    the decorated function, and its code is generated for this signature: the cache key is the tuple of all argument
+    values, with the default values applied, built in straight-line code. So `f(1, 2)`, `f(1, b=2)` and `f(1)` (if
+    the default value of `b` is 2) share the same cache entry, while they are different entries for `lru_cache`.
+
+    ```python
+    from makefun import memoize
+
+    @memoize(maxsize=1000)
+    def foo(a, b=2):
+        return a + b
+
+    foo(1)
+    foo(1, b=2)
+    assert foo.cache_info().hits == 1
+    ```
+
+    As for `lru_cache`, the wrapper has a `cache_info()` method returning the cache statistics (`hits`, `misses`,
+    `maxsize` and `currsize`), and a `cache_clear()` method. The arguments should be hashable.
+
+    Since the wrapper is python code, a cache hit is slower than with the C implementation of `lru_cache`: about 60%
+    slower for positional arguments on CPython 3.11 (see `benchmarks/bench_memoize.py`), but the hit rate is higher
+    when the same arguments are passed in different ways.
+
+    :param maxsize: the maximum number of cached results (default 128), or `None` for an unbounded cache.
+    :param policy: the policy used to evict results when the cache is full: `'lru'` (default, least recently used),
+        `'lfu'` (least frequently used) or `'ttl'` (the results expire `ttl` seconds after they were computed, and the
+        oldest ones are evicted when the cache is full)
+    :param ttl: the time-to-live of the results in seconds, for the `'ttl'` policy.
+    :return:
+    """
+    if callable(maxsize):
+        # called with no-args, apply immediately
+        return _create_memoized(maxsize, 128, policy, ttl)
+    else:
+        # called with parenthesis, return a decorator
+        if maxsize is not None and maxsize < 0:
+            raise ValueError("maxsize should be a positive integer or None, found %r" % maxsize)
+        if policy not in _CACHE_TYPES:
+            raise ValueError("Invalid policy %r, it should be one of %s" % (policy, tuple(_CACHE_TYPES)))
+        if (policy == 'ttl') != (ttl is not None):
+            raise ValueError("ttl should be provided if and only if policy is 'ttl'")
+
+        def apply_memoize(f):
+            return _create_memoized(f, maxsize, policy, ttl)
+
+        return apply_memoize
+
+
+def _create_memoized(f, maxsize, policy, ttl):
+    """
+    Creates the memoized wrapper of `f`, see `memoize`.
+
+    :param f:
+    :param maxsize:
+    :param policy:
+    :param ttl:
+    :return:
+    """
+    if _is_generator_func(f) or isasyncgenfunction(f) or iscoroutinefunction(f):
+        raise TypeError("memoize can not be applied on generator functions or coroutine functions: %r" % f)
+
+    func_signature = signature(f)
+    for p_name in func_signature.parameters:
+        if p_name in RESERVED_NAMES:
+            raise ValueError("memoize can not be applied on %r: parameter name %r is reserved" % (f, p_name))
+
+    if policy == 'lru' and maxsize is None:
+        cache = _UnboundedCache(maxsize, ttl)
+    else:
+        cache = _CACHE_TYPES[policy](maxsize, ttl)
+    func_name = getattr(f, '__name__', 'memoized')
+    co_name = func_name if _is_valid_func_def_name(func_name) else 'memoized'
+
+    # generate the code
+    params_str = ', '.join(("%s=%s" % (k, k)) if is_kw else k
+                           for k, is_kw in get_signature_params(func_signature).items())
+    body = "def %s(%s):\n    nonlocal _hits_\n    _key_ = %s\n%s\n" \
+           "    _hits_ += 1\n" \
+           "    return _res_\n" % (co_name, _get_signature_shape_string(func_signature),
+                                   _get_key_string(func_signature),
+                                   cache.lookup_template % dict(call="_func_impl_(%s)" % params_str))
+
+    factory_vars = dict(_func_impl_=f, _hits_=0)
+    factory_vars.update(cache.get_code_vars())
+    memoized = _make(co_name, (), body, dict(), factory_vars=factory_vars)
+    hits_cell = memoized.__closure__[memoized.__code__.co_freevars.index('_hits_')]
+
+    def cache_info():
+        """Returns the cache statistics"""
+        return CacheInfo(hits_cell.cell_contents, cache.misses, maxsize, len(cache.data))
+
+    def cache_clear():
+        """Clears the cache and its statistics"""
+        cache.clear()
+        hits_cell.cell_contents = 0
+
+    # default values and type hints are set on the function afterwards, they are not needed in the compiled code
+    annotations, defaults, kwonlydefaults = get_signature_details(func_signature)
+    attrs = dict(getattr(f, '__dict__', ()))
+    attrs.update(__wrapped__=f, cache_info=cache_info, cache_clear=cache_clear)
+    _update_fields(memoized, name=func_name, qualname=getattr(f, '__qualname__', None),
+                   doc=getattr(f, '__doc__', None), annotations=annotations, defaults=tuple(defaults),
+                   kwonlydefaults=kwonlydefaults, module=getattr(f, '__module__', None), kw=attrs)
+    return memoized
+
+
+def _get_key_string(func_signature):
+    """
+    Returns the expression of the cache key: the tuple of all arguments. Variable-length positional arguments are a
+    tuple in the key, and variable-length keyword arguments a frozenset of their items.
+
+    :param func_signature:
+    :return:
+    """
+    items = []
+    for p_name, p in func_signature.parameters.items():
+        if p.kind is Parameter.VAR_KEYWORD:
+            items.append("frozenset(%s.items())" % p_name)
+        else:
+            items.append(p_name)
+    return "(%s,)" % ', '.join(items) if items else "()"
+
+
+class _LRUCache(object):
+    """
+    A cache evicting the least recently used results. The generated code moves the results found to the end of the
+    `data` ordered dictionary, the first ones are evicted.
+    """
+    # the lookup code, in the generated function. The function is not called in an `except` block, so that the
+    # exceptions it raises have no context. A KeyError is raised when moving a result evicted by another thread
+    # meanwhile, it is still returned
+    lookup_template = """    _res_ = _get_(_key_, _MISS_)
+    if _res_ is _MISS_:
+        return _cache_set_(_key_, %(call)s)
+    try:
+        _move_to_end_(_key_)
+    except KeyError:
+        pass"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.misses = 0
+        self.data = OrderedDict()
+        self.lock = Lock()
+
+    def get_code_vars(self):
+        """Returns the variables used by the generated code"""
+        return dict(_get_=self.data.get, _MISS_=_MISS, _cache_set_=self.set, _move_to_end_=self.data.move_to_end)
+
+    def set(self, key, value):
+        """Stores the result computed after a miss, evicting other results if needed. Returns the result."""
+        with self.lock:
+            self.misses += 1
+            if self.maxsize == 0:
+                return value
+            if key not in self.data and self.maxsize is not None and len(self.data) >= self.maxsize:
+                self.evict()
+            self.store(key, value)
+        return value
+
+    def store(self, key, value):
+        self.data[key] = value
+
+    def evict(self):
+        self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.misses = 0
+            self.data.clear()
+
+
+class _UnboundedCache(_LRUCache):
+    """
+    A cache that never evicts results, used when maxsize is None for the 'lru' policy. There is no order to update.
+    """
+    lookup_template = """    _res_ = _get_(_key_, _MISS_)
+    if _res_ is _MISS_:
+        return _cache_set_(_key_, %(call)s)"""
+
+
+class _LFUCache(_LRUCache):
+    """
+    A cache evicting the least frequently used results (the least recently used one if several results have the same
+    frequency). The keys are stored in ordered dictionaries by frequency, so that all operations are O(1).
+    """
+    lookup_template = """    _res_ = _get_(_key_, _MISS_)
+    if _res_ is _MISS_:
+        return _cache_set_(_key_, %(call)s)
+    _touch_(_key_)"""
+
+    def __init__(self, maxsize, ttl):
+        super(_LFUCache, self).__init__(maxsize, ttl)
+        self.data = dict()
+        self.frequencies = dict()
+        self.keys_by_frequency = dict()
+        self.min_frequency = 0
+
+    def get_code_vars(self):
+        return dict(_get_=self.data.get, _MISS_=_MISS, _cache_set_=self.set, _touch_=self.touch)
+
+    def touch(self, key):
+        """Increments the frequency of `key`. Does nothing if it was evicted meanwhile."""
+        with self.lock:
+            frequency = self.frequencies.get(key)
+            if frequency is None:
+                return
+            self._remove_key(key, frequency)
+            self._add_key(key, frequency + 1)
+
+    def _add_key(self, key, frequency):
+        self.frequencies[key] = frequency
+        try:
+            self.keys_by_frequency[frequency][key] = None
+        except KeyError:
+            self.keys_by_frequency[frequency] = OrderedDict([(key, None)])
+
+    def _remove_key(self, key, frequency):
+        keys = self.keys_by_frequency[frequency]
+        del keys[key]
+        if not keys:
+            del self.keys_by_frequency[frequency]
+            if self.min_frequency == frequency:
+                self.min_frequency = frequency + 1
+
+    def store(self, key, value):
+        if key not in self.data:
+            self._add_key(key, 1)
+            self.min_frequency = 1
+        self.data[key] = value
+
+    def evict(self):
+        key = next(iter(self.keys_by_frequency[self.min_frequency]))
+        self._remove_key(key, self.min_frequency)
+        del self.frequencies[key]
+        del self.data[key]
+
+    def clear(self):
+        with self.lock:
+            super(_LFUCache, self).clear()
+            self.frequencies.clear()
+            self.keys_by_frequency.clear()
+            self.min_frequency = 0
+
+
+class _TTLCache(_LRUCache):
+    """
+    A cache where results expire `ttl` seconds after they were computed. The (expiry time, result) tuples are stored
+    in the order in which they were computed, so the oldest ones are evicted when the cache is full.
+    """
+    lookup_template = """    _res_ = _get_(_key_, _MISS_)
+    if _res_ is _MISS_ or _res_[0] <= _now_():
+        return _cache_set_(_key_, %(call)s)
+    _res_ = _res_[1]"""
+
+    def __init__(self, maxsize, ttl):
+        super(_TTLCache, self).__init__(maxsize, ttl)
+        self.ttl = ttl
+
+    def get_code_vars(self):
+        return dict(_get_=self.data.get, _MISS_=_MISS, _cache_set_=self.set, _now_=monotonic)
+
+    def store(self, key, value):
+        # the expired results are removed even if the cache is not full, so that they do not pile up when the cache is
+        # unbounded. They are the first ones, so this is fast
+        now = monotonic()
+        self.remove_expired(now)
+        # an expired result: move it to the end
+        self.data.pop(key, None)
+        self.data[key] = now + self.ttl, value
+
+    def evict(self):
+        # remove the expired results first
+        self.remove_expired(monotonic())
+        if len(self.data) >= self.maxsize:
+            self.data.popitem(last=False)
+
+    def remove_expired(self, now):
+        """Removes the results expired at time `now`"""
+        while self.data and next(iter(self.data.values()))[0] <= now:
+            self.data.popitem(last=False)
+
+
+_CACHE_TYPES = OrderedDict([('lru', _LRUCache), ('lfu', _LFUCache), ('ttl', _TTLCache)])
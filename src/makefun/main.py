@@ -4,16 +4,28 @@
 # License: 3-clause BSD, <https://github.com/smarie/python-makefun/blob/master/LICENSE>
 from __future__ import print_function
 
+import __future__
+import ast
+import builtins
+import dis
 import functools
+import linecache
+import operator
+import os
 import re
 import sys
 import itertools
-from collections import OrderedDict
-from copy import copy
-from inspect import getsource
+from collections import OrderedDict, namedtuple
+from copy import copy, deepcopy
+from importlib import import_module
+from importlib.util import find_spec
+from inspect import getsource, formatannotation, unwrap
 from keyword import iskeyword
 from textwrap import dedent
-from types import FunctionType
+from tokenize import generate_tokens
+from threading import Lock
+from types import FunctionType, CellType, MappingProxyType, ModuleType, BuiltinFunctionType, CodeType, MethodType
+from weakref import WeakValueDictionary, WeakMethod, proxy as weak_proxy, ProxyTypes
 
 
 if sys.version_info >= (3, 0):
@@ -41,6 +53,12 @@ except ImportError:
     def iscoroutinefunction(f):
         return False
 
+try:  # python 3.12+
+    from inspect import markcoroutinefunction
+except ImportError:
+    # the created functions can not be marked as coroutine functions: the fast path can not be used
+    markcoroutinefunction = None
+
 try:
     from inspect import isgeneratorfunction
 except ImportError:
@@ -55,11 +73,19 @@ except ImportError:
     def isasyncgenfunction(f):
         return False
 
+try:  # python 3.14+
+    from annotationlib import Format as AnnotationFormat
+except ImportError:
+    AnnotationFormat = None
+
 try:  # python 3.5+
-    from typing import Callable, Any, Union, Iterable, Dict, Tuple, Mapping
+    from typing import Callable, Any, Union, Iterable, Dict, Tuple, Mapping, Optional
 except ImportError:
     pass
 
+# The compiler flag of `from __future__ import annotations` (python 3.7+): type hints are stored as strings
+DEFERRED_ANNOTATIONS_FLAG = getattr(getattr(__future__, 'annotations', None), 'compiler_flag', 0)
+
 
 PY2 = sys.version_info < (3,)
 if not PY2:
@@ -68,17 +94,9 @@ else:
     string_types = basestring,  # noqa
 
 
-# macroscopic signature strings checker (we do not look inside params, `signature` will do it for us)
-FUNC_DEF = re.compile(
-    '(?s)^\\s*(?P<funcname>[_\\w][_\\w\\d]*)?\\s*'
-    '\\(\\s*(?P<params>.*?)\\s*\\)\\s*'
-    '(((?P<typed_return_hint>->\\s*[^:]+)?(?P<colon>:)?\\s*)|:\\s*#\\s*(?P<comment_return_hint>.+))*$'
-)
-
-
 def create_wrapper(wrapped,
                    wrapper,
-                   new_sig=None,               # type: Union[str, Signature]
+                   new_sig=None,               # type: Union[str, Signature, CompactSignature]
                    prepend_args=None,          # type: Union[str, Parameter, Iterable[Union[str, Parameter]]]
                    append_args=None,           # type: Union[str, Parameter, Iterable[Union[str, Parameter]]]
                    remove_args=None,           # type: Union[str, Iterable[str]]
@@ -90,6 +108,14 @@ def create_wrapper(wrapped,
                    qualname=None,              # type: str
                    co_name=None,               # type: str
                    module_name=None,           # type: str
+                   compact_metadata=False,     # type: bool
+                   weak_refs=False,            # type: bool
+                   fast_coroutine=False,       # type: bool
+                   fast_generator=False,       # type: bool
+                   lazy=False,                 # type: bool
+                   defer_annotations=False,    # type: bool
+                   intern_signature=False,     # type: bool
+                   enforce_signature=True,     # type: bool
                    **attrs
                    ):
     """
@@ -101,6 +127,10 @@ def create_wrapper(wrapped,
     return wraps(wrapped, new_sig=new_sig, prepend_args=prepend_args, append_args=append_args, remove_args=remove_args,
                  func_name=func_name, inject_as_first_arg=inject_as_first_arg, add_source=add_source,
                  add_impl=add_impl, doc=doc, qualname=qualname, module_name=module_name, co_name=co_name,
+                 compact_metadata=compact_metadata, weak_refs=weak_refs, fast_coroutine=fast_coroutine,
+                 fast_generator=fast_generator, lazy=lazy, defer_annotations=defer_annotations,
+                 intern_signature=intern_signature,
+                 enforce_signature=enforce_signature,
                  **attrs)(wrapper)
 
 
@@ -115,7 +145,7 @@ def getattr_partial_aware(obj, att_name, *att_default):
         return val
 
 
-def create_function(func_signature,             # type: Union[str, Signature]
+def create_function(func_signature,             # type: Union[str, Signature, CompactSignature]
                     func_impl,                  # type: Callable[[Any], Any]
                     func_name=None,             # type: str
                     inject_as_first_arg=False,  # type: bool
@@ -125,6 +155,13 @@ def create_function(func_signature,             # type: Union[str, Signature]
                     qualname=None,              # type: str
                     co_name=None,               # type: str
                     module_name=None,           # type: str
+                    compact_metadata=False,     # type: bool
+                    weak_refs=False,            # type: bool
+                    fast_coroutine=False,       # type: bool
+                    fast_generator=False,       # type: bool
+                    lazy=False,                 # type: bool
+                    defer_annotations=False,    # type: bool
+                    intern_signature=False,     # type: bool
                     **attrs):
     """
     Creates a function with signature `func_signature` that will call `func_impl` when called. All arguments received
@@ -139,7 +176,7 @@ def create_function(func_signature,             # type: Union[str, Signature]
        by default
      - as a `Signature` object, for example created using `signature(f)` or handcrafted. Since a `Signature` object
        does not contain any name, in this case the `__name__` and `__qualname__` of the created function will be copied
-       from `func_impl` by default.
+       from `func_impl` by default. A `CompactSignature` can be used the same way.
 
     All the other metadata of the created function are defined as follows:
 
@@ -159,6 +196,53 @@ def create_function(func_signature,             # type: Union[str, Signature]
      - `__func_impl__` attribute: set if `add_impl` is `True` (default), this attribute contains a pointer to
      `func_impl`
 
+    When `compact_metadata` is `True`, the string attributes (such as `__source__`) of the created function are shared
+    with all other functions created with equal strings: each of these strings is stored only once. This reduces memory
+    usage when very many wrappers with the same signature are created. Each function still has its own `__dict__`, so
+    setting an attribute on one of them does not change the others.
+
+    When `weak_refs` is `True`, the created function only holds a weak reference to `func_impl`, and the
+    `__func_impl__` and `__wrapped__` attributes are weak proxies instead of strong references. Therefore the created
+    function does not extend the lifetime of its implementation: you have to keep a reference to `func_impl` (and to
+    the wrapped function) elsewhere, otherwise calling the created function will raise a `ReferenceError`.
+
+    When `func_impl` is a native coroutine function, the created function is by default a native coroutine function
+    awaiting `func_impl`. When `fast_coroutine` is `True`, the created function is instead a plain function directly
+    returning the coroutine created by `func_impl`, and is marked with `inspect.markcoroutinefunction` so that it is
+    still seen as a coroutine function. This saves one coroutine object and one `await` per call. This requires python
+    3.12 or higher: on older versions this option is silently ignored.
+
+    Similarly, when `func_impl` is a generator function, the created function is by default a generator function
+    delegating to `func_impl` with `yield from`. When `fast_generator` is `True`, the created function is instead a
+    plain function directly returning the generator created by `func_impl`. This removes one generator frame from each
+    `next()`, `send()` or `throw()`. The created function is marked so that makefun still considers it as a generator
+    function (for example when it is wrapped again), but note that `inspect.isgeneratorfunction` will return `False`.
+
+    When `lazy` is `True`, the code of the created function is only compiled when it is called for the first time.
+    Until then the function has the code of a generic stub (shared by all lazy functions of the same kind), and its
+    signature is available through its `__signature__` attribute. On the first call the actual code is compiled and
+    replaces the `__code__` of the function, in a thread-safe way. This makes the creation of functions that are never
+    called much faster. Since default values and type hints are attributes of the function and not part of its code,
+    they are not included in the compiled code nor in the `__source__`: only the names and kinds of the parameters
+    are. Therefore the compiled code is shared by all lazy functions with the same name and signature shape (see
+    `get_signature_shape_key`): only the first one is compiled. Note that when `func_signature` is a string, it still
+    has to be compiled to be parsed. Generator, async generator and coroutine functions are compiled immediately
+    (using the shared code if available), since a stub would only check the arguments when the generator is iterated
+    or when the coroutine is awaited.
+
+    When `defer_annotations` is `True`, the type hints are never evaluated: they are not included in the generated
+    code, and are only copied as-is into the `__annotations__` of the created function. When `func_signature` is a
+    string, it is parsed as if `from __future__ import annotations` was used, so its type hints are kept as strings.
+    This avoids the cost of evaluating (and checking the `repr()` of) type hints that are not used at runtime, for
+    example in modules using `from __future__ import annotations` and heavy typing. Tools needing the actual types
+    can resolve them later with `typing.get_type_hints`, from the `__globals__` of the created function.
+
+    When `intern_signature` is `True`, the `__signature__` attribute of the created function is set to a `Signature`
+    shared with all other functions created with this option and an identical signature: same parameter names and
+    kinds, and same default values and type hints (compared by identity, except integers, strings and bytes that are
+    compared by value). This reduces memory usage when many functions have the same signature, and makes the
+    equality checks of these signatures immediate. Interned signatures are released when no function uses them.
+
     A lambda function will be created in the following cases:
 
      - when `func_signature` is a `Signature` object and `func_impl` is itself a lambda function,
@@ -168,8 +252,9 @@ def create_function(func_signature,             # type: Union[str, Signature]
 
     :param func_signature: either a string without 'def' such as "foo(a, b: int, *args, **kwargs)" or "(a, b: int)",
         or a `Signature` object, for example from the output of `inspect.signature` or from the `funcsigs.signature`
-        backport. Note that these objects can be created manually too. If the signature is provided as a string and
-        contains a non-empty name, this name will be used instead of the one of the decorated function.
+        backport. Note that these objects can be created manually too, or replaced with a faster `CompactSignature`.
+        If the signature is provided as a string and contains a non-empty name, this name will be used instead of the
+        one of the decorated function.
     :param func_impl: the function that will be called when the generated function is executed. Its signature should
         be compliant with (=more generic than) `func_signature`
     :param inject_as_first_arg: if `True`, the created function will be injected as the first positional argument of
@@ -192,6 +277,23 @@ def create_function(func_signature,             # type: Union[str, Signature]
         name defined in `func_signature` if `func_signature` is a `str` and contains a non-empty name.
     :param module_name: the name of the module to be set on the function (under __module__ ). If None (default),
         `func_impl.__module__` will be used.
+    :param compact_metadata: a boolean indicating if the attributes of the generated function should share their
+        string values with other functions created with equal strings (default: False).
+        See above for details.
+    :param weak_refs: a boolean indicating if the created function should only hold weak references to `func_impl`
+        and to the `__wrapped__` attribute if any (default: False). See above for details.
+    :param fast_coroutine: a boolean indicating if, when `func_impl` is a native coroutine function, the created
+        function should directly return the coroutine created by `func_impl` instead of awaiting it (default: False).
+        See above for details.
+    :param fast_generator: a boolean indicating if, when `func_impl` is a generator function, the created function
+        should directly return the generator created by `func_impl` instead of delegating to it with `yield from`
+        (default: False). See above for details.
+    :param lazy: a boolean indicating if the code of the created function should only be compiled when it is called
+        for the first time (default: False). See above for details.
+    :param defer_annotations: a boolean indicating if the type hints should be carried to `__annotations__` without
+        being evaluated (default: False). See above for details.
+    :param intern_signature: a boolean indicating if the `__signature__` of the created function should be shared with
+        all other functions having an identical signature (default: False). See above for details.
     :param attrs: other keyword attributes that should be set on the function. Note that `func_impl.__dict__` is not
         automatically copied.
     :return:
@@ -203,7 +305,12 @@ def create_function(func_signature,             # type: Union[str, Signature]
         frame = _get_callerframe(offset=1)
     except KeyError:
         frame = _get_callerframe()
-    evaldict, _ = extract_module_and_evaldict(frame)
+    if lazy and not isinstance(func_signature, str):
+        # the caller's namespace is only needed to compile the signature string, or to compile the function now
+        evaldict = dict()
+    else:
+        evaldict, _ = extract_module_and_evaldict(frame)
+    module_globals = getattr(frame, 'f_globals', None)
 
     # name defaults
     user_provided_name = True
@@ -242,10 +349,13 @@ def create_function(func_signature,             # type: Union[str, Signature]
     if module_name is None:
         module_name = getattr_partial_aware(func_impl, '__module__', None)
 
-    # input signature handling
+    # input signature handling. Symbols that need protection are only needed to create the function: they will be
+    # local variables of a factory instead of globals of the created function
+    protected_symbols = dict()
     if isinstance(func_signature, str):
         # transform the string into a Signature and make sure the string contains ":"
-        func_name_from_str, func_signature, func_signature_str = get_signature_from_string(func_signature, evaldict)
+        func_name_from_str, func_signature, func_signature_str = get_signature_from_string(func_signature, evaldict,
+                                                                                           defer_annotations)
 
         # if not explicitly overridden using `func_name`, the name in the string takes over
         if func_name_from_str is not None:
@@ -266,15 +376,29 @@ def create_function(func_signature,             # type: Union[str, Signature]
         elif func_name_from_str is None:
             func_signature_str = co_name + func_signature_str
 
-    elif isinstance(func_signature, Signature):
+        if defer_annotations and not lazy:
+            # the type hints were not evaluated: generate the signature string again, without them
+            if create_lambda:
+                func_signature_str = get_lambda_argument_string(func_signature, evaldict, protected_symbols,
+                                                                include_annotations=False)
+            else:
+                func_signature_str = get_signature_string(co_name, func_signature, evaldict, protected_symbols,
+                                                          include_annotations=False)
+
+    elif isinstance(func_signature, (Signature, CompactSignature)):
         # create the signature string
         create_lambda = not _is_valid_func_def_name(co_name)
 
-        if create_lambda:
+        if lazy:
+            # the signature string will be created from the signature shape, see below
+            func_signature_str = None
+        elif create_lambda:
             # create signature string (or argument string in the case of a lambda function
-            func_signature_str = get_lambda_argument_string(func_signature, evaldict)
+            func_signature_str = get_lambda_argument_string(func_signature, evaldict, protected_symbols,
+                                                            include_annotations=not defer_annotations)
         else:
-            func_signature_str = get_signature_string(co_name, func_signature, evaldict)
+            func_signature_str = get_signature_string(co_name, func_signature, evaldict, protected_symbols,
+                                                      include_annotations=not defer_annotations)
     else:
         raise TypeError("Invalid type for `func_signature`: %s" % type(func_signature))
 
@@ -295,14 +419,115 @@ def create_function(func_signature,             # type: Union[str, Signature]
     if inject_as_first_arg:
         params_str = "%s, %s" % (func_name, params_str)
 
-    if _is_generator_func(func_impl):
+    # when fast_generator / fast_coroutine are used, the plain body returning the generator / coroutine is used and
+    # the created function will be marked as generator / coroutine function
+    mark_as_generator = fast_generator and _is_generator_func(func_impl)
+    mark_as_coroutine = fast_coroutine and markcoroutinefunction is not None and iscoroutinefunction(func_impl)
+    body_kind = (_is_generator_func(func_impl) and not mark_as_generator,
+                 isasyncgenfunction(func_impl),
+                 create_lambda,
+                 iscoroutinefunction(func_impl) and not mark_as_coroutine)
+
+    if lazy:
+        # default values and type hints are set on the function afterwards, they are not needed in the compiled code.
+        # Using the shape of the signature only, the code can be compiled later without the caller's namespace.
+        func_signature_str = _get_signature_shape_string(func_signature)
+        if not create_lambda:
+            func_signature_str = "%s(%s):" % (co_name, func_signature_str)
+
+    body = _get_body(func_signature_str, params_str, *body_kind)
+
+    # only keep weak references to the implementation and to the wrapped function if needed
+    if weak_refs:
+        func_impl = _get_weak_proxy(func_impl)
+        if '__wrapped__' in attrs:
+            attrs['__wrapped__'] = _get_weak_proxy(attrs['__wrapped__'])
+
+    # `evaldict` (a copy of the caller's namespace) is only needed to create the function: do not keep it alive as
+    # the globals of the created function. Use the namespace of the caller module instead, as for any function defined
+    # there (this way forward references in type hints can still be resolved using `__globals__`).
+    if module_globals is None:
+        module_globals = dict(__builtins__=evaldict.get('__builtins__', builtins))
+
+    self_name = func_name if inject_as_first_arg else None
+    if lazy:
+        # create a stub, that will compile the function on first call
+        f = _make_lazy_function("lambda_" if create_lambda else co_name, params_names, body, func_impl, body_kind,
+                                self_name, module_globals, _get_params_shape(func_signature))
+        if qualname is None:
+            qualname = (lambda: None).__code__.co_name if create_lambda else co_name
+        attrs['__signature__'] = _to_signature(func_signature)
+    else:
+        # create the function by compiling code, binding the `_func_impl_` symbol to `func_impl` in a closure
+        protect_eval_dict(evaldict, func_name, params_names)
+        factory_vars = dict(_func_impl_=func_impl)
+        factory_vars.update(protected_symbols)
+        if create_lambda:
+            f = _make("lambda_", params_names, body, evaldict, factory_vars)
+        else:
+            f = _make(co_name, params_names, body, evaldict, factory_vars)
+
+        if qualname is None:
+            qualname = f.__qualname__
+        new_f = FunctionType(f.__code__, module_globals, f.__name__, None, f.__closure__)
+        if self_name in f.__code__.co_freevars:
+            # the function is a closure variable of itself
+            new_f.__closure__[f.__code__.co_freevars.index(self_name)].cell_contents = new_f
+        f = new_f
+
+    # share the `__signature__` with all other functions having an identical signature, if needed
+    if intern_signature:
+        attrs['__signature__'] = _intern_signature(attrs.get('__signature__', func_signature))
+
+    # add the source annotation if needed
+    if add_source:
+        attrs['__source__'] = body
+
+    # add the handler if needed
+    if add_impl:
+        attrs['__func_impl__'] = func_impl
+
+    # share the string attributes with all other functions having the same ones, if needed
+    if compact_metadata:
+        attrs = _get_compact_attrs(attrs)
+
+    # update the signature
+    _update_fields(f, name=func_name, qualname=qualname, doc=doc, annotations=annotations,
+                   defaults=tuple(defaults), kwonlydefaults=kwonlydefaults,
+                   module=module_name, kw=attrs)
+
+    # this has to be done after the `__dict__` is set, since the marks are attributes
+    if mark_as_coroutine:
+        markcoroutinefunction(f)
+    if mark_as_generator:
+        _mark_generator_function(f)
+
+    return f
+
+
+def _get_body(func_signature_str, params_str, generator, async_generator, create_lambda, coroutine):
+    """
+    Returns the source code of a function with signature `func_signature_str`, calling `_func_impl_` with `params_str`.
+
+    :param func_signature_str: the signature string, for example "foo(a, b=1):", or the arguments string if
+        `create_lambda` is True
+    :param params_str: the arguments string used to call `_func_impl_`
+    :param generator: a boolean indicating if the function should delegate to the generator created by `_func_impl_`
+    :param async_generator: a boolean indicating if the function should delegate to the async generator created by
+        `_func_impl_`
+    :param create_lambda: a boolean indicating if a lambda function should be created, named `lambda_` in the code
+    :param coroutine: a boolean indicating if the function should await the coroutine created by `_func_impl_`
+    :return:
+    """
+    if generator:
         if sys.version_info >= (3, 3):
             body = "def %s\n    yield from _func_impl_(%s)\n" % (func_signature_str, params_str)
         else:
             from makefun._main_legacy_py import get_legacy_py_generator_body_template
             body = get_legacy_py_generator_body_template() % (func_signature_str, params_str)
-    elif isasyncgenfunction(func_impl):
-        body = "async def %s\n    async for y in _func_impl_(%s):\n        yield y\n" % (func_signature_str, params_str)
+    elif async_generator:
+        from makefun._main_py36_and_higher import get_async_generator_body_template
+        body = get_async_generator_body_template() % (func_signature_str, params_str)
     elif create_lambda:
         if func_signature_str:
             body = "lambda_ = lambda %s: _func_impl_(%s)\n" % (func_signature_str, params_str)
@@ -311,40 +536,339 @@ def create_function(func_signature,             # type: Union[str, Signature]
     else:
         body = "def %s\n    return _func_impl_(%s)\n" % (func_signature_str, params_str)
 
-    if iscoroutinefunction(func_impl):
+    if coroutine:
         body = ("async " + body).replace('return _func_impl_', 'return await _func_impl_')
 
-    # create the function by compiling code, mapping the `_func_impl_` symbol to `func_impl`
-    protect_eval_dict(evaldict, func_name, params_names)
-    evaldict['_func_impl_'] = func_impl
-    if create_lambda:
-        f = _make("lambda_", params_names, body, evaldict)
+    return body
+
+
+def _get_signature_shape_string(func_signature):
+    """
+    Returns the arguments string corresponding to `func_signature` without the default values and type hints, for
+    example "a, b, /, c, *args, d, **kwargs". A function compiled with this string has the same code than one compiled
+    with the full signature: default values and type hints are attributes of the function, not of its code.
+
+    :param func_signature:
+    :return:
+    """
+    params = []
+    prev_kind = None
+    for p_name, p in func_signature.parameters.items():
+        kind = p.kind
+        if prev_kind is Parameter.POSITIONAL_ONLY and kind is not Parameter.POSITIONAL_ONLY:
+            params.append('/')
+        if kind is Parameter.KEYWORD_ONLY and prev_kind not in (Parameter.VAR_POSITIONAL, Parameter.KEYWORD_ONLY):
+            params.append('*')
+
+        if kind is Parameter.VAR_POSITIONAL:
+            params.append('*' + p_name)
+        elif kind is Parameter.VAR_KEYWORD:
+            params.append('**' + p_name)
+        else:
+            params.append(p_name)
+        prev_kind = kind
+
+    if prev_kind is Parameter.POSITIONAL_ONLY:
+        params.append('/')
+
+    return ', '.join(params)
+
+
+def get_signature_shape_key(s,        # type: Union[Signature, CompactSignature]
+                            func=None  # type: Callable
+                            ):
+    # type: (...) -> tuple
+    """
+    Returns a canonical, hashable key describing the "shape" of signature `s`: the names and kinds of its parameters,
+    and whether they have a default value. If `func` is provided, its flavour is added: 'coroutine', 'generator' or
+    'async_generator' (None for other functions).
+
+    Unlike `hash(s)`, this key does not depend on the default values and type hints, so it works for signatures with
+    unhashable default values (lists, dicts...), and it is much faster to compute than `str(s)`. Functions with the
+    same shape key accept the same arguments, so it can be used as a cache key for code templates, argument binders or
+    adapters. For example makefun uses it to share the code of functions created with `lazy=True`. It is computed only
+    once for `CompactSignature` objects and interned signatures (see `intern_signature` in `create_function`).
+
+    :param s: the signature
+    :param func: an optional function, whose flavour should be included in the key
+    :return: a tuple (flavour, ((name, kind, has_default), ...))
+    """
+    if func is None:
+        flavour = None
+    elif isasyncgenfunction(func):
+        flavour = 'async_generator'
+    elif iscoroutinefunction(func):
+        flavour = 'coroutine'
+    elif _is_generator_func(func):
+        flavour = 'generator'
     else:
-        f = _make(co_name, params_names, body, evaldict)
+        flavour = None
+    return flavour, _get_params_shape(s)
 
-    # add the source annotation if needed
-    if add_source:
-        attrs['__source__'] = body
 
-    # add the handler if needed
-    if add_impl:
-        attrs['__func_impl__'] = func_impl
+def _get_params_shape(s):
+    """
+    Returns the tuple of (name, kind, has_default) of all parameters of `s`, cached on `s` when possible.
 
-    # update the signature
-    _update_fields(f, name=func_name, qualname=qualname, doc=doc, annotations=annotations,
-                   defaults=tuple(defaults), kwonlydefaults=kwonlydefaults,
-                   module=module_name, kw=attrs)
+    :param s:
+    :return:
+    """
+    cache = isinstance(s, (CompactSignature, _InternedSignature))
+    if cache:
+        try:
+            return s._params_shape
+        except AttributeError:
+            pass
+
+    shape = tuple((p.name, p.kind, p.default is not Parameter.empty) for p in s.parameters.values())
+    if cache:
+        s._params_shape = shape
+    return shape
+
+
+# The lock used to compile the functions created with `lazy=True`, so that each of them is compiled only once
+_lazy_compile_lock = Lock()
+
+# The code of the stubs used by the functions created with `lazy=True`, by body kind and self-reference name
+_lazy_stub_codes = dict()
+
+# The compiled code of the functions created with `lazy=True`, by code key (see `_make_lazy_function`). The code only
+# depends on the name and shape of the function, so it is shared by all functions with the same code key.
+_lazy_codes = dict()
+
+# The maximum number of entries in `_lazy_codes`. When it is reached the cache is cleared.
+LAZY_CODES_CACHE_SIZE = 1024
+
+
+class _LazyCompiler(object):
+    """
+    The `_lazy_compiler_` of a function created with `lazy=True`.
+
+    The created function initially has the code of a generic stub calling `_lazy_compiler_(*args, **kwargs)`. On the
+    first call this object compiles the actual code of the function (or gets it from `_lazy_codes` if a function with
+    the same code key was already compiled) and replaces the `__code__` of the function with it. Then it calls the
+    function again. The calls that were already running the stub meanwhile also end up here, and are forwarded to the
+    compiled code: they never call the implementation directly, so the signature is always enforced.
+    """
+    __slots__ = ('f', 'func_impl', 'funcname', 'params_names', 'body', 'self_name', 'code_key')
+
+    def __init__(self, funcname, params_names, body, func_impl, self_name, code_key):
+        self.f = None
+        self.func_impl = func_impl
+        self.funcname = funcname
+        self.params_names = params_names
+        self.body = body
+        self.self_name = self_name
+        self.code_key = code_key
+
+    def __call__(self, *args, **kwargs):
+        f = self.f
+        with _lazy_compile_lock:
+            # note: another thread may have compiled the function in the meantime
+            if self.body is not None:
+                f.__code__ = _get_lazy_code(self.funcname, self.params_names, self.body, self.self_name,
+                                            self.code_key)
+                self.body = self.params_names = None
+
+        if self.self_name is not None:
+            # the stub injected the function as first argument, the compiled code will do it again
+            args = args[1:]
+        return f(*args, **kwargs)
+
+
+def _make_lazy_function(funcname, params_names, body, func_impl, body_kind, self_name, func_globals, params_shape):
+    """
+    Creates a function with `lazy=True`: its `body` will only be compiled on the first call. Until then it has the code
+    of a generic stub, see `_LazyCompiler`.
+
+    The code of the function only depends on its name, on `body_kind`, on `self_name` and on the shape of its signature,
+    that form its "code key". If a function with the same code key was already compiled, its code is used directly.
+    Generator, async generator and coroutine functions are compiled immediately: the code of a stub of these kinds
+    only runs when the generator is iterated or the coroutine awaited, so it could not check the arguments when the
+    function is called.
+
+    :param funcname: the name of the function in `body`
+    :param params_names:
+    :param body:
+    :param func_impl:
+    :param body_kind: the arguments of `_get_body` defining the kind of function to create
+    :param self_name: the name of the function if it is a closure variable of itself (`inject_as_first_arg=True`)
+    :param func_globals:
+    :param params_shape: the shape of the signature, see `get_signature_shape_key`
+    :return:
+    """
+    if '_lazy_compiler_' in params_names:
+        raise NameError('_lazy_compiler_ is overridden in\n%s' % body)
+    code_key = (funcname, body_kind, self_name, params_shape)
+    generator, async_generator, _, coroutine = body_kind
+    if code_key in _lazy_codes or generator or async_generator or coroutine:
+        # no need for a stub
+        code = _get_lazy_code(funcname, params_names, body, self_name, code_key)
+        return _make_closure_function(code, func_globals, funcname, func_impl, None, self_name)
+
+    stub_key = (body_kind, self_name)
+    try:
+        stub_code = _lazy_stub_codes[stub_key]
+    except KeyError:
+        create_lambda = body_kind[2]
+        stub_params_str = "*_args_, **_kwargs_" if self_name is None else "%s, *_args_, **_kwargs_" % self_name
+        stub_signature_str = "*_args_, **_kwargs_" if create_lambda else "_lazy_stub_(*_args_, **_kwargs_):"
+        stub_body = _get_lazy_body(_get_body(stub_signature_str, stub_params_str, *body_kind), '_lazy_compiler_')
+        stub_code = _make("lambda_" if create_lambda else "_lazy_stub_", (), stub_body, dict(),
+                          _get_lazy_closure_vars(self_name)).__code__
+        _lazy_stub_codes[stub_key] = stub_code
+
+    compiler = _LazyCompiler(funcname, params_names, body, func_impl, self_name, code_key)
+    f = _make_closure_function(stub_code, func_globals, funcname, func_impl, compiler, self_name)
+    compiler.f = f
+    return f
+
+
+def _get_lazy_code(funcname, params_names, body, self_name, code_key):
+    """
+    Returns the code of a function created with `lazy=True`, see `_make_lazy_function`. It is only compiled if no
+    function with the same `code_key` was compiled before: otherwise the compiled code is copied with a new unique
+    filename, as for all generated functions (see `_make`).
+
+    :param funcname:
+    :param params_names:
+    :param body:
+    :param self_name: the name of the function if it is a closure variable of itself (`inject_as_first_arg=True`)
+    :param code_key:
+    :return:
+    """
+    try:
+        code = _lazy_codes[code_key]
+    except KeyError:
+        code = _make(funcname, params_names, _get_lazy_body(body, '_func_impl_'), dict(),
+                     _get_lazy_closure_vars(self_name)).__code__
+        if len(_lazy_codes) >= LAZY_CODES_CACHE_SIZE:
+            _lazy_codes.clear()
+        _lazy_codes[code_key] = code
+        return code
+    return code.replace(co_filename='<makefun-gen-%d>' % next(_compile_count))
+
+
+def _get_lazy_closure_vars(self_name):
+    """
+    Returns the factory variables used to compile the stub and the actual code of functions created with `lazy=True`.
+    Both have the same closure variables, so that the code of the function can be replaced.
+
+    :param self_name: the name of the function if it is a closure variable of itself (`inject_as_first_arg=True`)
+    :return:
+    """
+    factory_vars = dict(_func_impl_=None, _lazy_compiler_=None)
+    if self_name is not None:
+        factory_vars[self_name] = None
+    return factory_vars
+
+
+def _get_lazy_body(body, callee):
+    """
+    Returns `body`, the source of a function calling `_func_impl_`, where `callee` (`'_func_impl_'` for the actual code
+    or `'_lazy_compiler_'` for the stub) is called instead. The other name is referenced in a branch that is removed by
+    the compiler, so that the stub and the actual code have the same closure variables at no cost.
+
+    :param body:
+    :param callee:
+    :return:
+    """
+    other = '_lazy_compiler_' if callee == '_func_impl_' else '_func_impl_'
+    return body.replace('_func_impl_(', '(%s if 1 else %s)(' % (callee, other))
+
+
+def _make_closure_function(code, func_globals, funcname, func_impl, compiler, self_name):
+    """
+    Creates a function from `code`, whose closure variables are `_func_impl_`, `_lazy_compiler_` and optionally
+    `self_name`, see `_get_lazy_closure_vars`.
+
+    :param code:
+    :param func_globals:
+    :param funcname:
+    :param func_impl: the value of the `_func_impl_` closure variable
+    :param compiler: the value of the `_lazy_compiler_` closure variable, used by the stub only
+    :param self_name: the name of the closure variable containing the function itself, or None
+    :return:
+    """
+    closure = tuple(CellType() for _ in code.co_freevars)
+    f = FunctionType(code, func_globals, funcname, None, closure)
+    closure[code.co_freevars.index('_func_impl_')].cell_contents = func_impl
+    closure[code.co_freevars.index('_lazy_compiler_')].cell_contents = compiler
+    if self_name is not None:
+        closure[code.co_freevars.index(self_name)].cell_contents = f
+    return f
+
+
+def _get_weak_proxy(obj):
+    """
+    Returns a weak proxy to `obj`, or `obj` itself if it is already a weak proxy.
+    Calling the proxy or accessing its attributes raises a `ReferenceError` once `obj` has been garbage-collected.
+
+    Bound methods are created on each attribute access, so a weak proxy to a bound method would die immediately: a
+    `_WeakMethodProxy` is returned instead, that only dies with the object the method is bound to.
+
+    :param obj:
+    :return:
+    """
+    if isinstance(obj, (ProxyTypes, _WeakMethodProxy)):
+        return obj
+    if isinstance(obj, MethodType):
+        return _WeakMethodProxy(obj)
+    return weak_proxy(obj)
+
+
+class _WeakMethodProxy(object):
+    """
+    A weak proxy to a bound method, based on `weakref.WeakMethod`. Calling it or accessing its attributes raises a
+    `ReferenceError` once the object the method is bound to (or the function) has been garbage-collected.
+    """
+    __slots__ = ('_ref',)
+
+    def __init__(self, method):
+        self._ref = WeakMethod(method)
+
+    def _get_method(self):
+        method = self._ref()
+        if method is None:
+            raise ReferenceError("weakly-referenced object no longer exists")
+        return method
+
+    def __call__(self, *args, **kwargs):
+        return self._get_method()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._get_method(), name)
+
+    def __repr__(self):
+        return "<weak method proxy to %r>" % (self._ref(),)
+
+
+# The mark set on functions created with `fast_generator=True`, similar to `inspect.markcoroutinefunction`
+_generator_mark = object()
+
+
+def _mark_generator_function(f):
+    """
+    Marks `f` as a generator function for makefun, although it is a plain function returning a generator.
+    Note that unlike `inspect.markcoroutinefunction` this is not seen by `inspect.isgeneratorfunction`.
 
+    :param f:
+    :return:
+    """
+    f._is_generator_marker = _generator_mark
     return f
 
 
 def _is_generator_func(func_impl):
     """
-    Return True if the func_impl is a generator
+    Return True if the func_impl is a generator, or a plain function returning a generator created with
+    `fast_generator=True`.
     :param func_impl:
     :return:
     """
-    if (3, 5) <= sys.version_info < (3, 6):
+    if getattr(func_impl, '_is_generator_marker', None) is _generator_mark:
+        return True
+    elif (3, 5) <= sys.version_info < (3, 6):
         # with Python 3.5 isgeneratorfunction returns True for all coroutines
         # however we know that it is NOT possible to have a generator
         # coroutine in python 3.5: PEP525 was not there yet
@@ -386,15 +910,24 @@ class _SymbolRef:
         return self.varname
 
 
-def get_signature_string(func_name, func_signature, evaldict):
+def get_signature_string(func_name, func_signature, evaldict, protected_symbols=None, include_annotations=True):
     """
     Returns the string to be used as signature.
-    If there is a non-native symbol in the defaults, it is created as a variable in the evaldict
+    If there is a non-native symbol in the defaults, it is created as a variable in the evaldict, or in
+    `protected_symbols` if provided.
     :param func_name:
     :param func_signature:
+    :param protected_symbols: an optional dictionary where to store the protected symbols instead of the evaldict
+    :param include_annotations: if False, the type hints are not included in the string, so they are neither
+        evaluated nor protected.
     :return:
     """
-    no_type_hints_allowed = sys.version_info < (3, 5)
+    no_type_hints_allowed = sys.version_info < (3, 5) or not include_annotations
+    if protected_symbols is None:
+        protected_symbols = evaldict
+
+    # the protected parameters are created with the same type as the signature (inspect __init__ methods are slow)
+    param_cls = CompactParameter if isinstance(func_signature, CompactSignature) else Parameter
 
     # protect the parameters if needed
     new_params = []
@@ -402,7 +935,8 @@ def get_signature_string(func_name, func_signature, evaldict):
     for p_name, p in func_signature.parameters.items():
         # if default value can not be evaluated, protect it
         default_needs_protection = _signature_symbol_needs_protection(p.default, evaldict)
-        new_default = _protect_signature_symbol(p.default, default_needs_protection, "DEFAULT_%s" % p_name, evaldict)
+        new_default = _protect_signature_symbol(p.default, default_needs_protection, "DEFAULT_%s" % p_name,
+                                                 protected_symbols)
 
         if no_type_hints_allowed:
             new_annotation = Parameter.empty
@@ -411,12 +945,12 @@ def get_signature_string(func_name, func_signature, evaldict):
             # if type hint can not be evaluated, protect it
             annotation_needs_protection = _signature_symbol_needs_protection(p.annotation, evaldict)
             new_annotation = _protect_signature_symbol(p.annotation, annotation_needs_protection, "HINT_%s" % p_name,
-                                                       evaldict)
+                                                       protected_symbols)
 
         # only create if necessary (inspect __init__ methods are slow)
         if default_needs_protection or annotation_needs_protection:
             # replace the parameter with the possibly new default and hint
-            p = Parameter(p.name, kind=p.kind, default=new_default, annotation=new_annotation)
+            p = param_cls(p.name, kind=p.kind, default=new_default, annotation=new_annotation)
             params_changed = True
 
         new_params.append(p)
@@ -428,11 +962,11 @@ def get_signature_string(func_name, func_signature, evaldict):
         # if return type hint can not be evaluated, protect it
         return_needs_protection = _signature_symbol_needs_protection(func_signature.return_annotation, evaldict)
         new_return_annotation = _protect_signature_symbol(func_signature.return_annotation, return_needs_protection,
-                                                          "RETURNHINT", evaldict)
+                                                          "RETURNHINT", protected_symbols)
 
     # only create new signature if necessary (inspect __init__ methods are slow)
     if params_changed or return_needs_protection:
-        s = Signature(parameters=new_params, return_annotation=new_return_annotation)
+        s = func_signature.replace(parameters=new_params, return_annotation=new_return_annotation)
     else:
         s = func_signature
 
@@ -440,15 +974,19 @@ def get_signature_string(func_name, func_signature, evaldict):
     return "%s%s:" % (func_name, s)
 
 
-def get_lambda_argument_string(func_signature, evaldict):
+def get_lambda_argument_string(func_signature, evaldict, protected_symbols=None, include_annotations=True):
     """
     Returns the string to be used as arguments in a lambda function definition.
-    If there is a non-native symbol in the defaults, it is created as a variable in the evaldict
+    If there is a non-native symbol in the defaults, it is created as a variable in the evaldict, or in
+    `protected_symbols` if provided.
     :param func_name:
     :param func_signature:
+    :param protected_symbols: an optional dictionary where to store the protected symbols instead of the evaldict
+    :param include_annotations: if False, the type hints are not included in the string. Note that lambda functions
+        can not have type hints anyway.
     :return:
     """
-    return get_signature_string('', func_signature, evaldict)[1:-2]
+    return get_signature_string('', func_signature, evaldict, protected_symbols, include_annotations)[1:-2]
 
 
 TYPES_WITH_SAFE_REPR = (int, str, bytes, bool)
@@ -498,54 +1036,166 @@ def _protect_signature_symbol(val, needs_protection, varname, evaldict):
         return val
 
 
-def get_signature_from_string(func_sig_str, evaldict):
+def get_signature_from_string(func_sig_str, evaldict, defer_annotations=False):
     """
     Creates a `Signature` object from the given function signature string.
 
     :param func_sig_str:
+    :param defer_annotations: if True, the type hints are not evaluated: they are kept as strings in the signature,
+        as with `from __future__ import annotations`.
     :return: (func_name, func_sig, func_sig_str). func_sig_str is guaranteed to contain the ':' symbol already
     """
     # escape leading newline characters
     if func_sig_str.startswith('\n'):
         func_sig_str = func_sig_str[1:]
 
-    # match the provided signature. note: fullmatch is not supported in python 2
-    def_match = FUNC_DEF.match(func_sig_str)
-    if def_match is None:
-        raise SyntaxError('The provided function template is not valid: "%s" does not match '
-                          '"<func_name>(<func_args>)[ -> <return-hint>]".\n For information the regex used is: "%s"'
-                          '' % (func_sig_str, FUNC_DEF.pattern))
-    groups = def_match.groupdict()
-
-    # extract function name and parameter names list
-    func_name = groups['funcname']
-    if func_name is None or func_name == '':
+    # parse the provided signature (macroscopic check only: we do not look inside params, `signature` will do it)
+    func_name, has_colon, checked = _parse_signature_string(func_sig_str, return_checked=True)
+    if func_name is None:
         func_name_ = 'dummy'
-        func_name = None
     else:
         func_name_ = func_name
-    # params_str = groups['params']
-    # params_names = extract_params_names(params_str)
 
-    # find the keyword parameters and the others
-    # posonly_names, kwonly_names, unrestricted_names = separate_positional_and_kw(params_names)
-
-    colon_end = groups['colon']
-    cmt_return_hint = groups['comment_return_hint']
-    if (colon_end is None or len(colon_end) == 0) \
-            and (cmt_return_hint is None or len(cmt_return_hint) == 0):
+    if not has_colon:
         func_sig_str = func_sig_str + ':'
 
     # Create a dummy function
     # complete the string if name is empty, so that we can actually use _make
     func_sig_str_ = (func_name_ + func_sig_str) if func_name is None else func_sig_str
     body = 'def %s\n    pass\n' % func_sig_str_
-    dummy_f = _make(func_name_, [], body, evaldict)
+    try:
+        dummy_f = _make(func_name_, [], body, evaldict,
+                        compile_flags=DEFERRED_ANNOTATIONS_FLAG if defer_annotations else 0)
+    except SyntaxError:
+        if not checked:
+            # the fast path does not check the brackets: raise the detailed error if the string is not well-formed
+            _check_signature_string(func_sig_str)
+        raise
 
     # return its signature
     return func_name, signature(dummy_f), func_sig_str
 
 
+# The fast path of `_parse_signature_string`, for well-formed signatures without comments. The arguments are a
+# sequence of characters, of single-line string literals without escape sequences and of parenthesis (one level deep):
+# they can not contain a closing parenthesis outside of these, so the pattern can not end the arguments too early.
+# Each part is matched in an atomic group (a lookahead followed by a backreference to what it matched), so that the
+# pattern never backtracks and runs in linear time.
+_SIGNATURE_FAST = re.compile(r"(?=(?P<head>\s*(?P<funcname>\w*)\s*))(?P=head)"
+                             r"\((?=(?P<params>(?:[^'\"#()\\]+|\([^'\"#()\\]*\)|'[^'\\\n]*'|\"[^\"\\\n]*\")*))"
+                             r"(?P=params)\)"
+                             r"(?=(?P<tail>\s*(?:->[^:'\"#()\\]*)?(?P<colon>:)?\s*))(?P=tail)$")
+
+# Patterns used by `_check_signature_string`. They do not contain nested repetitions of overlapping alternatives, so
+# they can not backtrack much and run in linear time.
+_WHITESPACE = re.compile(r'\s*')
+_NAME = re.compile(r'\w*')
+_PARAMS_TOKEN = re.compile(r"(?P<bracket>[()\[\]{}])"               # a bracket
+                           r"|#[^\n]*"                              # a comment
+                           r"|'''(?:[^'\\]|\\.|'(?!''))*'''"        # a string literal. Note: string prefixes do not
+                           r'|"""(?:[^"\\]|\\.|"(?!""))*"""'        # change how the end of a literal is found.
+                           r"|'(?:[^'\\\n]|\\.)*'"
+                           r'|"(?:[^"\\\n]|\\.)*"'
+                           r"|(?P<unterminated>['\"])", re.DOTALL)  # an unterminated string literal
+
+
+def _parse_signature_string(func_sig_str, return_checked=False):
+    """
+    Checks that `func_sig_str` has the form "<func_name>(<func_args>)[ -> <return-hint>][:][ # <comment-hint>]", where
+    the function name is optional. The contents of the arguments and of the return hint are not checked: the compiler
+    will do it later.
+
+    Common signatures are matched with a regular expression. This does not check that the brackets inside the
+    arguments are balanced, but this is not needed since the compiler will fail on such signatures. The other strings
+    are checked with `_check_signature_string`.
+
+    :param func_sig_str:
+    :param return_checked: if True, a third element is returned, indicating if `_check_signature_string` was used.
+    :return: a tuple (func_name, has_colon). func_name is None if the string does not contain a function name.
+    """
+    match = _SIGNATURE_FAST.match(func_sig_str)
+    if match is not None:
+        res = match.group('funcname') or None, match.group('colon') is not None
+        checked = False
+    else:
+        res = _check_signature_string(func_sig_str)
+        checked = True
+    return res + (checked,) if return_checked else res
+
+
+def _check_signature_string(func_sig_str):
+    """
+    Checks that `func_sig_str` has the form "<func_name>(<func_args>)[ -> <return-hint>][:][ # <comment-hint>]", where
+    the function name is optional, see `_parse_signature_string`.
+
+    This is done in a single pass over the string, so the time is linear in its length even for malformed inputs. The
+    closing parenthesis of the arguments is found by tracking nested brackets, while skipping string literals and
+    comments.
+
+    :param func_sig_str:
+    :return: a tuple (func_name, has_colon). func_name is None if the string does not contain a function name.
+    """
+    n = len(func_sig_str)
+
+    # optional function name, possibly surrounded with whitespace
+    name_start = _WHITESPACE.match(func_sig_str).end()
+    i = _NAME.match(func_sig_str, name_start).end()
+    func_name = func_sig_str[name_start:i] or None
+    i = _WHITESPACE.match(func_sig_str, i).end()
+
+    # arguments: find the matching closing parenthesis
+    if i >= n or func_sig_str[i] != '(':
+        _raise_invalid_signature_string(func_sig_str, "'(' expected at position %s" % i)
+    depth = 0
+    for token in _PARAMS_TOKEN.finditer(func_sig_str, i):
+        bracket = token.group('bracket')
+        if bracket is None:
+            # a comment or string literal: skip it
+            if token.group('unterminated') is not None:
+                _raise_invalid_signature_string(func_sig_str, "unterminated string literal")
+        elif bracket in '([{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                i = token.start()
+                break
+    else:
+        i = n
+
+    if i < 0 or i >= n or depth != 0 or func_sig_str[i] != ')':
+        _raise_invalid_signature_string(func_sig_str, "the arguments parenthesis is not closed")
+    i = _WHITESPACE.match(func_sig_str, i + 1).end()
+
+    # optional return type hint
+    if func_sig_str.startswith('->', i):
+        colon_idx = func_sig_str.find(':', i + 2)
+        if colon_idx < 0:
+            colon_idx = n
+        if colon_idx == i + 2:
+            _raise_invalid_signature_string(func_sig_str, "empty return type hint")
+        i = colon_idx
+
+    # optional colon, possibly followed with a comment (for example a type comment)
+    has_colon = i < n and func_sig_str[i] == ':'
+    if has_colon:
+        i = _WHITESPACE.match(func_sig_str, i + 1).end()
+        if i < n and func_sig_str[i] == '#':
+            if i + 1 == n:
+                _raise_invalid_signature_string(func_sig_str, "empty comment after ':'")
+            i = n
+
+    if _WHITESPACE.match(func_sig_str, i).end() < n:
+        _raise_invalid_signature_string(func_sig_str, "unexpected characters at position %s" % i)
+
+    return func_name, has_colon
+
+
+def _raise_invalid_signature_string(func_sig_str, details):
+    raise SyntaxError('The provided function template is not valid: "%s" does not match '
+                      '"<func_name>(<func_args>)[ -> <return-hint>]": %s' % (func_sig_str, details))
+
+
 # def extract_params_names(params_str):
 #     return [m.groupdict()['name'] for m in PARAM_DEF.finditer(params_str)]
 
@@ -687,15 +1337,23 @@ def protect_eval_dict(evaldict, func_name, params_names):
 _compile_count = itertools.count()
 
 
-def _make(funcname, params_names, body, evaldict=None):
+def _make(funcname, params_names, body, evaldict=None, factory_vars=None, compile_flags=0):
     """
     Make a new function from a given template and update the signature
 
+    If `factory_vars` is provided, the template is compiled inside a generated factory function receiving these
+    variables as arguments, and the function is created by calling this factory. These variables are therefore not
+    stored in `evaldict`: the ones used in the function body (such as `_func_impl_`) are closure variables of the
+    created function, and the other ones (such as protected default values and type hints) are only local variables
+    of the factory when the function definition is executed.
+
     :param func_name:
     :param params_names:
     :param body:
     :param evaldict:
-    :param add_source:
+    :param factory_vars: an optional dictionary of variables to bind as local variables of a factory
+    :param compile_flags: optional flags passed to `compile`, for example `DEFERRED_ANNOTATIONS_FLAG`. Such code is
+        not generated ahead of time, since the flags would apply to the whole generated module.
     :return:
     """
     evaldict = evaldict or {}
@@ -706,24 +1364,200 @@ def _make(funcname, params_names, body, evaldict=None):
     if not body.endswith('\n'):  # newline is needed for old Pythons
         raise ValueError("body should end with a newline")
 
-    # Ensure each generated function has a unique filename for profilers
-    # (such as cProfile) that depend on the tuple of (<filename>,
-    # <definition line>, <function name>) being unique.
-    filename = '<makefun-gen-%d>' % (next(_compile_count),)
-    try:
-        code = compile(body, filename, 'single')
-        exec(code, evaldict)  # noqa
-    except BaseException:
-        print('Error in generated code:', file=sys.stderr)
-        print(body, file=sys.stderr)
-        raise
+    if factory_vars:
+        code_str = "def _factory_(%s):\n%s    return %s\n" % (', '.join(factory_vars), _indent_code(body), funcname)
+    else:
+        code_str = body
+
+    # the name of the object defined by `code_str`
+    defined_name = '_factory_' if factory_vars else funcname
+
+    # use the code generated ahead of time for the caller module if available, see `makefun.aot`
+    module_name = evaldict.get('__name__') if not compile_flags else None
+    aot_holder = _get_aot_holder(module_name, code_str) if module_name is not None else None
+    if aot_holder is not None:
+        # the holder executes `code_str` in a function, with `evaldict` as globals, and returns the defined object
+        evaldict[defined_name] = FunctionType(aot_holder.__code__, evaldict)()
+    else:
+        # Ensure each generated function has a unique filename for profilers
+        # (such as cProfile) that depend on the tuple of (<filename>,
+        # <definition line>, <function name>) being unique.
+        filename = '<makefun-gen-%d>' % (next(_compile_count),)
+        try:
+            code = compile(code_str, filename, 'single', compile_flags)
+            exec(code, evaldict)  # noqa
+        except BaseException:
+            print('Error in generated code:', file=sys.stderr)
+            print(code_str, file=sys.stderr)
+            raise
+
+        if _aot_recorder is not None and module_name is not None:
+            _aot_recorder.append((module_name, code_str, defined_name))
 
     # extract the function from compiled code
-    func = evaldict[funcname]
+    if factory_vars:
+        func = evaldict.pop('_factory_')(**factory_vars)
+        # the function was defined in the factory: remove the factory from its qualified name
+        func.__qualname__ = func.__qualname__.rsplit('_factory_.<locals>.', 1)[-1]
+    else:
+        func = evaldict[funcname]
 
     return func
 
 
+# The suffix of the modules generated by `makefun.aot`: the code generated when importing `<module>` is stored in
+# the `<module>_makefun_aot` module
+AOT_MODULE_SUFFIX = '_makefun_aot'
+
+# When not None, the list where `_make` records all the code it compiles, see `makefun.aot`
+_aot_recorder = None
+
+# The registries of the modules generated by `makefun.aot`, by module name. None if there is no such module.
+_aot_registries = dict()
+
+
+def _get_aot_holder(module_name, code_str):
+    """
+    Returns the function generated by `makefun.aot` for `code_str` in the module named `module_name`, or None if it
+    was not generated (no `<module_name>_makefun_aot` module, or a module generated from a different version of the
+    code). The registry of each module is loaded once.
+
+    :param module_name:
+    :param code_str:
+    :return:
+    """
+    if _aot_recorder is not None:
+        # generating the ahead-of-time code: do not use a previous version
+        return None
+
+    try:
+        registry = _aot_registries[module_name]
+    except KeyError:
+        registry = None
+        aot_module_name = module_name + AOT_MODULE_SUFFIX
+        try:
+            if find_spec(aot_module_name) is not None:
+                registry = import_module(aot_module_name).MAKEFUN_AOT
+        except (ImportError, ValueError):
+            # for example the parent module is not a package
+            pass
+        _aot_registries[module_name] = registry
+
+    if registry is None:
+        return None
+    return registry.get(code_str)
+
+
+def _indent_code(code_str):
+    """
+    Indents all lines of `code_str` with 4 spaces, except the lines that are the continuation of a multi-line token
+    (a triple-quoted string, or a string containing an escaped newline), since their value would be modified.
+
+    :param code_str:
+    :return:
+    """
+    lines = code_str.splitlines(True)
+    if "'''" not in code_str and '"""' not in code_str and '\\\n' not in code_str:
+        # fast path: there can not be any multi-line token
+        return ''.join('    ' + line for line in lines)
+
+    continuation_rows = set()
+    for tok in generate_tokens(iter(lines).__next__):
+        (start_row, _), (end_row, _) = tok[2], tok[3]
+        continuation_rows.update(range(start_row + 1, end_row + 1))
+    return ''.join(line if (i + 1) in continuation_rows else ('    ' + line) for i, line in enumerate(lines))
+
+
+# The string attributes shared by the functions created with `compact_metadata=True`, see `_get_compact_attrs`
+_shared_strings = dict()
+
+# The maximum number of entries in `_shared_strings`. When it is reached the cache is cleared.
+SHARED_STRINGS_CACHE_SIZE = 1024
+
+
+def _get_compact_attrs(attrs):
+    """
+    Returns a new dictionary equal to `attrs`, to be used as the `__dict__` of a function created with
+    `compact_metadata=True`. String values (such as the `__source__`) are replaced with the equal string already used
+    by previously created functions, so that it is stored only once. Other values (such as `__func_impl__` or
+    `__wrapped__`) are specific to each function and kept as is.
+
+    Each function gets its own dictionary so that setting an attribute on one of them never changes the others.
+
+    :param attrs:
+    :return:
+    """
+    new_attrs = dict()
+    for k, v in attrs.items():
+        if isinstance(v, string_types):
+            try:
+                v = _shared_strings[v]
+            except KeyError:
+                if len(_shared_strings) >= SHARED_STRINGS_CACHE_SIZE:
+                    _shared_strings.clear()
+                _shared_strings[v] = v
+        new_attrs[k] = v
+    return new_attrs
+
+
+class _InternedSignature(Signature):
+    """
+    The signatures returned by `_intern_signature`. It is a `Signature` that can be weakly referenced, so that it can
+    be stored in `_interned_signatures`, and that caches its hash and its shape (see `get_signature_shape_key`).
+    """
+    __slots__ = ('__weakref__', '_hash', '_params_shape')
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = h = Signature.__hash__(self)
+            return h
+
+
+# All interned signatures currently in use, so that identical ones are created only once
+_interned_signatures = WeakValueDictionary()
+
+
+def _get_intern_key(obj):
+    """
+    Returns the key of a default value or type hint in `_interned_signatures`: the type and value of objects with a safe
+    `repr`, that are immutable, and the `id()` of all other objects.
+    """
+    t = type(obj)
+    return (t, obj) if t in TYPES_WITH_SAFE_REPR else id(obj)
+
+
+def _intern_signature(s):
+    # type: (Union[Signature, CompactSignature]) -> Signature
+    """
+    Returns a `Signature` equal to `s`, shared with all other signatures interned with the same parameter names and
+    kinds, the same default values and type hints and the same return type hint. They are compared by identity, except
+    integers, strings and bytes that are compared by value. This is safe because the returned signature holds
+    references to all of them: the `id()` of an object can not be reused while the corresponding entry exists.
+
+    :param s:
+    :return:
+    """
+    if type(s) is _InternedSignature:
+        return s
+
+    key = (tuple((p.name, p.kind, _get_intern_key(p.default), _get_intern_key(p.annotation))
+                 for p in s.parameters.values()),
+           _get_intern_key(s.return_annotation))
+    try:
+        return _interned_signatures[key]
+    except KeyError:
+        if isinstance(s, CompactSignature):
+            params = [p.to_parameter() for p in s.parameters.values()]
+        else:
+            params = s.parameters.values()
+        # the signature was already validated when created
+        interned = _InternedSignature(params, return_annotation=s.return_annotation, __validate_parameters__=False)
+        _interned_signatures[key] = interned
+        return interned
+
+
 def _update_fields(
         func, name, qualname=None, doc=None, annotations=None, defaults=(), kwonlydefaults=None, module=None, kw=None
 ):
@@ -774,7 +1608,7 @@ def _get_callerframe(offset=0):
 
 
 def wraps(wrapped_fun,
-          new_sig=None,               # type: Union[str, Signature]
+          new_sig=None,               # type: Union[str, Signature, CompactSignature]
           prepend_args=None,          # type: Union[str, Parameter, Iterable[Union[str, Parameter]]]
           append_args=None,           # type: Union[str, Parameter, Iterable[Union[str, Parameter]]]
           remove_args=None,           # type: Union[str, Iterable[str]]
@@ -786,6 +1620,14 @@ def wraps(wrapped_fun,
           doc=None,                   # type: str
           qualname=None,              # type: str
           module_name=None,           # type: str
+          compact_metadata=False,     # type: bool
+          weak_refs=False,            # type: bool
+          fast_coroutine=False,       # type: bool
+          fast_generator=False,       # type: bool
+          lazy=False,                 # type: bool
+          defer_annotations=False,    # type: bool
+          intern_signature=False,     # type: bool
+          enforce_signature=True,     # type: bool
           **attrs
           ):
     """
@@ -835,8 +1677,8 @@ def wraps(wrapped_fun,
         you can either use `remove/prepend/append_args`, or pass a non-None `new_sig`. It can be either a string
         without 'def' such as "foo(a, b: int, *args, **kwargs)" of "(a, b: int)", or a `Signature` object, for example
         from the output of `inspect.signature` or from the `funcsigs.signature` backport. Note that these objects can
-        be created manually too. If the signature is provided as a string and contains a non-empty name, this name
-        will be used instead of the one of `wrapped_fun`.
+        be created manually too, or replaced with a faster `CompactSignature`. If the signature is provided as a string
+        and contains a non-empty name, this name will be used instead of the one of `wrapped_fun`.
     :param prepend_args: a string or list of strings to prepend to the signature of `wrapped_fun`. These extra arguments
         should not be passed to `wrapped_fun`, as it does not know them. This is typically used to easily create a
         wrapper with additional arguments, without having to manipulate the signature objects.
@@ -867,6 +1709,31 @@ def wraps(wrapped_fun,
         name defined in `func_signature` if `func_signature` is a `str` and contains a non-empty name.
     :param module_name: the name of the module to be set on the function (under __module__ ). If None (default), the
         `__module__` attribute of `wrapped_fun` will be used.
+    :param compact_metadata: a boolean indicating if the attributes of the generated function should share their
+        string values with other functions created with equal strings (default: False).
+        See `create_function`.
+    :param weak_refs: a boolean indicating if the created function should only hold weak references to the decorated
+        function (`__func_impl__`) and to `wrapped_fun` (`__wrapped__`) (default: False). Both must then be kept alive
+        elsewhere. See `create_function`.
+    :param fast_coroutine: a boolean indicating if, when the decorated function is a native coroutine function, the
+        created function should directly return its coroutine instead of awaiting it (default: False). See
+        `create_function`.
+    :param fast_generator: a boolean indicating if, when the decorated function is a generator function, the created
+        function should directly return its generator instead of delegating to it with `yield from` (default: False).
+        See `create_function`.
+    :param lazy: a boolean indicating if the code of the created function should only be compiled when it is called
+        for the first time (default: False). See `create_function`.
+    :param defer_annotations: a boolean indicating if the type hints should be carried to `__annotations__` without
+        being evaluated (default: False). See `create_function`.
+    :param intern_signature: a boolean indicating if the `__signature__` of the created function should be shared with
+        all other functions having an identical signature (default: False). See `create_function`.
+    :param enforce_signature: a boolean indicating if a new function should be generated, so that the signature is
+        enforced when it is called (default: True). If `False`, no code is generated: the decorated function is updated
+        in place like with `functools.wraps`, and its `__signature__` attribute is always set so that introspection
+        (`inspect.signature`, documentation tools, dependency injection frameworks...) sees the new signature. This is
+        much faster, but the arguments are received as-is by the decorated function. In this mode a closure is only
+        created if `inject_as_first_arg` is `True`, and options related to code generation (`co_name`, `add_source`,
+        `lazy`, `fast_coroutine`, `fast_generator`) have no effect.
     :param attrs: other keyword attributes that should be set on the function. Note that the full `__dict__` of
         `wrapped_fun` is automatically copied.
     :return: a decorator
@@ -877,7 +1744,17 @@ def wraps(wrapped_fun,
                                                                                                  append_args,
                                                                                                  func_name, doc,
                                                                                                  qualname, co_name,
-                                                                                                 module_name, attrs)
+                                                                                                 module_name, attrs,
+                                                                                                 defer_annotations)
+
+    if not enforce_signature:
+        def update_wrapper(f):
+            return _update_wrapper_signature_only(f, func_name=func_name, func_sig=func_sig, doc=doc,
+                                                  qualname=qualname, module_name=module_name,
+                                                  inject_as_first_arg=inject_as_first_arg, add_impl=add_impl,
+                                                  compact_metadata=compact_metadata, weak_refs=weak_refs,
+                                                  intern_signature=intern_signature, attrs=all_attrs)
+        return update_wrapper
 
     return with_signature(func_sig,
                           func_name=func_name,
@@ -887,25 +1764,92 @@ def wraps(wrapped_fun,
                           qualname=qualname,
                           co_name=co_name,
                           module_name=module_name,
+                          compact_metadata=compact_metadata,
+                          weak_refs=weak_refs,
+                          fast_coroutine=fast_coroutine,
+                          fast_generator=fast_generator,
+                          lazy=lazy,
+                          defer_annotations=defer_annotations,
+                          intern_signature=intern_signature,
                           **all_attrs)
 
 
-def _get_args_for_wrapping(wrapped, new_sig, remove_args, prepend_args, append_args,
-                           func_name, doc, qualname, co_name, module_name, attrs):
+def _update_wrapper_signature_only(wrapper, func_name, func_sig, doc, qualname, module_name, inject_as_first_arg,
+                                   add_impl, compact_metadata, weak_refs, intern_signature, attrs):
     """
-    Internal method used by @wraps and create_wrapper
+    Internal method used by @wraps when `enforce_signature=False`: updates the metadata of `wrapper` in place, without
+    generating any code. If `inject_as_first_arg` is True, a closure injecting itself as first argument is created.
 
-    :param wrapped:
-    :param new_sig:
-    :param remove_args:
-    :param prepend_args:
-    :param append_args:
-    :param func_name:
+    :param wrapper:
+    :param func_sig: the signature of the wrapper. It is always set as `__signature__`, since the signature of the code
+        of `wrapper` is not modified.
+    :param attrs: the attributes to set on the wrapper, as returned by `_get_args_for_wrapping`
+    :return:
+    """
+    if '__signature__' not in attrs:
+        attrs['__signature__'] = _to_signature(func_sig)
+    if intern_signature:
+        attrs['__signature__'] = _intern_signature(attrs['__signature__'])
+
+    if weak_refs:
+        attrs['__wrapped__'] = _get_weak_proxy(attrs['__wrapped__'])
+
+    if inject_as_first_arg:
+        func_impl = _get_weak_proxy(wrapper) if weak_refs else wrapper
+
+        def wrapper(*args, **kwargs):
+            return func_impl(wrapper, *args, **kwargs)
+
+        if add_impl:
+            attrs['__func_impl__'] = func_impl
+        # the closure returns the coroutine or generator created by the implementation
+        if iscoroutinefunction(func_impl) and markcoroutinefunction is not None:
+            markcoroutinefunction(wrapper)
+        elif _is_generator_func(func_impl):
+            _mark_generator_function(wrapper)
+
+    # keep the attributes that are already set on the wrapper, like `functools.wraps`, except the ones describing the
+    # code generated by makefun if the wrapper was created by makefun: they do not apply to the updated function
+    new_attrs = copy(wrapper.__dict__)
+    new_attrs.pop('__source__', None)
+    new_attrs.pop('__func_impl__', None)
+    new_attrs.update(attrs)
+    if compact_metadata:
+        new_attrs = _get_compact_attrs(new_attrs)
+
+    if isinstance(func_sig, string_types):
+        func_sig = attrs['__signature__']
+    annotations, _, _ = get_signature_details(func_sig)
+
+    if func_name is not None:
+        wrapper.__name__ = func_name
+    if qualname is not None:
+        wrapper.__qualname__ = qualname
+    wrapper.__doc__ = doc
+    wrapper.__dict__ = new_attrs
+    wrapper.__annotations__ = annotations
+    wrapper.__module__ = module_name
+    return wrapper
+
+
+def _get_args_for_wrapping(wrapped, new_sig, remove_args, prepend_args, append_args,
+                           func_name, doc, qualname, co_name, module_name, attrs, defer_annotations=False):
+    """
+    Internal method used by @wraps and create_wrapper
+
+    :param wrapped:
+    :param new_sig:
+    :param remove_args:
+    :param prepend_args:
+    :param append_args:
+    :param func_name:
     :param doc:
     :param qualname:
     :param co_name:
     :param module_name:
     :param attrs:
+    :param defer_annotations: if True, the type hints are not evaluated when reading the signature of `wrapped` on
+        python 3.14+ (they are read as strings), nor when parsing `new_sig`.
     :return:
     """
     # the desired signature
@@ -916,28 +1860,24 @@ def _get_args_for_wrapping(wrapped, new_sig, remove_args, prepend_args, append_a
         func_sig = new_sig
         has_new_sig = True
     else:
-        func_sig = signature(wrapped)
-        if remove_args:
-            if isinstance(remove_args, string_types):
-                remove_args = (remove_args,)
-            func_sig = remove_signature_parameters(func_sig, *remove_args)
-            has_new_sig = True
-
-        if prepend_args:
-            if isinstance(prepend_args, string_types):
-                prepend_args = (prepend_args,)
-        else:
-            prepend_args = ()
-
-        if append_args:
-            if isinstance(append_args, string_types):
-                append_args = (append_args,)
+        if defer_annotations and AnnotationFormat is not None:
+            # python 3.14+: do not evaluate the deferred annotations of `wrapped`
+            func_sig = signature(wrapped, annotation_format=AnnotationFormat.STRING)
         else:
-            append_args = ()
-
-        if prepend_args or append_args:
+            func_sig = signature(wrapped)
+        if remove_args or prepend_args or append_args:
+            # edit the signature, creating the new one only once
+            builder = SignatureBuilder(func_sig)
+            if remove_args:
+                if isinstance(remove_args, string_types):
+                    remove_args = (remove_args,)
+                builder.remove(*remove_args)
+            if prepend_args:
+                builder.prepend(*_as_params_tuple(prepend_args))
+            if append_args:
+                builder.append(*_as_params_tuple(append_args))
+            func_sig = builder.build()
             has_new_sig = True
-            func_sig = add_signature_parameters(func_sig, first=prepend_args, last=append_args)
 
     # the desired metadata
     if func_name is None:
@@ -965,15 +1905,15 @@ def _get_args_for_wrapping(wrapped, new_sig, remove_args, prepend_args, append_a
     # PEP362: always set `__wrapped__`, and if signature was changed, set `__signature__` too
     all_attrs["__wrapped__"] = wrapped
     if has_new_sig:
-        if isinstance(func_sig, Signature):
-            all_attrs["__signature__"] = func_sig
+        if isinstance(func_sig, (Signature, CompactSignature)):
+            all_attrs["__signature__"] = _to_signature(func_sig)
         else:
             # __signature__ must be a Signature object, so if it is a string we need to evaluate it.
             frame = _get_callerframe(offset=1)
             evaldict, _ = extract_module_and_evaldict(frame)
             # Here we could wish to directly override `func_name` and `func_sig` so that this does not have to be done
             # again by `create_function` later... Would this be risky ?
-            _func_name, func_sig_as_sig, _ = get_signature_from_string(func_sig, evaldict)
+            _func_name, func_sig_as_sig, _ = get_signature_from_string(func_sig, evaldict, defer_annotations)
             all_attrs["__signature__"] = func_sig_as_sig
 
     all_attrs.update(attrs)
@@ -981,7 +1921,7 @@ def _get_args_for_wrapping(wrapped, new_sig, remove_args, prepend_args, append_a
     return func_name, func_sig, doc, qualname, co_name, module_name, all_attrs
 
 
-def with_signature(func_signature,             # type: Union[str, Signature]
+def with_signature(func_signature,             # type: Union[str, Signature, CompactSignature]
                    func_name=None,             # type: str
                    inject_as_first_arg=False,  # type: bool
                    add_source=True,             # type: bool
@@ -990,6 +1930,13 @@ def with_signature(func_signature,             # type: Union[str, Signature]
                    qualname=None,              # type: str
                    co_name=None,                # type: str
                    module_name=None,            # type: str
+                   compact_metadata=False,      # type: bool
+                   weak_refs=False,             # type: bool
+                   fast_coroutine=False,        # type: bool
+                   fast_generator=False,        # type: bool
+                   lazy=False,                  # type: bool
+                   defer_annotations=False,     # type: bool
+                   intern_signature=False,      # type: bool
                    **attrs
                    ):
     """
@@ -1010,10 +1957,10 @@ def with_signature(func_signature,             # type: Union[str, Signature]
     :param func_signature: the new signature of the decorated function. Either a string without 'def' such as
         "foo(a, b: int, *args, **kwargs)" of "(a, b: int)", or a `Signature` object, for example from the output of
         `inspect.signature` or from the `funcsigs.signature` backport. Note that these objects can be created manually
-        too. If the signature is provided as a string and contains a non-empty name, this name will be used instead
-        of the one of the decorated function. Finally `None` can be provided to indicate that user wants to only change
-        the medatadata (func_name, doc, module_name, attrs) of the decorated function, without generating a new
-        function.
+        too, or replaced with a faster `CompactSignature`. If the signature is provided as a string and contains a
+        non-empty name, this name will be used instead of the one of the decorated function. Finally `None` can be
+        provided to indicate that user wants to only change the medatadata (func_name, doc, module_name, attrs) of the
+        decorated function, without generating a new function.
     :param inject_as_first_arg: if `True`, the created function will be injected as the first positional argument of
         the decorated function. This can be handy in case the implementation is shared between several facades and needs
         to know from which context it was called. Default=`False`
@@ -1035,12 +1982,30 @@ def with_signature(func_signature,             # type: Union[str, Signature]
         name defined in `func_signature` if `func_signature` is a `str` and contains a non-empty name.
     :param module_name: the name of the module to be set on the function (under __module__ ). If None (default), the
         `__module__` attribute of the decorated function will be used.
+    :param compact_metadata: a boolean indicating if the attributes of the generated function should share their
+        string values with other functions created with equal strings (default: False).
+        See `create_function`.
+    :param weak_refs: a boolean indicating if the created function should only hold a weak reference to the decorated
+        function, that must then be kept alive elsewhere (default: False). See `create_function`.
+    :param fast_coroutine: a boolean indicating if, when the decorated function is a native coroutine function, the
+        created function should directly return its coroutine instead of awaiting it (default: False). See
+        `create_function`.
+    :param fast_generator: a boolean indicating if, when the decorated function is a generator function, the created
+        function should directly return its generator instead of delegating to it with `yield from` (default: False).
+        See `create_function`.
+    :param lazy: a boolean indicating if the code of the created function should only be compiled when it is called
+        for the first time (default: False). See `create_function`.
+    :param defer_annotations: a boolean indicating if the type hints should be carried to `__annotations__` without
+        being evaluated (default: False). See `create_function`.
+    :param intern_signature: a boolean indicating if the `__signature__` of the created function should be shared with
+        all other functions having an identical signature (default: False). See `create_function`.
     :param attrs: other keyword attributes that should be set on the function. Note that the full `__dict__` of the
         decorated function is not automatically copied.
     """
     if func_signature is None and co_name is None:
         # make sure that user does not provide non-default other args
-        if inject_as_first_arg or not add_source or not add_impl:
+        if inject_as_first_arg or not add_source or not add_impl or compact_metadata or weak_refs \
+                or fast_coroutine or fast_generator or lazy or defer_annotations or intern_signature:
             raise ValueError("If `func_signature=None` no new signature will be generated so only `func_name`, "
                              "`module_name`, `doc` and `attrs` should be provided, to modify the metadata.")
         else:
@@ -1069,6 +2034,13 @@ def with_signature(func_signature,             # type: Union[str, Signature]
                                    qualname=qualname,
                                    co_name=co_name,
                                    module_name=module_name,
+                                   compact_metadata=compact_metadata,
+                                   weak_refs=weak_refs,
+                                   fast_coroutine=fast_coroutine,
+                                   fast_generator=fast_generator,
+                                   lazy=lazy,
+                                   defer_annotations=defer_annotations,
+                                   intern_signature=intern_signature,
                                    _with_sig_=True,  # special trick to tell create_function that we're @with_signature
                                    **attrs
                                    )
@@ -1076,29 +2048,397 @@ def with_signature(func_signature,             # type: Union[str, Signature]
     return replace_f
 
 
+# A marker for the arguments that are not provided, in `CompactSignature.replace`
+_void = object()
+
+
+class CompactParameter(namedtuple('CompactParameter', ('name', 'kind', 'default', 'annotation'))):
+    """
+    A lightweight equivalent of `inspect.Parameter`: a plain tuple `(name, kind, default, annotation)`, created without
+    any validation. `kind` is one of the `Parameter` kinds, and `default` and `annotation` are `Parameter.empty` when
+    not set, so that it can be used wherever makefun reads a `Parameter`.
+    """
+    __slots__ = ()
+
+    empty = Parameter.empty
+
+    def __new__(cls, name, kind, default=Parameter.empty, annotation=Parameter.empty):
+        return tuple.__new__(cls, (name, kind, default, annotation))
+
+    @classmethod
+    def from_parameter(cls, p):
+        """
+        Returns a `CompactParameter` equivalent to `p`, that may be a `Parameter`, a `CompactParameter` or a tuple.
+
+        :param p:
+        :return:
+        """
+        if type(p) is cls:
+            return p
+        elif isinstance(p, tuple):
+            return cls(*p)
+        else:
+            return cls(p.name, p.kind, p.default, p.annotation)
+
+    def replace(self, **changes):
+        """
+        Returns a copy of the parameter with the provided fields replaced, see `Parameter.replace`.
+        """
+        return self._replace(**changes)
+
+    def to_parameter(self):
+        """
+        Returns the equivalent `inspect.Parameter`.
+        """
+        return Parameter(self.name, self.kind, default=self.default, annotation=self.annotation)
+
+    def __str__(self):
+        # same format as `Parameter.__str__`
+        formatted = self.name
+        if self.annotation is not Parameter.empty:
+            formatted = '%s: %s' % (formatted, formatannotation(self.annotation))
+        if self.default is not Parameter.empty:
+            if self.annotation is not Parameter.empty:
+                formatted = '%s = %r' % (formatted, self.default)
+            else:
+                formatted = '%s=%r' % (formatted, self.default)
+        if self.kind is Parameter.VAR_POSITIONAL:
+            formatted = '*' + formatted
+        elif self.kind is Parameter.VAR_KEYWORD:
+            formatted = '**' + formatted
+        return formatted
+
+
+class CompactSignature(object):
+    """
+    A lightweight equivalent of `inspect.Signature`, that can be used instead of it in all makefun functions. Creating
+    `Parameter` and `Signature` objects is slow because their constructors validate their contents. Here the parameters
+    are `CompactParameter` tuples, and no validation is performed (except for duplicate names): invalid signatures are
+    detected by the compiler when a function is created.
+
+    It has the same read-only `parameters` and `return_annotation` attributes and the same `replace` method as
+    `Signature`, so `add_signature_parameters`, `remove_signature_parameters` and `gen_partial_sig` return a
+    `CompactSignature` when they receive one. An actual `Signature` is only created when needed, for example when
+    setting the `__signature__` attribute of a created function.
+    """
+    __slots__ = ('parameters', 'return_annotation', '_params_shape')
+
+    empty = Parameter.empty
+
+    def __init__(self,
+                 parameters=(),                         # type: Iterable[Union[CompactParameter, Parameter, tuple]]
+                 return_annotation=Parameter.empty      # type: Any
+                 ):
+        """
+
+        :param parameters: an iterable of `CompactParameter`, `Parameter` or `(name, kind, default, annotation)` tuples
+        :param return_annotation:
+        """
+        params = dict()
+        for p in parameters:
+            p = CompactParameter.from_parameter(p)
+            if p.name in params:
+                raise ValueError("duplicate parameter name: %r" % p.name)
+            params[p.name] = p
+        self.parameters = MappingProxyType(params)
+        self.return_annotation = return_annotation
+
+    @classmethod
+    def from_signature(cls, s):
+        # type: (Union[Signature, CompactSignature]) -> CompactSignature
+        """
+        Returns a `CompactSignature` equivalent to `s`, or `s` itself if it is already a `CompactSignature`.
+
+        :param s:
+        :return:
+        """
+        if isinstance(s, CompactSignature):
+            return s
+        return cls(parameters=s.parameters.values(), return_annotation=s.return_annotation)
+
+    def to_signature(self):
+        # type: (...) -> Signature
+        """
+        Returns the equivalent `inspect.Signature`.
+        """
+        return Signature(parameters=[p.to_parameter() for p in self.parameters.values()],
+                         return_annotation=self.return_annotation)
+
+    def replace(self, parameters=_void, return_annotation=_void):
+        """
+        Creates a customized copy of the signature, see `Signature.replace`.
+        """
+        if parameters is _void:
+            parameters = self.parameters.values()
+        if return_annotation is _void:
+            return_annotation = self.return_annotation
+        return type(self)(parameters=parameters, return_annotation=return_annotation)
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactSignature):
+            return NotImplemented
+        return self.return_annotation == other.return_annotation \
+            and tuple(self.parameters.values()) == tuple(other.parameters.values())
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return hash((tuple(self.parameters.values()), self.return_annotation))
+
+    def __str__(self):
+        # same format as `Signature.__str__`
+        result = []
+        render_pos_only_separator = False
+        render_kw_only_separator = True
+        for p in self.parameters.values():
+            kind = p.kind
+            if kind is Parameter.POSITIONAL_ONLY:
+                render_pos_only_separator = True
+            elif render_pos_only_separator:
+                result.append('/')
+                render_pos_only_separator = False
+
+            if kind is Parameter.VAR_POSITIONAL:
+                render_kw_only_separator = False
+            elif kind is Parameter.KEYWORD_ONLY and render_kw_only_separator:
+                result.append('*')
+                render_kw_only_separator = False
+
+            result.append(str(p))
+
+        if render_pos_only_separator:
+            result.append('/')
+
+        rendered = '(%s)' % ', '.join(result)
+        if self.return_annotation is not Parameter.empty:
+            rendered += ' -> %s' % formatannotation(self.return_annotation)
+        return rendered
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self)
+
+
+def _to_signature(s):
+    # type: (Union[Signature, CompactSignature]) -> Signature
+    """
+    Returns `s` if it is a `Signature`, or the equivalent `Signature` if it is a `CompactSignature`.
+    """
+    return s.to_signature() if isinstance(s, CompactSignature) else s
+
+
+class SignatureBuilder(object):
+    """
+    Accumulates edits of a signature (parameters to prepend, append, insert, remove or rename), and creates the new
+    signature once with `build()`. This is faster than chaining `add_signature_parameters` and
+    `remove_signature_parameters`, that create a new signature at each step, and the time is linear in the number of
+    parameters.
+
+    ```python
+    new_sig = SignatureBuilder(sig).remove('b').prepend('x', 'y').append(Parameter('z', KEYWORD_ONLY)).build()
+    ```
+
+    The methods return the builder itself so that they can be chained. Parameters can be provided as `Parameter`,
+    `CompactParameter` or as strings, in which case their kind is guessed from the neighbouring parameter as in
+    `add_signature_parameters`. The created signature is a `CompactSignature` if the original signature is one.
+    """
+    __slots__ = ('signature', '_first', '_last', '_inserted', '_removed', '_renamed')
+
+    def __init__(self,
+                 s  # type: Union[Signature, CompactSignature]
+                 ):
+        """
+
+        :param s: the original signature to edit
+        """
+        self.signature = s
+        self._first = []      # the lists of parameters to prepend, in order of the calls
+        self._last = []       # the parameters to append
+        self._inserted = []   # the (index, parameters) to insert in the original parameters
+        self._removed = []    # the names of the original parameters to remove
+        self._renamed = dict()  # the new names of the original parameters
+
+    def prepend(self, *params):
+        # type: (...) -> SignatureBuilder
+        """
+        Adds parameters at the beginning of the signature, in the provided order. Parameters prepended by a subsequent
+        call will be placed before these ones.
+
+        :param params: `Parameter`, `CompactParameter` or strings
+        :return: self
+        """
+        self._first.append(params)
+        return self
+
+    def append(self, *params):
+        # type: (...) -> SignatureBuilder
+        """
+        Adds parameters at the end of the signature, in the provided order.
+
+        :param params: `Parameter`, `CompactParameter` or strings
+        :return: self
+        """
+        self._last.extend(params)
+        return self
+
+    def insert(self, idx, *params):
+        # type: (...) -> SignatureBuilder
+        """
+        Inserts parameters before the parameter at position `idx` in the original signature (negative indices are
+        counted from the end), in the provided order. The positions are not affected by the other edits, and the
+        parameters inserted at the same position by several calls are placed in the order of the calls.
+
+        :param idx:
+        :param params: `Parameter` or `CompactParameter` instances
+        :return: self
+        """
+        self._inserted.append((idx, params))
+        return self
+
+    def remove(self, *param_names):
+        # type: (...) -> SignatureBuilder
+        """
+        Removes parameters of the original signature.
+
+        :param param_names:
+        :return: self
+        """
+        self._removed.extend(param_names)
+        return self
+
+    def rename(self, old_name, new_name):
+        # type: (...) -> SignatureBuilder
+        """
+        Renames a parameter of the original signature.
+
+        :param old_name:
+        :param new_name:
+        :return: self
+        """
+        self._renamed[old_name] = new_name
+        return self
+
+    def build(self):
+        # type: (...) -> Union[Signature, CompactSignature]
+        """
+        Creates the new signature.
+
+        :return: a new `Signature`, or a new `CompactSignature` if the original signature is one
+        """
+        s = self.signature
+        param_cls = CompactParameter if isinstance(s, CompactSignature) else Parameter
+        orig_params = s.parameters
+        n_orig = len(orig_params)
+        for names in (self._removed, self._renamed):
+            for name in names:
+                if name not in orig_params:
+                    raise KeyError(name)
+
+        # the parameters to insert before each position of the original list (as `list.insert` does), in order
+        inserted_at = dict()
+        for idx, inserted in self._inserted:
+            pos = min(max(idx + n_orig if idx < 0 else idx, 0), n_orig)
+            inserted_at.setdefault(pos, []).extend(inserted)
+
+        # remove and rename the original parameters only, and insert the custom ones
+        removed = set(self._removed)
+        renamed = self._renamed
+        params = []
+        for pos, p in enumerate(orig_params.values()):
+            params.extend(inserted_at.get(pos, ()))
+            if p.name in removed:
+                continue
+            params.append(p.replace(name=renamed[p.name]) if p.name in renamed else p)
+        params.extend(inserted_at.get(n_orig, ()))
+
+        # the names already used, to detect duplicates
+        names = set()
+        for p in params:
+            _add_new_param_name(names, p.name)
+
+        # prepend: the last prepended parameters come first. Kinds are guessed from the next parameter
+        first = []
+        for prepended in reversed(self._first):
+            first.extend(prepended)
+        first_param_kind = params[0].kind if params else Parameter.POSITIONAL_OR_KEYWORD
+        # if the first parameter is a pos-only or a varpos we have to change to pos only.
+        if first_param_kind in (Parameter.POSITIONAL_ONLY, Parameter.VAR_POSITIONAL):
+            first_param_kind = Parameter.POSITIONAL_ONLY
+        for i in range(len(first) - 1, -1, -1):
+            param = first[i]
+            if isinstance(param, string_types):
+                # Create a Parameter with auto-guessed 'kind'
+                first[i] = param = param_cls(name=param, kind=first_param_kind)
+            else:
+                # remember the kind
+                first_param_kind = param.kind
+                if first_param_kind in (Parameter.POSITIONAL_ONLY, Parameter.VAR_POSITIONAL):
+                    first_param_kind = Parameter.POSITIONAL_ONLY
+            _add_new_param_name(names, param.name)
+
+        # append. Kinds are guessed from the previous parameter
+        last = list(self._last)
+        last_param_kind = params[-1].kind if params else Parameter.POSITIONAL_OR_KEYWORD
+        # if the last parameter is a keyword-only or a varkw we have to change to kw only.
+        if last_param_kind in (Parameter.KEYWORD_ONLY, Parameter.VAR_KEYWORD):
+            last_param_kind = Parameter.KEYWORD_ONLY
+        for i, param in enumerate(last):
+            if isinstance(param, string_types):
+                # Create a Parameter with auto-guessed 'kind'
+                last[i] = param = param_cls(name=param, kind=last_param_kind)
+            else:
+                # remember the kind
+                last_param_kind = param.kind
+                if last_param_kind in (Parameter.KEYWORD_ONLY, Parameter.VAR_KEYWORD):
+                    last_param_kind = Parameter.KEYWORD_ONLY
+            _add_new_param_name(names, param.name)
+
+        return s.replace(parameters=first + params + last)
+
+
+def _add_new_param_name(names, name):
+    """
+    Adds `name` to the set of parameter `names` of a signature being created, or raises a `ValueError` if it is
+    already present.
+    """
+    if name in names:
+        raise ValueError("Parameter with name '%s' is present twice in the signature to create" % name)
+    names.add(name)
+
+
+def _as_params_tuple(params):
+    """
+    Returns a tuple of parameters from a single parameter (a `Parameter`, `CompactParameter` or string) or from an
+    iterable of parameters.
+    """
+    if isinstance(params, (string_types, Parameter, CompactParameter)):
+        return params,
+    return tuple(params)
+
+
 def remove_signature_parameters(s,
                                 *param_names):
     """
-    Removes the provided parameters from the signature `s` (returns a new `Signature` instance).
+    Removes the provided parameters from the signature `s` (returns a new `Signature` instance, or a new
+    `CompactSignature` if `s` is one).
 
     :param s:
     :param param_names: a list of parameter names to remove
     :return:
     """
-    params = OrderedDict(s.parameters.items())
-    for param_name in param_names:
-        del params[param_name]
-    return s.replace(parameters=params.values())
+    return SignatureBuilder(s).remove(*param_names).build()
 
 
-def add_signature_parameters(s,             # type: Signature
+def add_signature_parameters(s,             # type: Union[Signature, CompactSignature]
                              first=(),      # type: Union[str, Parameter, Iterable[Union[str, Parameter]]]
                              last=(),       # type: Union[str, Parameter, Iterable[Union[str, Parameter]]]
                              custom=(),     # type: Union[Parameter, Iterable[Parameter]]
                              custom_idx=-1  # type: int
                              ):
     """
-    Adds the provided parameters to the signature `s` (returns a new `Signature` instance).
+    Adds the provided parameters to the signature `s` (returns a new `Signature` instance, or a new `CompactSignature`
+    if `s` is one). To perform several edits at once, see `SignatureBuilder`.
 
     :param s: the original signature to edit
     :param first: a single element or a list of `Parameter` instances to be added at the beginning of the parameter's
@@ -1108,94 +2448,14 @@ def add_signature_parameters(s,             # type: Signature
     :param custom: a single element or a list of `Parameter` instances to be added at a custom position in the list.
         That position is determined with `custom_idx`
     :param custom_idx: the custom position to insert the `custom` parameters to.
-    :return: a new signature created from the original one by adding the specified parameters.
+    :return: a new signature created from the original one by adding the specified parameters. It is a
+        `CompactSignature` if `s` is one.
     """
-    params = OrderedDict(s.parameters.items())
-    lst = list(params.values())
-
-    # insert at custom position (but keep the order, that's why we use 'reversed')
-    try:
-        for param in reversed(custom):
-            if param.name in params:
-                raise ValueError("Parameter with name '%s' is present twice in the signature to create" % param.name)
-            else:
-                lst.insert(custom_idx, param)
-    except TypeError:
-        # a single argument
-        if custom.name in params:
-            raise ValueError("Parameter with name '%s' is present twice in the signature to create" % custom.name)
-        else:
-            lst.insert(custom_idx, custom)
-
-    # prepend but keep the order
-    first_param_kind = None
-    try:
-        for param in reversed(first):
-            if isinstance(param, string_types):
-                # Create a Parameter with auto-guessed 'kind'
-                if first_param_kind is None:
-                    # by default use this
-                    first_param_kind = Parameter.POSITIONAL_OR_KEYWORD
-                    try:
-                        # check the first parameter kind
-                        first_param_kind = next(iter(params.values())).kind
-                    except StopIteration:
-                        # no parameter - ok
-                        pass
-                # if the first parameter is a pos-only or a varpos we have to change to pos only.
-                if first_param_kind in (Parameter.POSITIONAL_ONLY, Parameter.VAR_POSITIONAL):
-                    first_param_kind = Parameter.POSITIONAL_ONLY
-                param = Parameter(name=param, kind=first_param_kind)
-            else:
-                # remember the kind
-                first_param_kind = param.kind
-
-            if param.name in params:
-                raise ValueError("Parameter with name '%s' is present twice in the signature to create" % param.name)
-            else:
-                lst.insert(0, param)
-    except TypeError:
-        # a single argument
-        if first.name in params:
-            raise ValueError("Parameter with name '%s' is present twice in the signature to create" % first.name)
-        else:
-            lst.insert(0, first)
-
-    # append
-    last_param_kind = None
-    try:
-        for param in last:
-            if isinstance(param, string_types):
-                # Create a Parameter with auto-guessed 'kind'
-                if last_param_kind is None:
-                    # by default use this
-                    last_param_kind = Parameter.POSITIONAL_OR_KEYWORD
-                    try:
-                        # check the last parameter kind
-                        last_param_kind = next(reversed(params.values())).kind
-                    except StopIteration:
-                        # no parameter - ok
-                        pass
-                # if the last parameter is a keyword-only or a varkw we have to change to kw only.
-                if last_param_kind in (Parameter.KEYWORD_ONLY, Parameter.VAR_KEYWORD):
-                    last_param_kind = Parameter.KEYWORD_ONLY
-                param = Parameter(name=param, kind=last_param_kind)
-            else:
-                # remember the kind
-                last_param_kind = param.kind
-
-            if param.name in params:
-                raise ValueError("Parameter with name '%s' is present twice in the signature to create" % param.name)
-            else:
-                lst.append(param)
-    except TypeError:
-        # a single argument
-        if last.name in params:
-            raise ValueError("Parameter with name '%s' is present twice in the signature to create" % last.name)
-        else:
-            lst.append(last)
-
-    return s.replace(parameters=lst)
+    builder = SignatureBuilder(s)
+    builder.insert(custom_idx, *_as_params_tuple(custom))
+    builder.prepend(*_as_params_tuple(first))
+    builder.append(*_as_params_tuple(last))
+    return builder.build()
 
 
 def with_partial(*preset_pos_args, **preset_kwargs):
@@ -1242,8 +2502,8 @@ def partial(f,                 # type: Callable
             from makefun._main_legacy_py import make_partial_using_yield
             partial_f = make_partial_using_yield(new_sig, f, *preset_pos_args, **preset_kwargs)
     elif isasyncgenfunction(f) and sys.version_info >= (3, 6):
-        from makefun._main_py36_and_higher import make_partial_using_async_for_in_yield
-        partial_f = make_partial_using_async_for_in_yield(new_sig, f, *preset_pos_args, **preset_kwargs)
+        from makefun._main_py36_and_higher import make_partial_using_async_delegation
+        partial_f = make_partial_using_async_delegation(new_sig, f, *preset_pos_args, **preset_kwargs)
     else:
         @wraps(f, new_sig=new_sig)
         def partial_f(*args, **kwargs):
@@ -1279,7 +2539,7 @@ else:
     KW_ONLY = None
 
 
-def gen_partial_sig(orig_sig,         # type: Signature
+def gen_partial_sig(orig_sig,         # type: Union[Signature, CompactSignature]
                     preset_pos_args,  # type: Tuple[Any]
                     preset_kwargs,    # type: Mapping[str, Any]
                     f,                # type: Callable
@@ -1299,9 +2559,10 @@ def gen_partial_sig(orig_sig,         # type: Signature
     :param preset_pos_args:
     :param preset_kwargs:
     :param f: used in error messages only
-    :return:
+    :return: the new signature. It is a `CompactSignature` if `orig_sig` is one.
     """
     preset_kwargs = copy(preset_kwargs)
+    param_cls = CompactParameter if isinstance(orig_sig, CompactSignature) else Parameter
 
     # remove the first n positional, and assign/change default values for the keyword
     if len(orig_sig.parameters) < len(preset_pos_args):
@@ -1334,7 +2595,7 @@ def gen_partial_sig(orig_sig,         # type: Signature
                 else:
                     new_kind = Parameter.KEYWORD_ONLY
                     new_default = p.default
-                p = Parameter(name=p.name, kind=new_kind, default=new_default, annotation=p.annotation)
+                p = param_cls(name=p.name, kind=new_kind, default=new_default, annotation=p.annotation)
 
         else:
             # yes: override definition with the default. Note that the parameter will remain in the signature
@@ -1350,7 +2611,7 @@ def gen_partial_sig(orig_sig,         # type: Signature
                 new_kind = Parameter.KEYWORD_ONLY
             else:
                 new_kind = p.kind
-            p = Parameter(name=p.name, kind=new_kind, default=overridden_p_default, annotation=p.annotation)
+            p = param_cls(name=p.name, kind=new_kind, default=overridden_p_default, annotation=p.annotation)
 
             # from now on, all other parameters need to be keyword-only
             kwonly_flag = True
@@ -1358,8 +2619,7 @@ def gen_partial_sig(orig_sig,         # type: Signature
         # preserve order
         new_params.append(p)
 
-    new_sig = Signature(parameters=tuple(new_params),
-                        return_annotation=orig_sig.return_annotation)
+    new_sig = orig_sig.replace(parameters=tuple(new_params))
 
     if len(preset_kwargs) > 0:
         raise ValueError("Cannot preset keyword argument(s), not present in the signature of %s: %s"
@@ -1435,6 +2695,8 @@ class SourceUnavailable(OSError):
 
 def compile_fun(recurse=True,     # type: Union[bool, Callable]
                 except_names=(),  # type: Iterable[str]
+                optimize=False,   # type: bool
+                inline=(),        # type: Iterable[str]
                 ):
     """
     A draft decorator to `compile` any existing function so that users cant
@@ -1469,13 +2731,28 @@ def compile_fun(recurse=True,     # type: Union[bool, Callable]
     contribute !
 
     Note that according to [this post](https://stackoverflow.com/a/471227/7262247) compiling does not make the code
-    run any faster.
+    run any faster. With `optimize=True` however, the global and builtin symbols used by the function that are
+    unlikely to be rebound (modules, classes, functions and builtin functions) are bound once at compilation time,
+    and copied to local variables when the function starts. This saves the global and builtin dictionary lookups, for
+    example in tight loops. Symbols rebound later (for example by `mock.patch`) are therefore not seen by the compiled
+    function: exclude them with `except_names`.
+
+    Small helper functions called by the function can also be inlined with `inline`: each call to one of these
+    helpers in the source of the function is replaced with the expression returned by the helper, where the
+    parameters are replaced with the call arguments. This removes the cost of a function call, for example in loops.
+    Only helpers whose body is a single `return <expression>` statement can be inlined. A call is left as is when it
+    can not be inlined safely, for example when it uses `*args`, or when an argument that is not a simple name or
+    constant would be evaluated several times (or not at all).
 
     Known issues: `NameError` will appear if your function code depends on symbols that have not yet been defined.
     Make sure all symbols exist first ! See https://github.com/smarie/python-makefun/issues/47
 
     :param recurse: a boolean (default `True`) indicating if referenced symbols should be compiled too
-    :param except_names: an optional list of symbols to exclude from compilation when `recurse=True`
+    :param except_names: an optional list of symbols to exclude from compilation when `recurse=True`, and from
+        binding when `optimize=True`
+    :param optimize: a boolean (default `False`) indicating if the modules, classes, functions and builtin functions
+        used as global symbols by the function should be bound at compilation time.
+    :param inline: an optional list of names of helper functions whose calls should be replaced with their body.
     :return:
     """
     if callable(recurse):
@@ -1486,7 +2763,8 @@ def compile_fun(recurse=True,     # type: Union[bool, Callable]
     else:
         # called with parenthesis, return a decorator
         def apply_compile_fun(target):
-            return compile_fun_manually(target, recurse=recurse, except_names=except_names, _evaldict=True)
+            return compile_fun_manually(target, recurse=recurse, except_names=except_names, optimize=optimize,
+                                        inline=inline, _evaldict=True)
 
         return apply_compile_fun
 
@@ -1494,16 +2772,36 @@ def compile_fun(recurse=True,     # type: Union[bool, Callable]
 def compile_fun_manually(target,
                          recurse=True,     # type: Union[bool, Callable]
                          except_names=(),  # type: Iterable[str]
-                         _evaldict=None    # type: Union[bool, Dict]
+                         optimize=False,   # type: bool
+                         inline=(),        # type: Iterable[str]
+                         _evaldict=None,   # type: Union[bool, Dict]
+                         _memo=None        # type: Dict[int, Tuple[Any, Any]]
                          ):
     """
 
     :param target:
+    :param _memo: the functions already compiled during this run, by id of their code object: (code, compiled
+        function), or (code, list of names) while the function is being compiled, see `_CompilationCycle`. It is
+        shared across the recursion so that each function is compiled only once, even if it is referenced by several
+        closures or by itself.
     :return:
     """
     if not isinstance(target, FunctionType):
         raise UnsupportedForCompilation("Only functions can be compiled by this decorator")
 
+    if _memo is None:
+        _memo = dict()
+    else:
+        try:
+            _, compiled = _memo[id(target.__code__)]
+        except KeyError:
+            pass
+        else:
+            if isinstance(compiled, list):
+                # a cycle: the function will be available in _evaldict once compiled
+                raise _CompilationCycle(compiled)
+            return compiled
+
     if _evaldict is None or _evaldict is True:
         if _evaldict is True:
             frame = _get_callerframe(offset=1)
@@ -1513,7 +2811,7 @@ def compile_fun_manually(target,
 
     # first make sure that source code is available for compilation
     try:
-        lines = getsource(target)
+        lines = _get_function_source(target)
     except (OSError, IOError) as e:  # noqa # distinct exceptions in old python versions
         if 'could not get source code' in str(e):
             raise SourceUnavailable(target, e)
@@ -1530,6 +2828,28 @@ def compile_fun_manually(target,
         func_closure = target.func_closure
         func_code = target.func_code
 
+    cycle_names = []
+    _memo[id(func_code)] = func_code, cycle_names
+    try:
+        new_f = _compile_fun_from_source(target, lines, func_closure, func_code, recurse, except_names, optimize,
+                                         inline, _evaldict, _memo)
+    except BaseException:
+        del _memo[id(func_code)]
+        raise
+    _memo[id(func_code)] = func_code, new_f
+    # the functions compiled meanwhile that reference this one find it in the evaldict
+    for name in cycle_names:
+        _evaldict[name] = new_f
+    return new_f
+
+
+def _compile_fun_from_source(target, lines, func_closure, func_code, recurse, except_names, optimize, inline,
+                             _evaldict, _memo):
+    """Compiles `target` from its source `lines`, after compiling the functions in its closure if `recurse`"""
+    # the symbols that can not be bound at compilation time if `optimize`
+    not_bound = set(except_names)
+    not_bound.add(target.__name__)
+
     # Does not work: if `self.i` is used in the code, `i` will appear here
     # if func_code is not None:
     #     for name in func_code.co_names:
@@ -1559,9 +2879,14 @@ def compile_fun_manually(target,
                     # if not, users will have to do it manually
                     _evaldict[name] = compile_fun_manually(value,
                                                            recurse=recurse, except_names=except_names,
-                                                           _evaldict=_evaldict)
+                                                           optimize=optimize, inline=inline,
+                                                           _evaldict=_evaldict, _memo=_memo)
                 except (UnsupportedForCompilation, SourceUnavailable):
                     pass
+                except _CompilationCycle as cycle:
+                    # the compiled version does not exist yet
+                    cycle.names.append(name)
+                    not_bound.add(name)
 
     # now compile from sources
     lines = dedent(lines)
@@ -1574,7 +2899,832 @@ def compile_fun_manually(target,
         lines += '\n'
     # print("compiling: ")
     # print(lines)
-    new_f = _make(target.__name__, (), lines, _evaldict)
+    if inline:
+        inlined_lines = _inline_helpers(lines, func_code, func_closure, inline, _evaldict)
+        if inlined_lines is not lines:
+            lines = inlined_lines
+            if optimize:
+                # the symbols used by the function have changed
+                func_code = next(c for c in compile(lines, '<inlined>', 'exec').co_consts if isinstance(c, CodeType))
+
+    factory_vars = None
+    if optimize:
+        bound = _get_stable_globals(func_code, _evaldict, not_bound)
+        if bound:
+            lines, factory_vars = _bind_as_locals(lines, bound)
+    new_f = _make(target.__name__, (), lines, _evaldict, factory_vars=factory_vars)
     new_f.__source__ = source_lines
 
     return new_f
+
+
+def compile_module(module,        # type: Union[str, ModuleType]
+                   include=None,  # type: Optional[Iterable[str]]
+                   exclude=(),    # type: Iterable[str]
+                   ):
+    # type: (...) -> Dict[str, Callable]
+    """
+    Applies `compile_fun` to all functions of a module at once, for example at the end of the module:
+
+    ```python
+    from makefun import compile_module
+
+    def foo(a, b):
+        return a + b
+
+    compile_module(__name__)
+    ```
+
+    The module source is parsed once, and the selected functions are compiled with a single call to `compile()`, in
+    the module namespace: they are therefore replaced in the module, and the functions calling each other use the
+    compiled versions. The functions defined inside them are compiled with them. The `from __future__` imports of the
+    module apply to the compiled code, and the compiled functions keep the default values of the original ones.
+
+    Only functions defined at the top level of the module, not decorated, and still bound to their name, are
+    compiled. The other ones are left unchanged.
+
+    :param module: the module, or its name
+    :param include: an optional list of names of functions to compile. By default all functions are compiled.
+    :param exclude: an optional list of names of functions that should not be compiled.
+    :return: a dictionary containing the compiled functions, by name
+    """
+    if isinstance(module, str):
+        module = sys.modules[module]
+    namespace = vars(module)
+
+    # parse the module source once
+    try:
+        path = module.__file__
+    except AttributeError:
+        raise SourceUnavailable(module, OSError("module %s has no source file" % module.__name__))
+    linecache.checkcache(path)
+    lines = linecache.getlines(path, namespace)
+    if not lines:
+        raise SourceUnavailable(module, OSError("could not get source code of module %s" % module.__name__))
+
+    # select the functions
+    segments = []
+    for node in ast.parse(''.join(lines)).body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) or node.decorator_list \
+                or (include is not None and node.name not in include) or node.name in exclude:
+            continue
+        func = namespace.get(node.name)
+        if not isinstance(func, FunctionType) or func.__module__ != module.__name__ \
+                or func.__code__.co_firstlineno != node.lineno:
+            # rebound, or redefined later in the module
+            continue
+        segments.append((node.name, ''.join(lines[node.lineno - 1:node.end_lineno])))
+
+    if not segments:
+        return dict()
+
+    # the `from __future__ import ...` statements of the module apply to the compiled code
+    flags = 0
+    for value in namespace.values():
+        if isinstance(value, __future__._Feature):
+            flags |= value.compiler_flag
+
+    # compile them all at once in the module namespace
+    orig_defaults = {name: (namespace[name].__defaults__, namespace[name].__kwdefaults__) for name, _ in segments}
+    filename = '<makefun-gen-%d>' % (next(_compile_count),)
+    code_str = '\n'.join(segment for _, segment in segments)
+    try:
+        code = compile(code_str, filename, 'exec', flags=flags, dont_inherit=True)
+        exec(code, namespace)  # noqa
+    except BaseException:
+        print('Error in generated code:', file=sys.stderr)
+        print(code_str, file=sys.stderr)
+        raise
+
+    compiled = dict()
+    for name, segment in segments:
+        compiled[name] = new_f = namespace[name]
+        # the default values are the same objects as in the original functions
+        new_f.__defaults__, new_f.__kwdefaults__ = orig_defaults[name]
+        new_f.__source__ = segment
+    return compiled
+
+
+def _inline_helpers(source, func_code, func_closure, inline, evaldict):
+    """
+    Returns the source of the function defined in `source`, where the calls to the helper functions named in `inline`
+    are replaced with the expressions they return. Returns `source` itself if no call was inlined.
+
+    :param source:
+    :param func_code: the code of the function, to know its local variables
+    :param func_closure: the closure of the function, where helpers may be found
+    :param inline: the names of the helpers to inline
+    :param evaldict: the namespace where the function is compiled, where helpers may be found
+    :return:
+    """
+    caller_locals = set(func_code.co_varnames) | set(func_code.co_cellvars)
+    closure_vars = dict(zip(func_code.co_freevars, func_closure or ()))
+
+    helpers = dict()
+    for name in inline:
+        if name in caller_locals:
+            # the name does not refer to the helper in this function
+            continue
+        try:
+            helper = closure_vars[name].cell_contents
+        except KeyError:
+            try:
+                helper = evaldict[name]
+            except KeyError:
+                continue
+        except ValueError:
+            # empty cell
+            raise UndefinedSymbolError("Symbol %s does not seem to be defined yet. Make sure you apply "
+                                       "`compile_fun` *after* all required symbols have been defined." % name)
+        helpers[name] = _InlinableHelper(name, helper, evaldict, caller_locals)
+
+    inliner = _Inliner(helpers)
+    tree = inliner.visit(ast.parse(source))
+    if not inliner.n_inlined:
+        return source
+    return ast.unparse(ast.fix_missing_locations(tree)) + '\n'
+
+
+class _InlinableHelper(object):
+    """
+    The parameters and the returned expression of a helper function that can be inlined. Raises
+    `UnsupportedForCompilation` if the helper can not be inlined.
+    """
+    __slots__ = ('name', 'params', 'defaults', 'expr', 'conditional', 'preceded')
+
+    def __init__(self, name, helper, evaldict, caller_locals):
+        self.name = name
+        if not isinstance(helper, FunctionType):
+            raise UnsupportedForCompilation("%s can not be inlined: only functions can be inlined" % name)
+        if helper.__closure__ is not None:
+            raise UnsupportedForCompilation("%s can not be inlined: it uses a closure" % name)
+
+        source = getattr(helper, '__source__', None)
+        if source is None:
+            try:
+                source = _get_function_source(helper)
+            except (OSError, IOError) as e:  # noqa # distinct exceptions in old python versions
+                raise SourceUnavailable(helper, e)
+        func_def = ast.parse(dedent(source)).body[0]
+        body = func_def.body[1:] if ast.get_docstring(func_def, clean=False) is not None else func_def.body
+
+        args = func_def.args
+        if not isinstance(func_def, ast.FunctionDef) or args.vararg or args.kwarg or args.kwonlyargs \
+                or len(body) != 1 or not isinstance(body[0], ast.Return) or body[0].value is None:
+            raise UnsupportedForCompilation("%s can not be inlined: its body should be a single `return <expression>`"
+                                            " statement and it should not have variable-length or keyword-only "
+                                            "arguments" % name)
+        self.expr = body[0].value
+        self.params = [a.arg for a in getattr(args, 'posonlyargs', []) + args.args]
+
+        # default values are inlined too, when they are literals
+        self.defaults = dict()
+        for p_name, default in zip(self.params[len(self.params) - len(helper.__defaults__ or ()):],
+                                   helper.__defaults__ or ()):
+            if _is_literal(default):
+                self.defaults[p_name] = default
+
+        # the other symbols used in the expression should be the same in the function where it is inlined
+        helper_builtins = helper.__globals__.get('__builtins__', builtins)
+        helper_builtins = vars(helper_builtins) if isinstance(helper_builtins, ModuleType) else helper_builtins
+        for node in ast.walk(self.expr):
+            if isinstance(node, (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp,
+                                 ast.NamedExpr, ast.Yield, ast.YieldFrom, ast.Await)):
+                raise UnsupportedForCompilation("%s can not be inlined: its expression defines a new scope or a "
+                                                "variable, or suspends the function" % name)
+            if isinstance(node, ast.Name) and node.id not in self.params:
+                try:
+                    value = helper.__globals__[node.id]
+                except KeyError:
+                    value = helper_builtins.get(node.id, _void)
+                if node.id in caller_locals or evaldict.get(node.id, helper_builtins.get(node.id)) is not value:
+                    raise UnsupportedForCompilation("%s can not be inlined: symbol %s is not the same where it is "
+                                                    "inlined" % (name, node.id))
+
+        # the parameters that may not be evaluated, and the ones evaluated after other operations
+        self.conditional = _get_conditional_names(self.expr)
+        self.preceded = _get_preceded_names(self.expr)
+
+    def get_expression(self, call):
+        """
+        Returns a copy of the expression, where the parameters are replaced with the arguments of `call`, or None if
+        the call can not be inlined safely.
+
+        :param call: an `ast.Call` node calling the helper
+        :return:
+        """
+        if len(call.args) > len(self.params) or any(isinstance(a, ast.Starred) for a in call.args) \
+                or any(k.arg is None or k.arg not in self.params for k in call.keywords):
+            return None
+        args = dict(zip(self.params, call.args))
+        for k in call.keywords:
+            if k.arg in args:
+                return None
+            args[k.arg] = k.value
+        for p_name in self.params:
+            if p_name not in args:
+                if p_name not in self.defaults:
+                    return None
+                args[p_name] = ast.Constant(value=self.defaults[p_name])
+
+        # arguments that are not names or constants should be evaluated exactly once, so they should be used once and
+        # not in a conditional branch. They should also be evaluated before the other operations of the expression,
+        # as when the helper is called. Since the evaluation order of arguments may change, there should be at most
+        # one of them
+        uses = dict.fromkeys(self.params, 0)
+        for node in ast.walk(self.expr):
+            if isinstance(node, ast.Name) and node.id in uses:
+                uses[node.id] += 1
+        complex_args = [p_name for p_name, arg in args.items() if not isinstance(arg, (ast.Name, ast.Constant))]
+        if len(complex_args) > 1 or any(uses[p_name] != 1 or p_name in self.conditional or p_name in self.preceded
+                                        for p_name in complex_args):
+            return None
+
+        return _ArgsSubstituter(args).visit(deepcopy(self.expr))
+
+
+def _get_conditional_names(expr):
+    """
+    Returns the set of names used in the parts of `expr` that may not be evaluated: the branches of
+    `... if ... else ...` expressions and the operands of `and`/`or` after the first one. Comprehensions and lambdas,
+    that may be evaluated several times, are not supported in inlined expressions.
+
+    :param expr: an expression node
+    :return:
+    """
+    conditional_nodes = []
+    for node in ast.walk(expr):
+        if isinstance(node, ast.IfExp):
+            conditional_nodes += [node.body, node.orelse]
+        elif isinstance(node, ast.BoolOp):
+            conditional_nodes += node.values[1:]
+    return {n.id for cond in conditional_nodes for n in ast.walk(cond) if isinstance(n, ast.Name)}
+
+
+def _get_preceded_names(expr):
+    """
+    Returns the set of names used in `expr` after, in evaluation order, a subexpression that is not a name or a
+    constant (for example a call, an attribute access or an operation), that may have side effects.
+
+    :param expr: an expression node
+    :return:
+    """
+    names = set()
+    preceded = False
+    # post-order traversal, following the evaluation order: the operands are evaluated before the operation
+    stack = [(expr, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if isinstance(node, ast.Name):
+            if preceded:
+                names.add(node.id)
+        elif isinstance(node, ast.Constant):
+            continue
+        elif children_done:
+            # the operation itself (a keyword argument is only a part of the call)
+            preceded = preceded or not isinstance(node, ast.keyword)
+        else:
+            if isinstance(node, ast.Dict):
+                # the keys and values are evaluated by pairs
+                children = [c for kv in zip(node.keys, node.values) for c in kv if c is not None]
+            else:
+                children = [c for c in ast.iter_child_nodes(node) if isinstance(c, (ast.expr, ast.keyword))]
+            stack.append((node, True))
+            stack.extend((c, False) for c in reversed(children))
+    return names
+
+
+class _ArgsSubstituter(ast.NodeTransformer):
+    """Replaces the parameters of an inlined helper with the argument expressions"""
+    def __init__(self, args):
+        self.args = args
+
+    def visit_Name(self, node):
+        try:
+            return deepcopy(self.args[node.id])
+        except KeyError:
+            return node
+
+
+class _Inliner(ast.NodeTransformer):
+    """Replaces the calls to helpers with their expressions. Calls in the inlined expressions are inlined too."""
+    def __init__(self, helpers):
+        self.helpers = helpers
+        self.n_inlined = 0
+        self._inlining = set()
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.func, ast.Name) or node.func.id in self._inlining:
+            return node
+        try:
+            helper = self.helpers[node.func.id]
+        except KeyError:
+            return node
+        expr = helper.get_expression(node)
+        if expr is None:
+            return node
+
+        self.n_inlined += 1
+        self._inlining.add(helper.name)
+        try:
+            expr = self.visit(expr)
+        finally:
+            self._inlining.remove(helper.name)
+        return ast.copy_location(expr, node)
+
+
+# the types of the global symbols that compile_fun(optimize=True) binds at compilation time
+STABLE_GLOBAL_TYPES = (ModuleType, type, FunctionType, BuiltinFunctionType)
+
+
+def _get_stable_globals(code, evaldict, except_names):
+    """
+    Returns the global and builtin symbols used by `code` that can be bound at compilation time: the ones currently
+    defined with a type in `STABLE_GLOBAL_TYPES`, never assigned nor deleted as globals by the code, and not used by
+    the functions, classes or comprehensions it defines (they would become closure variables, slower than globals).
+    The free variables of `code` are included, since the function compiled from source looks them up in `evaldict`.
+
+    :param code:
+    :param evaldict:
+    :param except_names: the symbols that should not be bound
+    :return: a dictionary of symbols to bind
+    """
+    loaded, excluded = set(), set(except_names)
+    for instr in dis.get_instructions(code):
+        if instr.opname == 'LOAD_GLOBAL' or (instr.opname == 'LOAD_DEREF' and instr.argval in code.co_freevars):
+            loaded.add(instr.argval)
+        elif instr.opname in ('STORE_GLOBAL', 'DELETE_GLOBAL'):
+            excluded.add(instr.argval)
+
+    nested = [c for c in code.co_consts if isinstance(c, CodeType)]
+    while nested:
+        nested_code = nested.pop()
+        excluded.update(nested_code.co_names)
+        excluded.update(nested_code.co_freevars)
+        nested.extend(c for c in nested_code.co_consts if isinstance(c, CodeType))
+
+    builtins_dict = evaldict.get('__builtins__', builtins)
+    if isinstance(builtins_dict, ModuleType):
+        builtins_dict = vars(builtins_dict)
+
+    stable = dict()
+    for name in sorted(loaded - excluded):
+        try:
+            value = evaldict[name]
+        except KeyError:
+            try:
+                value = builtins_dict[name]
+            except KeyError:
+                # not defined yet
+                continue
+        if isinstance(value, STABLE_GLOBAL_TYPES):
+            stable[name] = value
+    return stable
+
+
+def _bind_as_locals(source, bound):
+    """
+    Inserts a statement at the beginning of the body of the function defined in `source` (after its docstring),
+    assigning the `bound` symbols as local variables from a `_bound_globals_` tuple. Returns the new source and the
+    `factory_vars` to use in `_make`, or the unchanged source and None if the body does not start on its own line.
+
+    :param source:
+    :param bound: a dictionary of symbols to bind
+    :return:
+    """
+    func_def = ast.parse(source).body[0]
+    body = func_def.body
+    if ast.get_docstring(func_def, clean=False) is not None:
+        if len(body) == 1:
+            return source, None
+        body = body[1:]
+
+    lines = source.splitlines(True)
+    first_line = body[0].lineno - 1
+    indent = lines[first_line][:body[0].col_offset]
+    if indent.strip():
+        # for example `def foo(): return 1`
+        return source, None
+
+    lines.insert(first_line, "%s%s, = _bound_globals_\n" % (indent, ', '.join(bound)))
+    return ''.join(lines), dict(_bound_globals_=tuple(bound.values()))
+
+
+class _CompilationCycle(Exception):
+    """
+    Raised internally by compile_fun_manually when a function references (through closures) a function currently
+    being compiled. The reference is skipped, and its name is appended to `names`: once the referenced function is
+    compiled, it is stored in the evaldict under these names, so that the compiled function is found at call time.
+    """
+    def __init__(self, names):
+        super(_CompilationCycle, self).__init__()
+        self.names = names
+
+
+def specialize(f,           # type: Callable
+               **constants  # type: Any
+               ):
+    """
+    Returns a specialized version of function `f`, where arguments are replaced with constant values. Contrary to
+    `partial`, that forwards the preset arguments at each call, the function is compiled again from its source, using
+    the same source access than `compile_fun`:
+
+     - the constant arguments are removed from the signature. The signature is otherwise the one computed by
+       `gen_partial_sig`, so the arguments after the first constant one become keyword-only.
+     - each use of a constant argument with a literal value (`None`, booleans, numbers, strings, bytes and tuples of
+       them) is replaced with this value. Conditions that become constant (`if`, `while`, `... if ... else ...`,
+       comparisons, boolean and unary operators) are evaluated and the dead branches are removed. Other values are
+       assigned to the argument when the function starts.
+
+    ```python
+    from makefun import specialize
+
+    def convert(x, mode, factor=2):
+        if mode == 'double':
+            return x * factor
+        elif mode is None:
+            return x
+        else:
+            raise ValueError(mode)
+
+    double = specialize(convert, mode='double')
+    print(double.__source__)
+    ```
+
+    yields
+
+    ```
+    def convert(x, *, factor=2):
+        return x * factor
+    ```
+
+    The decorators of `f` are not applied to the specialized function. It shares the globals, default values and type
+    hints of `f`. The free variables of `f` (if it is defined in another function) are read when the function is
+    specialized.
+
+    :param f: the function to specialize. Its source must be available.
+    :param constants: the constant value of each argument to remove
+    :return:
+    """
+    if not isinstance(f, FunctionType):
+        raise UnsupportedForCompilation("Only functions can be specialized")
+
+    # (1) the signature without the constant arguments. This validates their names
+    orig_sig = signature(f)
+    for name in constants:
+        p = orig_sig.parameters.get(name)
+        if p is not None and p.kind in (Parameter.VAR_POSITIONAL, Parameter.VAR_KEYWORD):
+            raise ValueError("Cannot specialize variable-length argument %r of %s" % (name, f.__name__))
+    new_sig = gen_partial_sig(orig_sig, (), constants, f)
+    new_sig = new_sig.replace(parameters=[p for p in new_sig.parameters.values() if p.name not in constants])
+    kinds = {p.name: p.kind for p in new_sig.parameters.values()}
+
+    # (2) the definition of the function
+    try:
+        source = _get_function_source(f)
+    except (OSError, IOError) as e:  # noqa # distinct exceptions in old python versions
+        raise SourceUnavailable(f, e)
+    func_def = ast.parse(dedent(source)).body[0]
+    if not isinstance(func_def, (ast.FunctionDef, ast.AsyncFunctionDef)) or func_def.name != f.__name__:
+        raise UnsupportedForCompilation("The source of %s does not define it: %r" % (f.__name__, source))
+    func_def.decorator_list = []
+    func_def.args = _get_specialized_arguments(func_def.args, kinds)
+
+    # (3) substitute the literal constants and remove the dead branches
+    stored = set(_get_bound_names(func_def))
+    literals = {n: v for n, v in constants.items() if n not in stored and _is_literal(v)}
+    is_generator = _has_yield(func_def)
+    func_def = _ConstantFolder(literals).visit(func_def)
+    if is_generator and not _has_yield(func_def):
+        # all `yield` expressions were in dead branches: keep a dead one, so that it remains a generator function
+        func_def.body.append(ast.parse("if False:\n    yield").body[0])
+    others = {n: v for n, v in constants.items() if n not in literals}
+    if others:
+        # after the docstring
+        first = 1 if ast.get_docstring(func_def, clean=False) is not None else 0
+        func_def.body[first:first] = [ast.parse("%s = _constants_[%r]" % (n, n)).body[0] for n in others]
+    ast.fix_missing_locations(func_def)
+    new_source = ast.unparse(func_def) + '\n'
+
+    # (4) compile it. The default values and type hints of `f` are reused as is: they are removed from the compiled
+    # definition, that is executed in a private namespace. The factory variables contain the free variables of `f`
+    func_args = func_def.args
+    func_args.defaults = []
+    func_args.kw_defaults = [None] * len(func_args.kwonlyargs)
+    for a in func_args.posonlyargs + func_args.args + func_args.kwonlyargs + [func_args.vararg, func_args.kwarg]:
+        if a is not None:
+            a.annotation = None
+    func_def.returns = None
+    factory_vars = dict(_constants_=others)
+    if f.__closure__ is not None:
+        for name, cell in zip(f.__code__.co_freevars, f.__closure__):
+            try:
+                factory_vars[name] = cell.cell_contents
+            except ValueError:
+                raise UndefinedSymbolError("Symbol %s does not seem to be defined yet. Make sure you call `specialize`"
+                                           " *after* all required symbols have been defined." % name)
+    compiled = _make(f.__name__, (), ast.unparse(func_def) + '\n', dict(), factory_vars=factory_vars)
+
+    # (5) the function is then created with the globals of `f`
+    new_f = FunctionType(compiled.__code__, f.__globals__, f.__name__, None, compiled.__closure__)
+    annotations, defaults, kwonlydefaults = get_signature_details(new_sig)
+    # the `func` attribute is set as `functools.partial` does
+    _update_fields(new_f, name=f.__name__, qualname=f.__qualname__, doc=f.__doc__, annotations=annotations,
+                   defaults=tuple(defaults), kwonlydefaults=kwonlydefaults, module=f.__module__,
+                   kw=dict(__source__=new_source, func=f))
+    return new_f
+
+
+def _get_specialized_arguments(args, kinds):
+    """
+    Returns the `ast.arguments` of the specialized function: the arguments whose names are in `kinds`, with these
+    kinds. The nodes of the arguments (including their type hints) and of their default values are reused.
+
+    :param args: the `ast.arguments` of the original function
+    :param kinds: the kind of each argument of the specialized function, by name, in order
+    :return:
+    """
+    pos_args = getattr(args, 'posonlyargs', []) + args.args
+    defaults = dict(zip((a.arg for a in pos_args[len(pos_args) - len(args.defaults):]), args.defaults))
+    defaults.update((a.arg, d) for a, d in zip(args.kwonlyargs, args.kw_defaults) if d is not None)
+    nodes = {a.arg: a for a in pos_args + args.kwonlyargs + [args.vararg, args.kwarg] if a is not None}
+
+    new_args = ast.arguments(posonlyargs=[], args=[], vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None,
+                             defaults=[])
+    for name, kind in kinds.items():
+        if kind is Parameter.VAR_POSITIONAL:
+            new_args.vararg = nodes[name]
+        elif kind is Parameter.VAR_KEYWORD:
+            new_args.kwarg = nodes[name]
+        elif kind is Parameter.KEYWORD_ONLY:
+            new_args.kwonlyargs.append(nodes[name])
+            new_args.kw_defaults.append(defaults.get(name))
+        else:
+            (new_args.posonlyargs if kind is Parameter.POSITIONAL_ONLY else new_args.args).append(nodes[name])
+            if name in defaults:
+                new_args.defaults.append(defaults[name])
+    return new_args
+
+
+def _get_bound_names(func_def):
+    """
+    Yields the names that can not be replaced with a constant value in the body of `func_def`: the ones assigned,
+    deleted, declared global or nonlocal, or used as argument names in a nested function, lambda or class.
+
+    :param func_def:
+    :return:
+    """
+    for node in ast.walk(func_def):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            yield node.id
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            for name in node.names:
+                yield name
+        elif isinstance(node, ast.arg):
+            # the constant arguments are not arguments of func_def anymore: this is a nested function or lambda
+            yield node.arg
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node is not func_def:
+            yield node.name
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                yield (alias.asname or alias.name).split('.')[0]
+        elif isinstance(node, ast.ExceptHandler) and node.name is not None:
+            yield node.name
+        elif isinstance(node, _MATCH_CAPTURES):
+            # the capture targets of a `match` statement: `case x`, `case [*rest]`, `case {**rest}`
+            name = node.rest if isinstance(node, _MatchMapping) else node.name
+            if name is not None:
+                yield name
+
+
+def _has_yield(func_def):
+    """
+    Returns True if the body of `func_def` contains a `yield` or `yield from` expression, making it a generator (or
+    asynchronous generator) function. The nested functions, lambdas and classes are not considered.
+
+    :param func_def:
+    :return:
+    """
+    nodes = list(func_def.body)
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, (ast.Yield, ast.YieldFrom)):
+            return True
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            nodes.extend(ast.iter_child_nodes(node))
+    return False
+
+
+# the `match` patterns binding names (python 3.10+)
+_MatchMapping = getattr(ast, 'MatchMapping', ())
+_MATCH_CAPTURES = tuple(getattr(ast, n) for n in ('MatchAs', 'MatchStar', 'MatchMapping') if hasattr(ast, n))
+
+
+# the types of the values that `specialize` substitutes in the source
+LITERAL_TYPES = (type(None), bool, int, float, complex, str, bytes)
+
+
+def _is_literal(value):
+    """Returns True if `value` can be represented by an `ast.Constant` node"""
+    if isinstance(value, tuple):
+        return all(_is_literal(v) for v in value)
+    return type(value) in LITERAL_TYPES
+
+
+class _ConstantFolder(ast.NodeTransformer):
+    """
+    Replaces the names in `constants` with their values, evaluates the expressions that become constant, and removes
+    the branches that can not be executed anymore.
+    """
+    def __init__(self, constants):
+        self.constants = constants
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load) and node.id in self.constants:
+            return ast.copy_location(ast.Constant(value=self.constants[node.id]), node)
+        return node
+
+    def _fold(self, node, evaluate):
+        """Replaces `node` with the result of evaluate() if it is a literal, and if it does not raise an error"""
+        self.generic_visit(node)
+        try:
+            value = evaluate(node)
+        except _NotConstant:
+            return node
+        except Exception:
+            # the error will be raised at runtime, as in the original function
+            return node
+        if not _is_literal(value):
+            return node
+        return ast.copy_location(ast.Constant(value=value), node)
+
+    def visit_UnaryOp(self, node):
+        return self._fold(node, _evaluate)
+
+    def visit_BinOp(self, node):
+        return self._fold(node, _evaluate)
+
+    def visit_BoolOp(self, node):
+        return self._fold(node, _evaluate)
+
+    def visit_Compare(self, node):
+        return self._fold(node, _evaluate)
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.test, ast.Constant):
+            return node.body if node.test.value else node.orelse
+        return node
+
+    def visit_If(self, node):
+        self.generic_visit(node)
+        if isinstance(node.test, ast.Constant):
+            return (node.body if node.test.value else node.orelse) or _pass(node)
+        return node
+
+    def visit_While(self, node):
+        self.generic_visit(node)
+        if isinstance(node.test, ast.Constant) and not node.test.value:
+            return node.orelse or _pass(node)
+        return node
+
+    def generic_visit(self, node):
+        super(_ConstantFolder, self).generic_visit(node)
+        # removing branches may leave a block empty
+        if getattr(node, 'body', None) == []:
+            node.body.append(_pass(node))
+        return node
+
+
+def _pass(node):
+    """Returns a `pass` statement at the location of `node`"""
+    return ast.copy_location(ast.Pass(), node)
+
+
+class _NotConstant(Exception):
+    """Raised by `_evaluate` when an expression is not constant"""
+    pass
+
+
+_UNARY_OPS = {ast.Not: operator.not_, ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Invert: operator.invert}
+_BINARY_OPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+               ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+               ast.BitAnd: operator.and_, ast.BitOr: operator.or_, ast.BitXor: operator.xor,
+               ast.LShift: operator.lshift, ast.RShift: operator.rshift}
+_COMPARE_OPS = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+                ast.Gt: operator.gt, ast.GtE: operator.ge, ast.Is: operator.is_, ast.IsNot: operator.is_not,
+                ast.In: lambda a, b: a in b, ast.NotIn: lambda a, b: a not in b}
+
+
+def _evaluate(node):
+    """
+    Returns the value of the expression `node` if it only contains constants and the operators above. Raises
+    `_NotConstant` otherwise.
+
+    :param node:
+    :return:
+    """
+    if isinstance(node, ast.Constant):
+        return node.value
+    elif isinstance(node, ast.Tuple) and isinstance(node.ctx, ast.Load):
+        return tuple(_evaluate(e) for e in node.elts)
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        return _UNARY_OPS[type(node.op)](_evaluate(node.operand))
+    elif isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        return _BINARY_OPS[type(node.op)](_evaluate(node.left), _evaluate(node.right))
+    elif isinstance(node, ast.BoolOp):
+        # short-circuit as python does: the remaining operands may not be constant
+        for value_node in node.values[:-1]:
+            value = _evaluate(value_node)
+            if isinstance(node.op, ast.And) and not value:
+                return value
+            if isinstance(node.op, ast.Or) and value:
+                return value
+        return _evaluate(node.values[-1])
+    elif isinstance(node, ast.Compare):
+        left = _evaluate(node.left)
+        for op, comparator_node in zip(node.ops, node.comparators):
+            right = _evaluate(comparator_node)
+            if type(op) not in _COMPARE_OPS:
+                raise _NotConstant()
+            if not _COMPARE_OPS[type(op)](left, right):
+                return False
+            left = right
+        return True
+    raise _NotConstant()
+
+
+# The index of the functions defined in each source file, by path: (mtime, lines, {(first line, name): last line})
+_source_index_cache = dict()
+
+# The number of source lines read with `inspect.getsource` in each source file not indexed yet
+_source_lines_read = dict()
+
+
+def _get_function_source(target):
+    """
+    Returns the source code of function `target`, like `inspect.getsource`.
+
+    Parsing a source file to index all the functions it defines by first line and name (the first line of a decorated
+    function is the one of its first decorator, as in its code object) takes about as long as reading the same number
+    of lines with `inspect.getsource`. So `inspect.getsource` is used for isolated lookups, and the file is only
+    indexed once as many lines as it contains were read this way. The index is rebuilt if the file is modified.
+    `inspect.getsource` is still used for the functions that are not found in the index, for example lambda functions.
+
+    :param target:
+    :return:
+    """
+    # as `inspect.getsource`, return the source of the wrapped function if any
+    code = getattr(unwrap(target), '__code__', None)
+    if code is None:
+        return getsource(target)
+
+    path = code.co_filename
+    try:
+        mtime = os.stat(path).st_mtime
+    except (OSError, IOError):  # noqa # distinct exceptions in old python versions
+        return getsource(target)
+
+    try:
+        cached_mtime, lines, index = _source_index_cache[path]
+        if cached_mtime != mtime:
+            raise KeyError(path)
+    except KeyError:
+        source = getsource(target)
+        lines_read = _source_lines_read.get(path, 0) + source.count('\n')
+        if lines_read < len(linecache.getlines(path)):
+            _source_lines_read[path] = lines_read
+        else:
+            _source_lines_read.pop(path, None)
+            _source_index_cache[path] = (mtime,) + _index_source_file(path)
+        return source
+
+    try:
+        last_line = index[(code.co_firstlineno, code.co_name)]
+    except KeyError:
+        return getsource(target)
+    return ''.join(lines[code.co_firstlineno - 1:last_line])
+
+
+def _index_source_file(path):
+    """
+    Parses the source file `path` and returns its lines and a dictionary {(first line, name): last line} of all the
+    functions it defines, including methods and nested functions.
+
+    :param path:
+    :return:
+    """
+    linecache.checkcache(path)
+    lines = linecache.getlines(path)
+    index = dict()
+    try:
+        tree = ast.parse(''.join(lines), path)
+    except (SyntaxError, ValueError):
+        return lines, index
+
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            first_line = node.decorator_list[0].lineno if node.decorator_list else node.lineno
+            index[(first_line, node.name)] = node.end_lineno
+    return lines, index
@@ -0,0 +1,11 @@
+def make_matcher():
+    def matcher(x, mode):
+        match x:
+            case [*mode]:
+                return mode
+            case {'key': 1, **mode}:
+                return mode
+            case int(mode):
+                return mode
+        return mode
+    return matcher
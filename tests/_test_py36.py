@@ -15,3 +15,23 @@ def make_async_generator_wrapper(async_gen_f):
             yield v
 
     return wrapper
+
+
+def make_async_echo_generator():
+    """Returns a new async generator function echoing the values it receives with `asend`, and the type of the
+    exceptions it receives with `athrow`. The list of events is stored in `events`."""
+
+    events = []
+
+    async def echo(first, last=None):
+        received = first
+        try:
+            while received != last:
+                try:
+                    received = yield received
+                except ValueError as e:
+                    received = type(e).__name__
+        finally:
+            events.append('closed')
+
+    return echo, events
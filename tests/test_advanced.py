@@ -5,7 +5,7 @@ import pytest
 
 from makefun.main import get_signature_from_string, with_signature
 
-from makefun import create_wrapper, wraps
+from makefun import create_wrapper, wraps, create_function
 
 try:  # python 3.3+
     from inspect import signature, Signature, Parameter
@@ -260,3 +260,537 @@ def test_type_hint_error_sigchange():
         return a
 
     assert foo(10) == 10
+
+
+def test_compact_metadata():
+    """ Tests that `compact_metadata=True` shares the string attributes between wrappers, but not their `__dict__` """
+
+    def impl1(*args, **kwargs):
+        return args, kwargs
+
+    def impl2(*args, **kwargs):
+        return args, kwargs
+
+    f1 = create_function("foo(a, b=1)", impl1, compact_metadata=True)
+    f2 = create_function("foo(a, b=1)", impl2, compact_metadata=True)
+    f3 = create_function("foo(a, b=2)", impl1, compact_metadata=True)
+
+    # same attribute names and values as usual
+    assert f1.__func_impl__ is impl1
+    assert f2.__func_impl__ is impl2
+    assert f1.__source__ == "def foo(a, b=1):\n    return _func_impl_(a=a, b=b)\n"
+    assert vars(f1) == {'__source__': f1.__source__, '__func_impl__': impl1}
+    assert vars(f2) == {'__source__': f1.__source__, '__func_impl__': impl2}
+
+    # the source is stored once, even for distinct implementations
+    assert f1.__source__ is f2.__source__
+    assert f3.__source__ != f1.__source__
+
+    # and the functions work as usual
+    assert f1(0) == ((), {'a': 0, 'b': 1})
+    assert f3(0) == ((), {'a': 0, 'b': 2})
+
+    # each function has its own dictionary: an attribute set on one function is not set on the others
+    assert f1.__dict__ is not f2.__dict__
+    f1.custom = 1
+    assert not hasattr(f2, 'custom')
+    f4 = create_function("foo(a, b=1)", impl1, compact_metadata=True)
+    assert vars(f4) == {'__source__': f1.__source__, '__func_impl__': impl1}
+
+    # wraps supports it too
+    @wraps(impl1, compact_metadata=True)
+    def g1(*args, **kwargs):
+        return args, kwargs
+
+    @wraps(impl1, compact_metadata=True)
+    def g2(*args, **kwargs):
+        return args, kwargs
+
+    assert g1.__wrapped__ is impl1
+    assert g1.__func_impl__ is not g2.__func_impl__
+    assert g1.__source__ is g2.__source__
+    g1.custom = 1
+    assert not hasattr(g2, 'custom')
+    assert g1(1, b=2) == ((1,), {'b': 2})
+
+
+def test_weak_refs():
+    """ Tests that `weak_refs=True` does not keep the implementation and the wrapped function alive """
+    import gc
+    import weakref
+
+    def foo(a, b=1):
+        return a + b
+
+    def impl(*args, **kwargs):
+        return foo(*args, **kwargs)
+
+    def make_wrapper(f):
+        # note: we do this in a separate frame because on old python versions the caller's `frame.f_locals` is cached
+        return wraps(foo, weak_refs=True)(f)
+
+    bar = make_wrapper(impl)
+
+    # the function works and its attributes can be used as usual
+    assert bar(1) == 2
+    assert bar.__func_impl__(1) == 2
+    assert bar.__wrapped__.__name__ == 'foo'
+    assert str(signature(bar)) == "(a, b=1)"
+
+    # but it does not keep its implementation alive
+    impl_ref = weakref.ref(impl)
+    del impl
+    gc.collect()
+    assert impl_ref() is None
+    with pytest.raises(ReferenceError):
+        bar(1)
+
+    # bound methods are supported: they only die with their object
+    class Counter(object):
+        def add(self, a, b=1):
+            return a + b
+
+    def make_function(m):
+        return create_function("add(a, b=1)", m, weak_refs=True)
+
+    counter = Counter()
+    add = make_function(counter.add)
+    gc.collect()
+    assert add(1) == 2
+    assert add.__func_impl__.__name__ == 'add'
+    del counter
+    gc.collect()
+    with pytest.raises(ReferenceError):
+        add(1)
+
+
+def test_protected_symbols_not_in_globals():
+    """ Tests that the symbols protected in the signature are not stored in the globals of the created function """
+
+    default_logger = logging.getLogger('default')
+
+    def foo(logger=default_logger):
+        pass
+
+    @wraps(foo)
+    def bar(*args, **kwargs):
+        return args, kwargs
+
+    assert 'DEFAULT_logger' not in bar.__globals__
+    assert bar.__defaults__[0] is default_logger
+    assert bar() == ((), {'logger': default_logger})
+
+
+def test_indent_code():
+    """ Tests that the code indentation used to create factories does not modify multi-line tokens """
+    from makefun.main import _indent_code
+
+    assert _indent_code("def foo(a):\n    return a\n") == "    def foo(a):\n        return a\n"
+    assert _indent_code("def foo(a='''\n  b''', c='\\\nd'):\n    return a\n") \
+        == "    def foo(a='''\n  b''', c='\\\nd'):\n        return a\n"
+
+
+def test_caller_namespace_not_retained():
+    """ Tests that the created functions do not keep a copy of the caller's namespace alive """
+    import gc
+    import weakref
+
+    class Foo(object):
+        pass
+
+    def make_function():
+        foo = Foo()
+        f = create_function("bar(a)", lambda a: a)
+        return f, weakref.ref(foo)
+
+    bar, foo_ref = make_function()
+    gc.collect()
+    assert foo_ref() is None
+
+    # the globals of the created function are the ones of the caller module, and `_func_impl_` is a closure variable
+    assert bar.__globals__ is globals()
+    assert bar.__code__.co_freevars == ('_func_impl_',)
+    assert bar(1) == 1
+
+
+class _HintedClass(object):
+    pass
+
+
+@pytest.mark.parametrize("lazy", [False, True], ids="lazy={}".format)
+def test_type_hints_resolved_from_globals(lazy):
+    """ Tests that the forward references in the type hints of created functions can be resolved by get_type_hints """
+    from typing import get_type_hints
+
+    def impl(a: '_HintedClass') -> '_HintedClass':
+        return a
+
+    bar = create_function(signature(impl), impl, lazy=lazy)
+    assert not hasattr(bar, '__wrapped__')
+    assert get_type_hints(bar) == {'a': _HintedClass, 'return': _HintedClass}
+
+
+def test_lazy():
+    """ Tests that `lazy=True` creates functions that are only compiled on first call """
+    from threading import Thread
+
+    def impl(*args, **kwargs):
+        return args, kwargs
+
+    foo = create_function("foo(a, b=1, /, c: int = 2, *args, d, **kwargs) -> int", impl, lazy=True)
+    stub_code = foo.__code__
+
+    # the signature and metadata are correct before the first call
+    assert str(signature(foo)) == "(a, b=1, /, c: int = 2, *args, d, **kwargs) -> int"
+    assert foo.__name__ == foo.__qualname__ == 'foo'
+    assert foo.__defaults__ == (1, 2)
+    assert foo.__annotations__ == {'c': int, 'return': int}
+    # the source does not contain default values nor type hints
+    assert foo.__source__ == "def foo(a, b, /, c, *args, d, **kwargs):\n" \
+                             "    return _func_impl_(a, b, c, *args, d=d, **kwargs)\n"
+
+    # the code is compiled on first call, by a single thread
+    results = []
+    threads = [Thread(target=lambda: results.append(foo(0, d=3))) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [((0, 1, 2), {'d': 3})] * 10
+    assert foo.__code__ is not stub_code
+    assert foo.__code__.co_name == 'foo'
+    with pytest.raises(TypeError):
+        foo(0)
+
+    # `inject_as_first_arg` and `wraps` are supported too
+    bar = create_function("bar(a)", impl, inject_as_first_arg=True, lazy=True)
+    assert bar(1) == ((bar,), {'a': 1})
+    assert bar(1) == ((bar,), {'a': 1})
+
+    def goo(a, b=2):
+        """ hey """
+        return a + b
+
+    @wraps(goo, lazy=True)
+    def goo_wrapper(*args, **kwargs):
+        return goo(*args, **kwargs)
+
+    assert goo_wrapper.__doc__ == goo.__doc__
+    assert str(signature(goo_wrapper)) == "(a, b=2)"
+    assert goo_wrapper(1) == 3
+
+
+def test_lazy_compiled_during_call():
+    """ Tests that a call running the stub while the function is compiled by another call still enforces the
+    signature """
+
+    def impl(*args, **kwargs):
+        return args, kwargs
+
+    foo = create_function("foo(a, b=1)", impl, lazy=True)
+    stub_code = foo.__code__
+    inner_results = []
+
+    def compile_during_stub(frame, event, arg):
+        # the outer call has entered the stub: compile the function before the stub calls anything
+        if event == 'call' and frame.f_code is stub_code and not inner_results:
+            inner_results.append(foo(1))
+
+    sys.settrace(compile_during_stub)
+    try:
+        outer_result = foo(0)
+    finally:
+        sys.settrace(None)
+
+    assert foo.__code__ is not stub_code
+    assert inner_results == [((), {'a': 1, 'b': 1})]
+    assert outer_result == ((), {'a': 0, 'b': 1})
+
+
+def test_wraps_signature_only():
+    """ Tests that `enforce_signature=False` updates the wrapper in place, without generating code """
+
+    def foo(a, b: int = 1):
+        """ hey """
+        return a + b
+
+    def bar(*args, **kwargs):
+        return foo(*args, **kwargs)
+
+    bar._mark = True
+    bar2 = wraps(foo, enforce_signature=False)(bar)
+
+    # no new function is created
+    assert bar2 is bar
+    assert not hasattr(bar, '__source__')
+    for field in ('__module__', '__name__', '__qualname__', '__doc__', '__annotations__'):
+        assert getattr(bar, field) == getattr(foo, field), "field %s is different" % field
+    assert str(signature(bar)) == "(a, b: int = 1)"
+    assert bar.__wrapped__ is foo
+    assert bar._mark is True
+    assert bar(1) == 2
+
+    # the signature is not enforced
+    with pytest.raises(TypeError):
+        bar(1, c=2)
+    with pytest.raises(TypeError):
+        foo(1, c=2)
+
+    # signature changes
+    @wraps(foo, prepend_args="c", enforce_signature=False)
+    def goo(c, *args, **kwargs):
+        return foo(*args, **kwargs)
+
+    assert str(signature(goo)) == "(c, a, b: int = 1)"
+    assert goo.__annotations__ == {'b': int}
+    assert goo(0, 1) == 2
+
+    # inject_as_first_arg creates a closure
+    def impl(f, *args, **kwargs):
+        return f, args, kwargs
+
+    hoo = create_wrapper(foo, impl, inject_as_first_arg=True, enforce_signature=False)
+    assert hoo is not impl
+    assert hoo.__func_impl__ is impl
+    assert str(signature(hoo)) == "(a, b: int = 1)"
+    assert hoo(1) == (hoo, (1,), {})
+
+    # the attributes describing the code generated by makefun are not kept
+    generated = create_function("generated(*args, **kwargs)", impl)
+    ioo = wraps(foo, enforce_signature=False)(generated)
+    assert ioo is generated
+    assert not hasattr(ioo, '__source__')
+    assert not hasattr(ioo, '__func_impl__')
+    assert ioo.__wrapped__ is foo
+
+
+def test_defer_annotations():
+    """Tests that with `defer_annotations=True` the type hints are never evaluated"""
+
+    def impl(*args, **kwargs):
+        return args, kwargs
+
+    # string signature: the type hints are kept as strings, even if they can not be evaluated
+    with pytest.raises(NameError):
+        create_function("foo(a: UndefinedHint, b: int = 1) -> OtherHint", impl)
+
+    foo = create_function("foo(a: UndefinedHint, b: int = 1) -> OtherHint", impl, defer_annotations=True)
+    assert foo.__annotations__ == {'a': 'UndefinedHint', 'b': 'int', 'return': 'OtherHint'}
+    assert str(signature(foo)) == "(a: 'UndefinedHint', b: 'int' = 1) -> 'OtherHint'"
+    assert foo.__source__ == "def foo(a, b=1):\n    return _func_impl_(a=a, b=b)\n"
+    assert foo(0) == ((), dict(a=0, b=1))
+
+    # Signature object: the type hints are not in the generated code, so their repr() is not evaluated
+    class Hint(object):
+        def __repr__(self):
+            raise AssertionError("The hint should not be evaluated")
+
+    hint = Hint()
+    sig = Signature(parameters=[Parameter('a', Parameter.POSITIONAL_OR_KEYWORD, annotation=hint)],
+                    return_annotation='str')
+    goo = create_function(sig, impl, func_name='goo', defer_annotations=True)
+    assert goo.__annotations__ == {'a': hint, 'return': 'str'}
+    assert goo.__source__ == "def goo(a):\n    return _func_impl_(a=a)\n"
+    assert goo(1) == ((), dict(a=1))
+
+    # wraps with a new string signature
+    @wraps(impl, new_sig="(a: UndefinedHint = 0)", defer_annotations=True)
+    def hoo(*args, **kwargs):
+        return impl(*args, **kwargs)
+
+    assert hoo.__annotations__ == {'a': 'UndefinedHint'}
+    assert hoo() == ((), dict(a=0))
+
+
+def test_compact_signature():
+    """Tests that `CompactSignature` can be used instead of `Signature` in all makefun functions"""
+    from makefun import CompactSignature, CompactParameter, add_signature_parameters, remove_signature_parameters
+    from makefun.main import gen_partial_sig
+
+    def foo(a, b: int = 1, *args, c, d=[1], **kwargs) -> str:
+        return a
+
+    sig = signature(foo)
+    csig = CompactSignature.from_signature(sig)
+    assert str(csig) == str(sig)
+    assert repr(csig) == "<CompactSignature %s>" % sig
+    assert csig.to_signature() == sig
+    assert csig == CompactSignature.from_signature(sig)
+    assert csig.parameters['b'] == ('b', Parameter.POSITIONAL_OR_KEYWORD, 1, int)
+
+    with pytest.raises(ValueError):
+        CompactSignature([('a', Parameter.POSITIONAL_OR_KEYWORD), ('a', Parameter.KEYWORD_ONLY)])
+
+    # editing
+    csig2 = add_signature_parameters(csig, first='z', custom=Parameter('o', Parameter.KEYWORD_ONLY, default=True))
+    csig2 = remove_signature_parameters(csig2, 'b', 'd')
+    assert type(csig2) is CompactSignature
+    assert all(type(p) is CompactParameter for p in csig2.parameters.values())
+    assert str(csig2) == "(z, a, *args, c, o=True, **kwargs) -> str"
+    csig3 = gen_partial_sig(CompactSignature.from_signature(signature(lambda a, b, c=1: None)), (1,), dict(c=2), foo)
+    assert type(csig3) is CompactSignature
+    assert str(csig3) == "(b, *, c=2)"
+
+    # function creation: the `Signature` is only created for `__signature__`
+    def impl(*args, **kwargs):
+        return args, kwargs
+
+    gen = create_function(csig2, impl, func_name='gen')
+    assert str(signature(gen)) == str(csig2)
+    assert gen(0, 1, c=2) == ((0, 1), dict(c=2, o=True))
+
+    lazy_gen = create_function(csig2, impl, func_name='gen', lazy=True)
+    assert type(lazy_gen.__signature__) is Signature
+    assert str(signature(lazy_gen)) == str(csig2)
+
+    @wraps(foo, new_sig=CompactSignature.from_signature(sig).replace(return_annotation=int))
+    def bar(*args, **kwargs):
+        return foo(*args, **kwargs)
+
+    assert type(bar.__signature__) is Signature
+    assert str(signature(bar)) == "(a, b: int = 1, *args, c, d=[1], **kwargs) -> int"
+    assert bar(0, c=1) == 0
+
+
+def test_signature_builder():
+    """Tests that `SignatureBuilder` applies all edits at once"""
+    from makefun import SignatureBuilder, CompactSignature, add_signature_parameters
+
+    def foo(a, b, c=1, *, d, **kwargs):
+        pass
+
+    sig = signature(foo)
+    builder = SignatureBuilder(sig)
+    assert builder.remove('b').rename('c', 'e').prepend('y').prepend('x') \
+        .insert(-1, Parameter('z', Parameter.KEYWORD_ONLY, default=0)) is builder
+    new_sig = builder.build()
+    assert type(new_sig) is Signature
+    assert str(new_sig) == "(x, y, a, e=1, *, d, z=0, **kwargs)"
+    assert builder.signature is sig
+
+    # the kinds of parameters given as strings are guessed from their neighbours
+    new_sig = SignatureBuilder(sig).remove('kwargs').prepend('x').append('z').build()
+    assert str(new_sig) == "(x, a, b, c=1, *, d, z)"
+
+    # custom insertions keep the order
+    new_sig = add_signature_parameters(sig, custom=(Parameter('x', Parameter.KEYWORD_ONLY),
+                                                    Parameter('y', Parameter.KEYWORD_ONLY)))
+    assert str(new_sig) == "(a, b, c=1, *, d, x, y, **kwargs)"
+
+    # long lists of parameters
+    many = ['p%s' % i for i in range(2000)]
+    new_sig = SignatureBuilder(CompactSignature.from_signature(sig)).prepend(*many).build()
+    assert type(new_sig) is CompactSignature
+    assert list(new_sig.parameters)[:3] == ['p0', 'p1', 'p2']
+    assert len(new_sig.parameters) == 2005
+
+    # errors
+    with pytest.raises(KeyError):
+        SignatureBuilder(sig).remove('unknown').build()
+    with pytest.raises(ValueError):
+        SignatureBuilder(sig).prepend('a').build()
+    with pytest.raises(ValueError):
+        SignatureBuilder(sig).rename('a', 'b').build()
+    # the removed parameters can be added again
+    assert str(SignatureBuilder(sig).remove('a').prepend('a').build()) == str(sig)
+    assert str(SignatureBuilder(sig).remove('b').insert(1, Parameter('b', Parameter.POSITIONAL_OR_KEYWORD)).build()) \
+        == str(sig)
+
+    # the insertion indices refer to the original signature
+    def bar(a, b, c, d):
+        pass
+
+    x, y = Parameter('x', Parameter.POSITIONAL_OR_KEYWORD), Parameter('y', Parameter.POSITIONAL_OR_KEYWORD)
+    assert str(SignatureBuilder(signature(bar)).insert(1, x).insert(2, y).build()) == "(a, x, b, y, c, d)"
+    assert str(SignatureBuilder(signature(bar)).insert(-1, x).insert(10, y).build()) == "(a, b, c, x, d, y)"
+    assert str(SignatureBuilder(signature(bar)).insert(2, x).insert(2, y).build()) == "(a, b, x, y, c, d)"
+
+
+def test_intern_signature():
+    """Tests that `intern_signature=True` shares identical signatures"""
+    import gc
+    from makefun.main import _interned_signatures
+
+    default = object()
+
+    def make_handler(b_default):
+        def handler(request, a: int = 1, b=b_default):
+            return request, a, b
+        return handler
+
+    def wrapper(user, *args, **kwargs):
+        return args, kwargs
+
+    handlers = [make_handler(default) for _ in range(3)]
+    wrappers = [create_wrapper(h, wrapper, prepend_args='user', intern_signature=True) for h in handlers]
+    sig = wrappers[0].__signature__
+    assert str(sig) == "(user, request, a: int = 1, b=%r)" % default
+    assert all(w.__signature__ is sig for w in wrappers)
+    assert signature(wrappers[1]) is sig
+    assert hash(sig) == hash(signature(wrappers[1]))
+    assert wrappers[2]('u', 'r') == ((), dict(request='r', a=1, b=default))
+
+    # defaults are compared by identity, except simple literals
+    other = create_wrapper(make_handler(object()), wrapper, prepend_args='user', intern_signature=True)
+    assert other.__signature__ is not sig
+    assert other.__signature__ != sig
+
+    # other ways to create functions
+    def impl(request, a, b):
+        return request, a, b
+
+    f1 = create_function("foo(request, a: int = 1, b='hello')", impl, intern_signature=True)
+    f2 = create_function(signature(f1), impl, func_name="bar", intern_signature=True)
+    f3 = create_function(signature(f1), impl, func_name="baz", intern_signature=True, lazy=True)
+    f4 = create_wrapper(f1, impl, intern_signature=True, enforce_signature=False)
+    assert f1.__signature__ is f2.__signature__ is f3.__signature__ is f4.__signature__
+    assert f3('r') == ('r', 1, 'hello')
+
+    # interned signatures are released when they are not used anymore
+    n_interned = len(_interned_signatures)
+    w = create_wrapper(make_handler(object()), wrapper, intern_signature=True)
+    assert len(_interned_signatures) == n_interned + 1
+    del w
+    gc.collect()
+    assert len(_interned_signatures) == n_interned
+
+
+def test_signature_shape_key():
+    """Tests `get_signature_shape_key`, and that lazy functions with the same shape share their code"""
+    from makefun import get_signature_shape_key, CompactSignature
+
+    def foo(a, b=[], *args, c: int = 1, **kwargs):
+        pass
+
+    def bar(a, b={}, *args, c: str = 2, **kwargs):
+        yield
+
+    def baz(a, b, *args, c=1, **kwargs):
+        pass
+
+    key = get_signature_shape_key(signature(foo))
+    assert key == (None, (('a', Parameter.POSITIONAL_OR_KEYWORD, False), ('b', Parameter.POSITIONAL_OR_KEYWORD, True),
+                          ('args', Parameter.VAR_POSITIONAL, False), ('c', Parameter.KEYWORD_ONLY, True),
+                          ('kwargs', Parameter.VAR_KEYWORD, False)))
+    assert hash(key) == hash(get_signature_shape_key(signature(bar)))
+    assert get_signature_shape_key(signature(bar), bar) == ('generator', key[1])
+    assert get_signature_shape_key(signature(baz)) != key
+
+    # the shape is cached on compact signatures
+    csig = CompactSignature.from_signature(signature(foo))
+    assert get_signature_shape_key(csig)[1] is get_signature_shape_key(csig)[1]
+
+    # lazy functions with the same shape share their compiled code
+    def impl(*args, **kwargs):
+        return args, kwargs
+
+    f1 = create_function(signature(foo), impl, func_name='f', lazy=True)
+    f2 = create_function(signature(bar), impl, func_name='f', lazy=True)
+    assert f1(0) == ((0, []), dict(c=1))
+    f3 = create_function(signature(bar), impl, func_name='f', lazy=True)
+    assert f3.__code__.co_code == f1.__code__.co_code
+    assert f2(0) == ((0, {}), dict(c=2))
+    assert f2.__code__.co_code == f1.__code__.co_code
+    # each function has a unique filename though, for profilers
+    assert len({f1.__code__.co_filename, f2.__code__.co_filename, f3.__code__.co_filename}) == 3
+    assert f3(0, c=3) == ((0, {}), dict(c=3))
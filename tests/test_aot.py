@@ -0,0 +1,71 @@
+import sys
+
+import pytest
+
+from makefun import main as makefun_main
+from makefun.aot import generate_aot_module
+
+
+AOT_TEST_MODULE = '''
+from makefun import wraps, create_function, with_signature
+
+
+def foo(a, b=1, *, c="""multi
+line"""):
+    return a + b
+
+
+@wraps(foo)
+def wrapper(*args, **kwargs):
+    return foo(*args, **kwargs)
+
+
+def impl(*args, **kwargs):
+    return args, kwargs
+
+
+created = create_function("created(x, y=[1, 2])", impl)
+
+
+@with_signature("(a, b=2)")
+def decorated(a, b):
+    return a * b
+'''
+
+
+def test_aot(tmp_path, monkeypatch):
+    """Tests that the code generated ahead of time by `makefun.aot` is used instead of compiling the code"""
+    module_name = '_makefun_aot_test_module'
+    (tmp_path / (module_name + '.py')).write_text(AOT_TEST_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    try:
+        output_path = generate_aot_module(module_name)
+        assert output_path == str(tmp_path / (module_name + '_makefun_aot.py'))
+
+        # the module is already imported
+        with pytest.raises(ValueError):
+            generate_aot_module(module_name)
+
+        # import the module again, forbidding runtime compilation
+        del sys.modules[module_name]
+
+        def compile(*args, **kwargs):
+            raise AssertionError("The code should not be compiled")
+
+        monkeypatch.setattr(makefun_main, 'compile', compile, raising=False)
+        import _makefun_aot_test_module as m
+
+        assert m.wrapper(1, 2) == 3
+        assert m.wrapper.__qualname__ == 'foo'
+        assert m.wrapper.__code__.co_filename == output_path
+        assert m.created(0) == ((), dict(x=0, y=[1, 2]))
+        assert m.decorated(3) == 6
+
+        # code that was not generated ahead of time can not be found
+        with pytest.raises(AssertionError):
+            makefun_main.create_function("other(a)", m.impl, evaldict=vars(m))
+    finally:
+        sys.modules.pop(module_name, None)
+        sys.modules.pop(module_name + '_makefun_aot', None)
+        makefun_main._aot_registries.pop(module_name, None)
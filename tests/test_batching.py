@@ -0,0 +1,126 @@
+import asyncio
+from inspect import signature, iscoroutinefunction
+
+import pytest
+
+from makefun import micro_batch
+
+
+def test_micro_batch():
+    """Tests that concurrent calls are processed by batches, and that the per-item signature is preserved"""
+    batches = []
+
+    async def get_users(user_ids, prefixes):
+        batches.append(list(user_ids))
+        await asyncio.sleep(0)
+        return ["%s%s" % (p, i) for i, p in zip(user_ids, prefixes)]
+
+    @micro_batch(get_users, max_size=3, max_delay=0.01)
+    async def get_user(user_id: int, prefix: str = 'user') -> str:
+        """Returns a user"""
+
+    assert str(signature(get_user)) == "(user_id: int, prefix: str = 'user') -> str"
+    assert get_user.__doc__ == "Returns a user"
+    assert iscoroutinefunction(get_user)
+
+    async def main():
+        return await asyncio.gather(*[get_user(i) for i in range(4)], get_user(4, prefix='admin'))
+
+    assert asyncio.run(main()) == ['user0', 'user1', 'user2', 'user3', 'admin4']
+    assert batches == [[0, 1, 2], [3, 4]]
+
+
+def test_micro_batch_errors():
+    """Tests that an error of the batch implementation is raised by all calls of the batch"""
+
+    def get_squares(xs):
+        if 0 in xs:
+            raise ZeroDivisionError()
+        return [x ** 2 for x in xs][:-1]
+
+    @micro_batch(get_squares, max_delay=0)
+    def square(x):
+        pass
+
+    async def main(*xs):
+        return await asyncio.gather(*[square(x) for x in xs], return_exceptions=True)
+
+    res = asyncio.run(main(0, 1))
+    assert all(isinstance(e, ZeroDivisionError) for e in res)
+
+    res = asyncio.run(main(1, 2))
+    assert all(isinstance(e, ValueError) and "returned 1 results for 2 calls" in str(e) for e in res)
+
+    with pytest.raises(ValueError):
+        @micro_batch(get_squares)
+        def foo(*args):
+            pass
+
+
+def test_micro_batch_cancelled():
+    """Tests that the calls of a batch are cancelled when the batch task is cancelled"""
+
+    async def main():
+        started = asyncio.Event()
+
+        async def get_squares(xs):
+            started.set()
+            await asyncio.sleep(10)
+
+        @micro_batch(get_squares, max_delay=0)
+        def square(x):
+            pass
+
+        calls = [asyncio.ensure_future(square(x)) for x in range(3)]
+        await started.wait()
+        batch_tasks = asyncio.all_tasks() - set(calls) - {asyncio.current_task()}
+        assert len(batch_tasks) == 1
+        batch_tasks.pop().cancel()
+        return await asyncio.wait_for(asyncio.gather(*calls, return_exceptions=True), 1)
+
+    res = asyncio.run(main())
+    assert all(isinstance(e, asyncio.CancelledError) for e in res)
+
+
+def test_create_batched():
+    """Tests that create_batched generates a batched function with a column-wise signature"""
+    from typing import List, Sequence
+    from makefun import create_batched
+
+    def convert(a: float, b, unit: str = 'm', *, factor=1) -> float:
+        """converts"""
+        return (a + b) * (1000 if unit == 'km' else 1) * factor
+
+    convert_batch = create_batched(convert)
+    s = signature(convert_batch)
+    assert list(s.parameters) == ['a', 'b', 'unit', 'factor']
+    assert s.parameters['a'].annotation == Sequence[float]
+    assert s.parameters['b'].annotation == Sequence
+    assert s.parameters['unit'].default is None
+    assert s.return_annotation == List[float]
+    assert convert_batch.__name__ == 'convert_batch'
+    assert convert_batch.__doc__ == "converts"
+
+    assert convert_batch([1, 2], (3, 4)) == [4, 6]
+    assert convert_batch([1, 2], [3, 4], ['m', 'km'], factor=[1, 2]) == [4, 12000]
+
+    with pytest.raises(ValueError, match="b has length 1 instead of 2"):
+        convert_batch([1, 2], [3])
+
+
+def test_create_batched_numpy():
+    """Tests that a vectorizable function is called with NumPy arrays directly"""
+    np = pytest.importorskip("numpy")
+    from makefun import create_batched
+
+    calls = []
+
+    def add(a, b=1):
+        calls.append(a)
+        return a + b
+
+    add_batch = create_batched(add, vectorizable=True)
+    assert add_batch([1, 2]) == [2, 3]
+    assert len(calls) == 2
+    assert list(add_batch(np.array([1, 2]), b=[2, 3])) == [3, 5]
+    assert len(calls) == 3
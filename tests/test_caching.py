@@ -0,0 +1,105 @@
+import time
+from inspect import signature
+
+import pytest
+
+from makefun import memoize
+
+
+def test_memoize_key():
+    """Tests that the arguments are bound by name with their defaults applied to build the cache key"""
+    calls = []
+
+    @memoize
+    def foo(a, b=2, *args, c=3, **kwargs):
+        """foo doc"""
+        calls.append(a)
+        return a, b, args, c, kwargs
+
+    assert str(signature(foo)) == "(a, b=2, *args, c=3, **kwargs)"
+    assert foo.__name__ == 'foo'
+    assert foo.__doc__ == "foo doc"
+
+    assert foo(1) == (1, 2, (), 3, {})
+    assert foo(1, 2) == foo(1, b=2) == foo(a=1, c=3) == (1, 2, (), 3, {})
+    assert foo(1, 2, 3, d=4) == foo(1, 2, 3, d=4) == (1, 2, (3,), 3, dict(d=4))
+    assert calls == [1, 1]
+    assert foo.cache_info() == (4, 2, 128, 2)
+
+    foo.cache_clear()
+    assert foo.cache_info() == (0, 0, 128, 0)
+
+    with pytest.raises(TypeError):
+        foo([])
+
+    with pytest.raises(TypeError):
+        @memoize
+        def gen():
+            yield 1
+
+
+@pytest.mark.parametrize("policy, hits, cached", [('lru', 2, [2, 4]),
+                                                  ('lfu', 3, [1, 4])],
+                         ids=str)
+def test_memoize_eviction(policy, hits, cached):
+    """Tests the eviction of the 'lru' and 'lfu' policies"""
+
+    @memoize(maxsize=2, policy=policy)
+    def double(x):
+        return x * 2
+
+    for x in (1, 1, 1, 2, 3, 1, 2, 4):
+        assert double(x) == x * 2
+
+    assert double.cache_info() == (hits, 8 - hits, 2, 2)
+    assert sorted(k[0] for k in double.__closure__[double.__code__.co_freevars.index('_get_')].cell_contents.__self__) \
+        == cached
+
+
+def test_memoize_ttl():
+    """Tests the expiration of the results with the 'ttl' policy"""
+
+    @memoize(maxsize=2, policy='ttl', ttl=0.05)
+    def foo(x):
+        return x
+
+    foo(1)
+    foo(1)
+    time.sleep(0.06)
+    foo(1)
+    assert foo.cache_info() == (1, 2, 2, 1)
+
+
+def test_memoize_ttl_unbounded():
+    """Tests that the expired results are removed from an unbounded cache with the 'ttl' policy"""
+
+    @memoize(maxsize=None, policy='ttl', ttl=0.05)
+    def foo(x):
+        return x
+
+    for x in range(100):
+        foo(x)
+    assert foo.cache_info().currsize == 100
+    time.sleep(0.06)
+    foo(100)
+    assert foo.cache_info() == (0, 101, None, 1)
+
+    with pytest.raises(ValueError):
+        memoize(ttl=1)
+
+
+@pytest.mark.parametrize("policy, maxsize, ttl", [('lru', 128, None), ('lru', None, None), ('lfu', 128, None),
+                                                  ('ttl', 128, 10)], ids=str)
+def test_memoize_exception_context(policy, maxsize, ttl):
+    """Tests that the exceptions raised by the memoized function have no context on a cache miss"""
+
+    @memoize(maxsize=maxsize, policy=policy, ttl=ttl)
+    def foo(x):
+        if x < 0:
+            raise ValueError(x)
+        return x
+
+    assert foo(1) == foo(1) == 1
+    with pytest.raises(ValueError) as exc_info:
+        foo(-1)
+    assert exc_info.value.__context__ is None
@@ -155,6 +155,324 @@ def test_compileclass_decorator():
             pass
 
 
+INDEXED_MODULE = """
+def foo(a):
+    return a + 1
+
+
+class A(object):
+    @staticmethod
+    def bar(a):
+        return foo(a) * 2
+"""
+
+
+def test_compilefun_memo(monkeypatch):
+    """tests that with recurse=True each function is compiled once, even if shared or in a reference cycle"""
+    from makefun import main as makefun_main
+    from makefun.main import compile_fun_manually
+
+    compiled = []
+    _make = makefun_main._make
+
+    def counting_make(funcname, *args, **kwargs):
+        compiled.append(funcname)
+        return _make(funcname, *args, **kwargs)
+
+    monkeypatch.setattr(makefun_main, '_make', counting_make)
+
+    def helper(x):
+        return x + 1
+
+    def ping(n):
+        return pong(n - 1) if n > 0 else helper(n)
+
+    def pong(n):
+        return ping(n - 1) if n > 0 else helper(n)
+
+    def foo(n):
+        return ping(n) + pong(n) + helper(n)
+
+    evaldict = dict(helper=helper, ping=ping, pong=pong)
+    new_foo = compile_fun_manually(foo, _evaldict=evaldict)
+
+    assert sorted(compiled) == ['foo', 'helper', 'ping', 'pong']
+    assert new_foo(3) == foo(3)
+    assert evaldict['ping'].__source__.startswith('def ping(n):')
+
+    # in a cycle the compiled functions call each other, even when the globals are bound as local variables
+    for optimize in (False, True):
+        evaldict = dict(helper=helper, ping=ping, pong=pong)
+        new_ping = compile_fun_manually(ping, optimize=optimize, _evaldict=evaldict)
+        assert evaldict['ping'] is new_ping
+        assert evaldict['pong'].__globals__['ping'] is new_ping
+
+
+def test_compilefun_optimize():
+    """tests that compile_fun(optimize=True) binds the stable global and builtin symbols as local variables"""
+    from makefun.main import compile_fun_manually
+
+    def helper(x):
+        return x + 1
+
+    def foo(items):
+        """foo doc"""
+        global counter
+        counter += 1
+        res = []
+        for i in range(len(items)):
+            res.append(helper(i))
+        return res, dedent, counter, limit, (lambda: abs(-1))()
+
+    evaldict = dict(helper=helper, dedent=dedent, counter=0, limit=10)
+    new_foo = compile_fun_manually(foo, optimize=True, except_names=('dedent',), _evaldict=evaldict)
+
+    # helper, range and len are bound: later changes are not seen. abs is used in a lambda and is not bound.
+    assert new_foo.__code__.co_freevars == ('_bound_globals_',)
+    assert {'helper', 'len', 'range'} <= set(new_foo.__code__.co_varnames)
+    assert 'abs' not in new_foo.__code__.co_varnames
+    evaldict['helper'] = None
+    evaldict['limit'] = 20
+    assert new_foo('ab') == ([1, 2], dedent, 1, 20, 1)
+    assert new_foo.__qualname__ == 'foo'
+    assert new_foo.__doc__ == "foo doc"
+
+    # without optimize, the symbols are looked up at each call
+    new_foo = compile_fun_manually(foo, _evaldict=evaldict)
+    assert new_foo.__code__.co_freevars == ()
+
+
+def test_compilefun_inline():
+    """tests that compile_fun(inline=...) replaces the calls to small helpers with their expressions"""
+    from makefun import UnsupportedForCompilation
+    from makefun.main import compile_fun_manually
+
+    def to_m(x):
+        """converts mm to m"""
+        return x * 0.001
+
+    def clamp(v, lo=0.0, hi=1.0):
+        return max(lo, min(v, hi))
+
+    def twice(v):
+        return v + v
+
+    def foo(values, f):
+        res = []
+        for v in values:
+            res.append((clamp(to_m(v * 2), hi=0.5), twice(v), twice(f(v))))
+        return res
+
+    evaldict = dict(to_m=to_m, clamp=clamp, twice=twice)
+    new_foo = compile_fun_manually(foo, inline=('to_m', 'clamp', 'twice'), _evaldict=evaldict)
+    assert new_foo([100, 1000], abs) == foo([100, 1000], abs) == [(0.2, 200, 200), (0.5, 2000, 2000)]
+
+    # twice(f(v)) is not inlined since f(v) would be evaluated twice
+    assert set(new_foo.__code__.co_names) == {'append', 'max', 'min', 'twice'}
+    assert new_foo.__source__.startswith('def foo(values, f):')
+
+    # a complex argument used in a conditional branch is not inlined, since it may not be evaluated
+    def pick(cond, v):
+        return v if cond else 0
+
+    def both(cond, v):
+        return cond and v
+
+    def qux(flag, record):
+        return pick(flag, record(42)), both(flag, record(43)), pick(record(44), flag)
+
+    records = []
+    new_qux = compile_fun_manually(qux, inline=('pick', 'both'), _evaldict=dict(pick=pick, both=both))
+    assert new_qux(False, records.append) == (0, False, False)
+    assert records == [42, 43, 44]
+    assert set(new_qux.__code__.co_names) == {'pick', 'both'}
+
+    # a complex argument is not inlined after an operation of the expression, that could have side effects
+    def h(f, a):
+        return f('f') + a
+
+    def k(a, f):
+        return a + f('f')
+
+    def quux(step):
+        return h(step, step('arg')), k(step('arg'), step)
+
+    order = []
+
+    def step(name):
+        order.append(name)
+        return 1
+
+    new_quux = compile_fun_manually(quux, inline=('h', 'k'), _evaldict=dict(h=h, k=k))
+    assert new_quux(step) == (2, 2)
+    assert order == ['arg', 'f', 'arg', 'f']
+    assert set(new_quux.__code__.co_names) == {'h'}
+
+    def bar(x):
+        y = x
+        return y
+
+    def baz(x):
+        return bar(x)
+
+    with pytest.raises(UnsupportedForCompilation):
+        compile_fun_manually(baz, inline=('bar',), _evaldict=dict(bar=bar))
+
+
+def test_compilefun_source_index(tmp_path, monkeypatch):
+    """tests that compile_fun reads the sources from an index of the source file once it is used enough"""
+    import inspect
+    import os
+    import sys
+    from makefun import main as makefun_main
+    from makefun.main import compile_fun_manually
+
+    module_name = '_compile_fun_indexed_module'
+    module_path = tmp_path / (module_name + '.py')
+    module_path.write_text(INDEXED_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    try:
+        m = __import__(module_name)
+
+        calls = []
+
+        def getsource(obj):
+            calls.append(obj)
+            return inspect.getsource(obj)
+
+        monkeypatch.setattr(makefun_main, 'getsource', getsource)
+
+        # isolated lookups use getsource
+        foo = compile_fun_manually(m.foo, _evaldict=dict(vars(m)))
+        assert foo.__source__ == "def foo(a):\n    return a + 1\n"
+        assert foo(1) == 2
+        assert calls == [m.foo]
+        assert m.__file__ not in makefun_main._source_index_cache
+
+        # the file is indexed once as many lines as it contains were read
+        for _ in range(3):
+            compile_fun_manually(m.A.bar, _evaldict=dict(vars(m)))
+        assert len(calls) == 4
+        assert m.__file__ in makefun_main._source_index_cache
+        bar = compile_fun_manually(m.A.bar, _evaldict=dict(vars(m)))
+        assert bar.__source__ == "@staticmethod\ndef bar(a):\n    return foo(a) * 2\n"
+        foo = compile_fun_manually(m.foo, _evaldict=dict(vars(m)))
+        assert foo.__source__ == "def foo(a):\n    return a + 1\n"
+        assert len(calls) == 4
+
+        # modify the file: the index is not used anymore
+        module_path.write_text(INDEXED_MODULE.replace("a + 1", "a + 10"))
+        os.utime(str(module_path), (0, 0))
+        foo = compile_fun_manually(m.foo, _evaldict=dict(vars(m)))
+        assert foo.__source__ == "def foo(a):\n    return a + 10\n"
+        assert len(calls) == 5
+    finally:
+        sys.modules.pop(module_name, None)
+
+
+COMPILED_MODULE = """
+from functools import lru_cache
+
+
+def foo(a):
+    return bar(a) + 1
+
+
+def bar(a):
+    def inner(b):
+        return b * 2
+    return inner(a)
+
+
+async def baz():
+    return foo(1)
+
+
+@lru_cache()
+def decorated():
+    return 1
+
+
+def excluded():
+    return 2
+
+
+def redefined():
+    return 3
+
+
+redefined = foo
+"""
+
+
+def test_compile_module(tmp_path, monkeypatch):
+    """tests that compile_module compiles all functions of a module at once"""
+    import sys
+    from makefun import compile_module
+
+    module_name = '_compile_module_module'
+    (tmp_path / (module_name + '.py')).write_text(COMPILED_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    try:
+        m = __import__(module_name)
+        orig_foo, orig_decorated, orig_excluded = m.foo, m.decorated, m.excluded
+
+        compiled = compile_module(module_name, exclude=('excluded',))
+
+        assert sorted(compiled) == ['bar', 'baz', 'foo']
+        assert m.foo is compiled['foo'] and m.foo is not orig_foo
+        assert m.foo.__source__ == "def foo(a):\n    return bar(a) + 1\n"
+        assert m.foo.__code__.co_filename.startswith('<makefun-gen-')
+        # all functions were compiled together, and calls use the compiled functions
+        assert m.foo.__code__.co_filename == m.bar.__code__.co_filename
+        assert m.foo(2) == 5
+        # aliases are not updated
+        assert m.redefined is orig_foo
+        assert m.decorated is orig_decorated
+        assert m.excluded is orig_excluded
+
+        assert compile_module(m, include=('decorated', 'excluded', 'missing')) == dict(excluded=m.excluded)
+    finally:
+        sys.modules.pop(module_name, None)
+
+
+FUTURE_MODULE = """
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from decimal import Decimal
+
+
+def foo(a: Decimal, cache={}) -> Decimal:
+    cache[a] = cache.get(a, 0) + 1
+    return cache[a]
+"""
+
+
+def test_compile_module_future_and_defaults(tmp_path, monkeypatch):
+    """tests that compile_module uses the `__future__` imports and the default values of the module"""
+    import sys
+    from makefun import compile_module
+
+    module_name = '_compile_module_future_module'
+    (tmp_path / (module_name + '.py')).write_text(FUTURE_MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    try:
+        m = __import__(module_name)
+        orig_foo = m.foo
+        assert orig_foo(1) == 1
+
+        compiled = compile_module(m)
+        assert m.foo is compiled['foo'] and m.foo is not orig_foo
+        assert m.foo.__annotations__ == {'a': 'Decimal', 'return': 'Decimal'}
+        assert m.foo.__defaults__[0] is orig_foo.__defaults__[0]
+        assert m.foo(1) == 2
+    finally:
+        sys.modules.pop(module_name, None)
+
+
 # def test_compileclass_decorator():
 #
 #     @compile_fun
@@ -192,3 +192,40 @@ def _test_arguments(params_str, inputs, expected):
     args, kwargs = eval("f(%s)" % inputs, globals(), locals())
 
     assert (args, kwargs) == expected
+
+
+@pytest.mark.parametrize("sig_str, expected", [
+    ("foo(a, b)", ('foo', False)),
+    ("  foo  (a, b)  ", ('foo', False)),
+    ("(a, b):", (None, True)),
+    ("foo(a=(1, 2), b=')', c={'(': [1]})", ('foo', False)),
+    ("foo(a='''\n)''', b=r'\\')') -> Tuple[int, int]", ('foo', False)),
+    ("foo(a) -> f(x):", ('foo', True)),
+    ("foo(b,  # type: (int) -> str\n    a=0,  # type: float\n    ):\n    # type: (...) -> Any", ('foo', True)),
+], ids=repr)
+def test_signature_string_parser(sig_str, expected):
+    """ Tests that the signature string parser finds the function name and the ending colon correctly """
+    from makefun.main import _parse_signature_string, _check_signature_string
+
+    assert _parse_signature_string(sig_str) == expected
+    # same result without the regular expression fast path
+    assert _check_signature_string(sig_str) == expected
+
+
+@pytest.mark.parametrize("sig_str", [
+    "foo",
+    "foo(a, b",
+    "foo(a, b))",
+    "foo(a='b)",
+    "foo(a) ->:",
+    "foo(a) pass",
+    "foo(a): pass",
+    "foo(a):  #",
+    "foo(a=[1)",
+    "foo(a=(1) -> int",
+], ids=repr)
+def test_signature_string_parser_invalid(sig_str):
+    """ Tests that the signature string parser raises a `SyntaxError` on invalid signature strings """
+
+    with pytest.raises(SyntaxError, match="The provided function template is not valid"):
+        create_function(sig_str, lambda *args, **kwargs: None)
@@ -115,3 +115,145 @@ async def test_issue_96():
     # verify that the new function is a native coroutine and behaves correctly
     out = await dynamic_fun(0.1)
     assert out == 0.1
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason="native coroutines with async/await require python3.6 or higher")
+async def test_native_coroutine_fast():
+    """ Tests that `fast_coroutine=True` creates a coroutine function returning the coroutine of its impl """
+
+    from tests._test_py35 import make_native_coroutine_handler
+    my_native_coroutine_handler = make_native_coroutine_handler()
+
+    dynamic_fun = create_function("foo(sleep_time=2)", my_native_coroutine_handler, fast_coroutine=True)
+
+    # it is still a coroutine function for inspect, in all python versions
+    assert iscoroutinefunction(dynamic_fun)
+
+    if sys.version_info >= (3, 12):
+        # a plain function directly returning the coroutine from the impl: no extra await in the body
+        assert dynamic_fun.__source__ == "def foo(sleep_time=2):\n    return _func_impl_(sleep_time=sleep_time)\n"
+    else:
+        # the fast path is not available, it falls back to the default behaviour
+        assert dynamic_fun.__source__.startswith("async def foo(")
+
+    # the arguments are still checked at call time
+    with pytest.raises(TypeError):
+        dynamic_fun(1, 2)
+
+    out = await dynamic_fun(0.1)
+    assert out == 0.1
+
+
+@pytest.mark.skipif(sys.version_info < (3, 6), reason="requires python 3.6 or higher (async generator)")
+@pytest.mark.parametrize("mode", ['create_function', 'lazy', 'partial'], ids="mode={}".format)
+async def test_async_generator_delegation(mode):
+    """ Tests that wrappers of async generators forward `asend`, `athrow` and `aclose` to the implementation """
+
+    from inspect import isasyncgenfunction
+    from makefun import partial
+    from tests._test_py36 import make_async_echo_generator
+
+    echo, events = make_async_echo_generator()
+    if mode in ('create_function', 'lazy'):
+        dynamic_fun = create_function("foo(first, last='stop')", echo, lazy=(mode == 'lazy'))
+        agen = dynamic_fun('hello')
+    else:
+        dynamic_fun = partial(echo, last='stop')
+        agen = dynamic_fun('hello')
+
+    assert isasyncgenfunction(dynamic_fun)
+
+    assert await agen.__anext__() == 'hello'
+    assert await agen.asend('hi') == 'hi'
+    assert await agen.__anext__() is None
+    assert await agen.athrow(ValueError()) == 'ValueError'
+    with pytest.raises(StopAsyncIteration):
+        await agen.asend('stop')
+    assert events == ['closed']
+
+    # same when an exception is thrown before anything is sent
+    agen = dynamic_fun('hello')
+    assert await agen.__anext__() == 'hello'
+    assert await agen.athrow(ValueError()) == 'ValueError'
+    assert await agen.__anext__() is None
+    assert await agen.asend('hi') == 'hi'
+    with pytest.raises(StopAsyncIteration):
+        await agen.asend('stop')
+    assert events == ['closed', 'closed']
+
+    # aclose is forwarded too
+    agen = dynamic_fun('hello')
+    assert await agen.__anext__() == 'hello'
+    await agen.aclose()
+    assert events == ['closed', 'closed', 'closed']
+
+
+def test_generator_fast():
+    """ Tests that `fast_generator=True` creates a function directly returning the generator of its impl """
+
+    def my_gencoroutine_handler(first_msg):
+        second_msg = (yield first_msg)
+        yield second_msg
+
+    dynamic_fun = create_function("foo(first_msg='hello')", my_gencoroutine_handler, fast_generator=True)
+    assert dynamic_fun.__source__ == "def foo(first_msg='hello'):\n    return _func_impl_(first_msg=first_msg)\n"
+
+    # the arguments are checked at call time
+    with pytest.raises(TypeError):
+        dynamic_fun(1, 2)
+
+    # the generator is the one from the implementation, so send() works as usual
+    cor = dynamic_fun('hi')
+    assert cor.gi_code is my_gencoroutine_handler.__code__
+    assert next(cor) == 'hi'
+    assert cor.send('chaps') == 'chaps'
+
+    # inspect does not see it as a generator function, but makefun does: using it as an implementation creates a
+    # proper generator function
+    assert not isgeneratorfunction(dynamic_fun)
+    dynamic_fun2 = create_function("bar(first_msg)", dynamic_fun)
+    assert isgeneratorfunction(dynamic_fun2)
+    assert list(dynamic_fun2('hi')) == ['hi', None]
+
+
+def test_generator_lazy():
+    """ Tests that `lazy=True` creates a generator function checking its arguments when it is called """
+
+    def my_gencoroutine_handler(first_msg):
+        second_msg = (yield first_msg)
+        yield second_msg
+
+    dynamic_fun = create_function("foo(first_msg='hello')", my_gencoroutine_handler, lazy=True)
+    assert isgeneratorfunction(dynamic_fun)
+
+    # generator functions are compiled immediately, so that the arguments are checked when the function is called
+    with pytest.raises(TypeError):
+        dynamic_fun(1, 2)
+
+    for _ in range(2):
+        cor = dynamic_fun()
+        assert next(cor) == 'hello'
+        assert cor.send('chaps') == 'chaps'
+
+    # the compiled code is shared with the next functions with the same shape, but with a unique filename
+    dynamic_fun2 = create_function("foo(first_msg='hi')", my_gencoroutine_handler, lazy=True)
+    assert dynamic_fun2.__code__.co_code == dynamic_fun.__code__.co_code
+    assert dynamic_fun2.__code__.co_filename != dynamic_fun.__code__.co_filename
+    assert list(dynamic_fun2()) == ['hi', None]
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason="native coroutines with async/await require python3.6 or higher")
+async def test_native_coroutine_lazy():
+    """ Tests that `lazy=True` creates a coroutine function, before and after it is compiled """
+
+    from tests._test_py35 import make_native_coroutine_handler
+    my_native_coroutine_handler = make_native_coroutine_handler()
+
+    dynamic_fun = create_function("foo(sleep_time=2)", my_native_coroutine_handler, lazy=True)
+    assert iscoroutinefunction(dynamic_fun)
+    with pytest.raises(TypeError):
+        dynamic_fun(1, 2)
+
+    assert await dynamic_fun(0.1) == 0.1
+    assert await dynamic_fun(0.1) == 0.1
+    assert iscoroutinefunction(dynamic_fun)
@@ -211,3 +211,102 @@ def test_simple_partial_copy(is_generator):
     # the func attribute is there too
     f4 = functools.partial(f1)
     assert f2.func == f4.func
+
+
+def test_specialize():
+    """Tests that `specialize` substitutes the constant arguments and removes the dead branches"""
+
+    factor = 3
+
+    def convert(x, mode, scale=1.0, *, clip=None, log=None):
+        """converts x"""
+        if mode == 'linear' and clip is None:
+            res = x * scale * factor
+        elif mode == 'square':
+            res = x ** 2
+        else:
+            raise ValueError(mode)
+        if log is not None:
+            log.append(res)
+        return res
+
+    linear = makefun.specialize(convert, mode='linear')
+    assert str(signature(linear)) == "(x, *, scale=1.0, clip=None, log=None)"
+    assert linear.__kwdefaults__ == {'scale': 1.0, 'clip': None, 'log': None}
+    assert linear(2, scale=2) == 12
+    assert linear.__doc__ == "converts x"
+    assert linear.__qualname__ == convert.__qualname__
+    assert linear.func is convert
+    assert "mode" not in linear.__source__
+    assert "square" not in linear.__source__
+
+    # a non-literal value is assigned when the function starts
+    log = []
+    square = makefun.specialize(convert, mode='square', log=log)
+    assert str(signature(square)) == "(x, *, scale=1.0, clip=None)"
+    assert square(3) == 9
+    assert log == [9]
+    assert "linear" not in square.__source__
+
+    with pytest.raises(ValueError, match="not present in the signature"):
+        makefun.specialize(convert, foo=1)
+
+
+def test_specialize_namespace_and_defaults():
+    """Tests that `specialize` does not modify the module globals, and reuses the default values of the function"""
+
+    def count(x, mode, cache={}, *, seen=[]):
+        if mode == 'add':
+            cache[x] = cache.get(x, 0) + 1
+        seen.append(x)
+        return cache[x]
+
+    marker = object()
+    globals()['_factory_'] = marker
+    try:
+        names = set(globals())
+        add = makefun.specialize(count, mode='add')
+        assert set(globals()) == names
+        assert globals()['_factory_'] is marker
+    finally:
+        del globals()['_factory_']
+
+    assert add.__globals__ is count.__globals__
+    assert add.__kwdefaults__['cache'] is count.__defaults__[0]
+    assert add.__kwdefaults__['seen'] is count.__kwdefaults__['seen']
+    assert add(1) == 1
+    assert count(1, 'add') == 2
+    assert count.__kwdefaults__['seen'] == [1, 1]
+
+
+def test_specialize_generator():
+    """Tests that `specialize` keeps generator functions generator functions when their yields are removed"""
+    from inspect import isgeneratorfunction
+
+    def gen(x, lazy):
+        if lazy:
+            yield x
+        else:
+            return [x]
+
+    eager = makefun.specialize(gen, lazy=False)
+    assert isgeneratorfunction(eager)
+    with pytest.raises(StopIteration) as exc_info:
+        next(eager(1))
+    assert exc_info.value.value == [1]
+
+    lazy = makefun.specialize(gen, lazy=True)
+    assert list(lazy(1)) == [1]
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="match statement")
+def test_specialize_match_captures():
+    """Tests that `specialize` does not substitute the capture targets of a `match` statement"""
+    from ._test_py310 import make_matcher
+    matcher = make_matcher()
+
+    const = makefun.specialize(matcher, mode='const')
+    assert const(5) == 5
+    assert const([1, 2]) == [1, 2]
+    assert const({'key': 1, 'other': 2}) == {'other': 2}
+    assert const('x') == 'const'